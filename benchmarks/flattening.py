@@ -0,0 +1,78 @@
+"""
+Compares the time it takes to turn records into the tag values to set on
+their objects using get_values and split_values (walking each record) and a
+plan compiled once from the template (compile_plan).
+
+Usage:
+
+    python benchmarks/flattening.py [number of records]
+"""
+import sys
+import time
+from fom.mapping import tag_value
+from flimp.utils import (create_class, get_values, split_values,
+                         compile_plan)
+
+ROOT_PATH = 'test/benchmark'
+
+def make_data(records):
+    """
+    Returns a list of the given number of records
+    """
+    data = list()
+    for i in range(records):
+        data.append({
+            'id': i,
+            'description': 'Record number %d' % i,
+            'food': i % 2 == 0,
+            'cuisine': ['chinese', 'indian', 'thai'],
+            'location': {'lat': 52.160454999999999 + i,
+                         'long': -0.87890599999999997 - i},
+            'scores': [i, i + 1],
+        })
+    return data
+
+def make_class(template):
+    """
+    Returns a FOM class with an attribute for each of the template's values
+    """
+    tags = {}
+    for key in get_values(template, ROOT_PATH):
+        content_type = None
+        if key.endswith('scores'):
+            content_type = 'application/json'
+        tags[key] = tag_value(key, content_type)
+    return create_class(tags)
+
+def walked(klass, data):
+    for item in data:
+        split_values(klass, get_values(item, ROOT_PATH), True)
+
+def compiled(klass, data):
+    plan = compile_plan(klass, ROOT_PATH)
+    for item in data:
+        plan.split(plan.values(item), True)
+
+def timed(label, flatten, klass, data):
+    """
+    Flattens the records with the given function and reports how long it took
+    """
+    start = time.time()
+    flatten(klass, data)
+    duration = time.time() - start
+    print "%-40s %8.3fs %10.0f records/s" % (label, duration,
+                                             len(data) / duration)
+    return duration
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        records = int(sys.argv[1])
+    else:
+        records = 100000
+    data = make_data(records)
+    klass = make_class(data[0])
+    print "Flattening %d records\n" % records
+    current = timed('get_values + split_values (walked)', walked, klass,
+                    data)
+    plan = timed('compile_plan (compiled)', compiled, klass, data)
+    print "\nThe compiled plan is %.1fx faster" % (current / plan)
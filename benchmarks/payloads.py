@@ -0,0 +1,84 @@
+"""
+Compares the time it takes to encode the tag values of records one at a time
+(encode) and through a PayloadCache, for records whose values repeat (country
+codes, flags, ratings and so on) and records whose values are all different
+(which the cache soon stops caching).
+
+Usage:
+
+    python benchmarks/payloads.py [number of records]
+"""
+import sys
+import time
+from flimp.direct import encode, PayloadCache
+
+COUNTRIES = ['GB', 'FR', 'DE', 'US', 'CA', 'JP', 'CN', 'IN', 'BR', 'ZA']
+
+def make_repeated(records):
+    """
+    Returns a list of the given number of records with values that repeat
+    """
+    data = list()
+    for i in range(records):
+        data.append({
+            'country': COUNTRIES[i % len(COUNTRIES)],
+            'open': i % 3 == 0,
+            'rating': i % 5,
+            'price': (i % 4) * 2.5,
+            'category': u'Category %d' % (i % 20),
+            'tags': ['tag%d' % (i % 3), 'tag%d' % (i % 7)],
+        })
+    return data
+
+def make_unique(records):
+    """
+    Returns a list of the given number of records with values that are all
+    different
+    """
+    data = list()
+    for i in range(records):
+        data.append({
+            'id': i,
+            'name': u'Record number %d' % i,
+            'lat': 52.160454999999999 + i,
+            'long': -0.87890599999999997 - i,
+            'code': 'X%08d' % i,
+        })
+    return data
+
+def encoded(data):
+    for item in data:
+        for value in item.itervalues():
+            encode(value)
+
+def cached(data):
+    cache = PayloadCache()
+    for item in data:
+        for column, value in item.iteritems():
+            cache.encode(value, None, column)
+
+def timed(label, encoder, data):
+    """
+    Encodes the records' values with the given function and reports how long
+    it took
+    """
+    start = time.time()
+    encoder(data)
+    duration = time.time() - start
+    print "%-40s %8.3fs %10.0f records/s" % (label, duration,
+                                             len(data) / duration)
+    return duration
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        records = int(sys.argv[1])
+    else:
+        records = 100000
+    for label, make_data in [('repeated', make_repeated),
+                             ('unique', make_unique)]:
+        data = make_data(records)
+        print "Encoding the values of %d records (%s values)\n" % (records,
+                                                                   label)
+        current = timed('encode', encoded, data)
+        cache = timed('PayloadCache', cached, data)
+        print "\nThe cache takes %.2fx the time\n" % (cache / current)
@@ -0,0 +1,56 @@
+"""
+Compares the time it takes to parse a yaml file using parse_yaml.parse (the
+pure Python loader, the whole file at once) and parse_yaml.iterparse (libyaml
+if it's installed, one record at a time).
+
+Usage:
+
+    python benchmarks/yaml_parsers.py [number of records]
+"""
+import sys
+import time
+from StringIO import StringIO
+import yaml
+from flimp.parser import parse_yaml
+
+def make_data(records):
+    """
+    Returns a yaml string containing a list of the given number of records
+    """
+    data = list()
+    for i in range(records):
+        data.append({
+            'id': i,
+            'description': 'Record number %d' % i,
+            'food': i % 2 == 0,
+            'cuisine': ['chinese', 'indian', 'thai'],
+            'location': {'lat': 52.160454999999999 + i,
+                         'long': -0.87890599999999997 - i},
+        })
+    return yaml.dump(data)
+
+def timed(label, parser, raw):
+    """
+    Parses the raw yaml with the given parser and reports how long it took
+    """
+    start = time.time()
+    count = 0
+    for record in parser(StringIO(raw)):
+        count += 1
+    duration = time.time() - start
+    print "%-40s %8.3fs %10.0f records/s" % (label, duration, count / duration)
+    return duration
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        records = int(sys.argv[1])
+    else:
+        records = 20000
+    raw = make_data(records)
+    print "Parsing %d records (%d bytes), libyaml available: %s\n" % (records,
+        len(raw), parse_yaml.CParser is not None)
+    current = timed('parse (pure Python, whole file)', parse_yaml.parse, raw)
+    streamed = timed('iterparse (%s, streamed)' %
+                     parse_yaml.StreamLoader.__name__, parse_yaml.iterparse,
+                     raw)
+    print "\niterparse is %.1fx faster" % (current / streamed)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+An on-disk cache of the namespaces and tags that are known to exist in
+FluidDB so repeated imports into the same schema needn't ask FluidDB again.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+
+logger = logging.getLogger("flimp")
+
+# The default location of the cache
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.flimp_schema_cache')
+
+# By default paths are trusted for a day
+DEFAULT_TTL = 24 * 60 * 60
+
+NAMESPACES = 'namespaces'
+TAGS = 'tags'
+
+class SchemaCache(object):
+    """
+    Remembers the namespace and tag paths that exist in a FluidDB instance
+    (for a particular user) and when they were last seen. A path is only
+    trusted for ttl seconds.
+
+    The cache is kept in a JSON file at path (shared by all instances and
+    users) that is read when the cache is created and written by save.
+
+    Bind the cache (see bind) to have flimp.utils.make_namespace and make_tag
+    use it.
+    """
+
+    # The cache used by flimp.utils (see bind)
+    bound = None
+
+    def __init__(self, path, instance, username, ttl=DEFAULT_TTL):
+        self.path = path
+        self.key = '%s %s' % (instance, username)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.data = {}
+        if os.path.exists(path):
+            f = open(path, 'r')
+            try:
+                try:
+                    self.data = json.load(f)
+                except ValueError:
+                    logger.warning('Ignoring corrupt schema cache %r' % path)
+            finally:
+                f.close()
+        self.paths = self.data.setdefault(self.key, {NAMESPACES: {},
+                                                     TAGS: {}})
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def bind(self):
+        """
+        Makes this the cache used by flimp.utils.
+        """
+        SchemaCache.bound = self
+
+    def known(self, kind, path):
+        """
+        Returns True if the path of the given kind (NAMESPACES or TAGS) is
+        known to exist.
+        """
+        with self.lock:
+            seen = self.paths[kind].get(path)
+            if seen is not None and time.time() - seen < self.ttl:
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, kind, path):
+        """
+        Records that the path of the given kind (NAMESPACES or TAGS) exists.
+        """
+        with self.lock:
+            self.paths[kind][path] = time.time()
+
+    def invalidate(self, path=None):
+        """
+        Forgets the path and everything underneath it (or everything if no
+        path is given).
+        """
+        with self.lock:
+            for paths in self.paths.itervalues():
+                if path is None:
+                    paths.clear()
+                    continue
+                for known in paths.keys():
+                    if known == path or known.startswith(path + '/'):
+                        del paths[known]
+
+    def save(self):
+        """
+        Writes the cache (without the paths that have expired) to disk.
+        """
+        now = time.time()
+        with self.lock:
+            for paths in self.paths.itervalues():
+                for known, seen in paths.items():
+                    if now - seen >= self.ttl:
+                        del paths[known]
+            temp_path = self.path + '.tmp'
+            f = open(temp_path, 'w')
+            try:
+                json.dump(self.data, f)
+            finally:
+                f.close()
+            os.rename(temp_path, self.path)
+
+    def stats(self):
+        """
+        Returns a summary of the cache's statistics.
+        """
+        return 'Schema cache: %d hits, %d misses' % (self.hits, self.misses)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+A compact in-memory representation of a list of records (dictionaries) that
+share the same keys - such as the rows of a CSV file.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+from itertools import izip
+
+class Columns(object):
+    """
+    The names of the columns in a Dataset (in order) and a dict mapping each
+    name to its index. Shared by all the records in the dataset.
+    """
+
+    __slots__ = ('names', 'index')
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.index = dict([(name, index) for index, name in
+                           enumerate(self.names)])
+        if len(self.index) != len(self.names):
+            raise ValueError('Duplicate column names in %r' % (names, ))
+
+class Record(object):
+    """
+    A read-only dictionary-like view onto a row in a Dataset. The column names
+    are shared with the Dataset (and every other Record) so the only thing a
+    record stores is a reference to the tuple of values.
+
+    Supports the usual (read-only) dictionary methods so records can be used
+    wherever flimp expects a dict.
+    """
+
+    __slots__ = ('_columns', '_values')
+
+    def __init__(self, columns, values):
+        # columns is the Columns instance shared with the Dataset
+        self._columns = columns
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._columns.index[key]]
+
+    def __contains__(self, key):
+        return key in self._columns.index
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return dict(self.iteritems()) == dict(other.iteritems())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
+
+    def get(self, key, default=None):
+        if key in self._columns.index:
+            return self[key]
+        return default
+
+    def iterkeys(self):
+        return iter(self._columns.names)
+
+    def itervalues(self):
+        return iter(self._values)
+
+    def iteritems(self):
+        return izip(self._columns.names, self._values)
+
+    def keys(self):
+        return list(self._columns.names)
+
+    def values(self):
+        return list(self._values)
+
+    def items(self):
+        return list(self.iteritems())
+
+class Dataset(object):
+    """
+    A list-like collection of records. Records that have the same keys as the
+    first record (the usual case) are stored as a tuple of values and the
+    keys are only stored once, for the whole dataset. Indexing or iterating
+    returns Record instances for these rows. Any other records (with missing
+    or extra keys) are stored, and returned, as they are so validation still
+    works as expected.
+
+    Use the from_records class method to build a dataset from an iterable of
+    dictionaries.
+    """
+
+    def __init__(self, columns):
+        self._columns = Columns(columns)
+        self._rows = list()
+
+    @property
+    def columns(self):
+        """
+        The names of the columns
+        """
+        return self._columns.names
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Given an iterable of dictionaries will return a new Dataset containing
+        them. The keys of the first record become the columns. Records are
+        consumed one at a time so an iterator (such as a parser's iterparse)
+        never has to be held in memory as a list of dictionaries.
+        """
+        dataset = None
+        for record in records:
+            if dataset is None:
+                dataset = cls(record.keys())
+            dataset.append(record)
+        if dataset is None:
+            raise ValueError('No records found')
+        return dataset
+
+    def append(self, record):
+        """
+        Adds a record (a dictionary) to the dataset.
+        """
+        if len(record) == len(self.columns):
+            try:
+                self._rows.append(tuple([record[name] for name in
+                                         self.columns]))
+                return
+            except KeyError:
+                pass
+        # doesn't fit the columns so keep it as it is
+        self._rows.append(record)
+
+    def _wrap(self, row):
+        if isinstance(row, tuple):
+            return Record(self._columns, row)
+        return row
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            result = Dataset(self.columns)
+            result._rows = self._rows[index]
+            return result
+        return self._wrap(self._rows[index])
+
+    def __iter__(self):
+        for row in self._rows:
+            yield self._wrap(row)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __repr__(self):
+        return '<Dataset %r (%d records)>' % (self.columns, len(self))
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Works out which records and tag values have changed since a dataset was last
+imported (using a local index or by reading what's in FluidDB) so that only
+they need to be pushed.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import sys
+import time
+import shelve
+import hashlib
+import logging
+import threading
+from itertools import islice
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+from fom.session import Fluid
+from flimp.utils import get_values
+from flimp.writers import about_query
+
+logger = logging.getLogger("flimp")
+
+# The default number of records whose values are read with each request
+DEFAULT_BATCH_SIZE = 50
+
+# The delta index is written to disk at least this often (in seconds)
+SYNC_INTERVAL = 1.0
+
+def value_hash(value):
+    """
+    Returns a hash of the (JSON serialisable) value.
+    """
+    return hashlib.sha1(json.dumps(value, sort_keys=True,
+                                   default=repr)).hexdigest()
+
+def index_key(about_value):
+    """
+    Returns the key used to store the about tag value in the index.
+    """
+    if isinstance(about_value, unicode):
+        return about_value.encode('utf-8')
+    return about_value
+
+def record_hash(value_hashes):
+    """
+    Given a dict of tag paths to value hashes returns a hash of the whole
+    record.
+    """
+    return hashlib.sha1(json.dumps(sorted(value_hashes.iteritems()))
+                        ).hexdigest()
+
+class DeltaIndex(object):
+    """
+    Maps the about tag value of each object imported from a dataset to a hash
+    of the record's content and a hash of each of its tag values (stored in a
+    shelve at path).
+
+    Ask the index for the changes to a record before pushing it and update
+    the index once it has been pushed. Only new tag values and those that are
+    different to last time need to be pushed. Tags dropped from a record are
+    not removed from its object.
+
+    The index is written to disk every SYNC_INTERVAL seconds (and when it's
+    closed) so an import that dies only loses the last few entries. It is
+    thread safe and counts the unchanged records and the new and changed
+    records that have been pushed.
+
+    DeltaIndex and RemoteDiff are used in the same way so either can be given
+    to the functions that push records to FluidDB.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = shelve.open(path)
+        self.lock = threading.Lock()
+        self.synced = time.time()
+        # statistics
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+
+    def prefetch(self, records, root_path, about, name, skip=None):
+        """
+        Returns the records (which don't need to be read ahead).
+        """
+        return records
+
+    def changes(self, about_value, tag_values):
+        """
+        Given the about tag value and the tag values of a record (see
+        flimp.utils.get_values) returns a tuple containing a dict of the tag
+        values that are new or have changed (empty if the record hasn't
+        changed) and the entry to pass to update once they've been pushed.
+        """
+        hashes = dict((tag, value_hash(value)) for tag, value in
+                      tag_values.iteritems())
+        entry = (record_hash(hashes), hashes)
+        with self.lock:
+            old = self.db.get(index_key(about_value))
+            if old is None:
+                return dict(tag_values), entry
+            if old[0] == entry[0]:
+                self.unchanged += 1
+                return {}, entry
+        old_hashes = old[1]
+        return dict((tag, value) for tag, value in tag_values.iteritems() if
+                    old_hashes.get(tag) != hashes[tag]), entry
+
+    def update(self, about_value, entry):
+        """
+        Stores the entry (see changes) for the record once it's been pushed.
+        """
+        key = index_key(about_value)
+        with self.lock:
+            if key in self.db:
+                self.changed += 1
+            else:
+                self.new += 1
+            self.db[key] = entry
+            now = time.time()
+            if now - self.synced >= SYNC_INTERVAL:
+                self.db.sync()
+                self.synced = now
+
+    def stats(self):
+        """
+        Returns a summary of the index's statistics.
+        """
+        return '%d new, %d changed and %d unchanged records' % (self.new,
+            self.changed, self.unchanged)
+
+    def close(self):
+        """
+        Writes the index to disk and closes it.
+        """
+        self.db.close()
+
+class RemoteDiff(object):
+    """
+    Works out what has changed in each record by comparing its tag values
+    with those of its object in FluidDB (so no local state is needed).
+
+    The records must be passed through prefetch, which reads them batch_size
+    at a time and fetches the current values of all their objects with a
+    single request. Values FluidDB can't return in bulk (such as JSON values)
+    always count as changed.
+
+    Thread safe and counts the unchanged records and the new and changed
+    records that have been pushed.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, fluid=None):
+        if batch_size < 1:
+            raise ValueError('The batch size must be at least 1')
+        self.batch_size = batch_size
+        self.fluid = fluid or Fluid.bound
+        self.current = {}
+        self.lock = threading.Lock()
+        # statistics
+        self.requests = 0
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+
+    def prefetch(self, records, root_path, about, name, skip=None):
+        """
+        A generator that yields the records after fetching the current values
+        of each batch of them from FluidDB.
+
+        The values of the records skip (if given) returns True for, given
+        their (1-based) position, aren't fetched (such as those a journal says
+        are done) but the records are yielded all the same.
+        """
+        records = iter(records)
+        start = 1
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                break
+            wanted = [item for index, item in enumerate(batch, start) if
+                      not (skip and skip(index))]
+            start += len(batch)
+            if wanted:
+                tags = set()
+                for item in wanted:
+                    tags.update(get_values(item, root_path))
+                self.fetch(["%s:%s" % (name, item[about]) for item in
+                            wanted], tags)
+            for item in batch:
+                yield item
+
+    def fetch(self, about_values, tags):
+        """
+        Fetches the current values of the tags on the objects with the given
+        about values with a single request.
+        """
+        query = ' or '.join(about_query(about_value) for about_value in
+                            about_values)
+        self.requests += 1
+        response = self.fluid.values.get(query, ['fluiddb/about'] +
+                                         sorted(tags))
+        current = {}
+        for values in response.value['results']['id'].itervalues():
+            about_value = values.pop('fluiddb/about')['value']
+            # opaque values only come with their type and size
+            current[about_value] = dict((tag, value['value']) for tag, value
+                                        in values.iteritems() if 'value' in
+                                        value)
+        logger.info('Fetched the values of %d of %d objects' %
+                    (len(current), len(about_values)))
+        with self.lock:
+            self.current.update(current)
+
+    def changes(self, about_value, tag_values):
+        """
+        Given the about tag value and the tag values of a record (see
+        flimp.utils.get_values) returns a tuple containing a dict of the tag
+        values that are new or different to those in FluidDB (empty if none
+        are) and the entry to pass to update once they've been pushed (the
+        name of the statistic to count).
+        """
+        with self.lock:
+            current = self.current.pop(about_value, None)
+            if current is None:
+                return dict(tag_values), 'new'
+            changed = dict((tag, value) for tag, value in
+                           tag_values.iteritems() if tag not in current or
+                           current[tag] != value)
+            if not changed:
+                self.unchanged += 1
+                return changed, None
+        return changed, 'changed'
+
+    def update(self, about_value, entry):
+        """
+        Counts the pushed record as new or changed (FluidDB itself is the
+        record of what was imported).
+        """
+        with self.lock:
+            setattr(self, entry, getattr(self, entry) + 1)
+
+    def stats(self):
+        """
+        Returns a summary of the statistics.
+        """
+        return '%d new, %d changed and %d unchanged records (read with %d'\
+            ' requests)' % (self.new, self.changed, self.unchanged,
+                            self.requests)
+
+    def close(self):
+        """
+        Nothing to close.
+        """
+        pass
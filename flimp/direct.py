@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Sets tag values by sending requests straight to a fom session's transport,
+without going through the FOM class's tag_value descriptors.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import sys
+import urllib
+import logging
+import threading
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+from fom.session import Fluid
+from fom.db import FluidResponse, PRIMITIVE_CONTENT_TYPE
+
+logger = logging.getLogger("flimp")
+
+JSON_CONTENT_TYPE = 'application/json'
+
+# The types fom will send as FluidDB's primitive type
+PRIMITIVE_TYPES = (type(None), bool, int, long, float, basestring)
+
+# The default number of payloads kept by a PayloadCache
+DEFAULT_CACHE_SIZE = 10000
+
+# The number of times a column's values must miss a PayloadCache before it
+# decides whether they're worth caching
+TRIAL_SIZE = 1000
+
+# The types of value (and of the items of lists) that a PayloadCache keeps the
+# payloads of
+CACHED_TYPES = frozenset([type(None), bool, int, long, float, str, unicode])
+
+def quote(part):
+    """
+    Quotes part of a URL's path in the same way as fom.
+    """
+    if isinstance(part, unicode):
+        part = part.encode('utf-8')
+    return urllib.quote(part, safe='')
+
+def encode(value, content_type=None):
+    """
+    Returns a tuple containing the body and MIME type of the request that sets
+    a tag to the value (given the tag's MIME type, if it has one) in the same
+    way as fom.
+    """
+    if content_type:
+        if content_type == JSON_CONTENT_TYPE:
+            return json.dumps(value), content_type
+        return value, content_type
+    if isinstance(value, dict):
+        return json.dumps(value), JSON_CONTENT_TYPE
+    if isinstance(value, (list, tuple)):
+        if not all(isinstance(x, basestring) for x in value):
+            raise ValueError('Non-string in list payload %r.' % (value,))
+    elif not isinstance(value, PRIMITIVE_TYPES):
+        raise ValueError("Can't handle payload %r of type %s" % (value,
+                                                                type(value)))
+    return json.dumps(value), PRIMITIVE_CONTENT_TYPE
+
+class PayloadCache(object):
+    """
+    Remembers the encoded payloads (see encode) of the last size values used
+    so values that come up again and again (country codes, flags and so on)
+    aren't encoded each time. Lists (such as the application/json lists found
+    by flimp.schema.build_schema) are kept under a tuple of their items.
+
+    The least recently used payload is dropped once the cache is full. The
+    payloads are kept in a dict for looking them up and a circular doubly
+    linked list (oldest first) for the order they were used in: each link is
+    a list of [previous link, next link, key, payload]. Moving a link to the
+    end of the list is a handful of assignments, much cheaper than popping
+    and adding it again to an OrderedDict.
+
+    The hits and misses of each column (the tag path) are counted. A miss
+    costs more than encoding the value, so once a column has missed
+    TRIAL_SIZE times and most of its values weren't found its values are no
+    longer cached (see benchmarks/payloads.py).
+
+    The cache can be shared by threads (although the counts may then be a
+    little out).
+    """
+
+    def __init__(self, size=DEFAULT_CACHE_SIZE):
+        self.size = size
+        self.payloads = {}
+        # the first and last links point to this
+        self.root = root = []
+        root[:] = [root, root, None, None]
+        self.lock = threading.Lock()
+        # statistics keyed by column
+        self.hits = {}
+        self.misses = {}
+        # the columns whose values aren't worth caching
+        self.uncached = set()
+
+    def encode(self, value, content_type=None, column=None):
+        """
+        Returns the encoded payload for the value (see encode) of the given
+        column from the cache if it's there.
+        """
+        if column in self.uncached:
+            return encode(value, content_type)
+        value_type = value.__class__
+        if value_type in CACHED_TYPES:
+            key = (value_type, value, content_type)
+        elif value_type is list or value_type is tuple:
+            # the types are part of the key as 1, 1.0 and True are equal
+            items = tuple(value)
+            types = tuple(map(type, items))
+            if CACHED_TYPES.issuperset(types):
+                key = (value_type, items, types, content_type)
+            else:
+                key = None
+        else:
+            key = None
+        if key is not None:
+            with self.lock:
+                link = self.payloads.get(key)
+                if link is not None:
+                    # make it the most recently used
+                    previous, following = link[0], link[1]
+                    previous[1] = following
+                    following[0] = previous
+                    root = self.root
+                    last = root[0]
+                    last[1] = root[0] = link
+                    link[0] = last
+                    link[1] = root
+                    payload = link[3]
+            if link is not None:
+                self.hits[column] = self.hits.get(column, 0) + 1
+                return payload
+        payload = encode(value, content_type)
+        if key is not None:
+            with self.lock:
+                if key not in self.payloads:
+                    root = self.root
+                    last = root[0]
+                    last[1] = root[0] = self.payloads[key] = [last, root, key,
+                                                              payload]
+                    if len(self.payloads) > self.size:
+                        # drop the least recently used
+                        oldest = root[1]
+                        root[1] = oldest[1]
+                        oldest[1][0] = root
+                        del self.payloads[oldest[2]]
+        misses = self.misses[column] = self.misses.get(column, 0) + 1
+        if misses == TRIAL_SIZE and self.hits.get(column, 0) < misses:
+            logger.info('Not caching the payloads of %s (too few repeat)' %
+                        column)
+            self.uncached.add(column)
+        return payload
+
+    def stats(self):
+        """
+        Returns a summary of the cache's statistics with the hit rate of each
+        column.
+        """
+        hits = sum(self.hits.itervalues())
+        total = hits + sum(self.misses.itervalues())
+        lines = ['Payload cache: %d hits, %d misses (%.0f%%)' % (hits,
+                 total - hits, total and 100.0 * hits / total)]
+        for column in sorted(set(self.hits) | set(self.misses)):
+            column_hits = self.hits.get(column, 0)
+            column_total = column_hits + self.misses.get(column, 0)
+            line = '  %s: %.0f%% of %d' % (column,
+                   100.0 * column_hits / column_total, column_total)
+            if column in self.uncached:
+                line += ' (then no longer cached)'
+            lines.append(line)
+        return '\n'.join(lines)
+
+class DirectWriter(object):
+    """
+    Sets the tag values of a FOM class's objects (see
+    flimp.utils.create_class) by sending requests straight to the fluid
+    session's transport (defaults to the bound session) rather than through
+    the class's tag_value descriptors and fom's request machinery. The
+    requests are the same as those fom would send.
+
+    The URL of each tag and the headers for each MIME type are worked out
+    when the writer is created so the session must already be logged in. If
+    a PayloadCache is given the values are encoded with it.
+    """
+
+    def __init__(self, klass, fluid=None, cache=None):
+        self.fluid = fluid or Fluid.bound
+        self.cache = cache
+        db = self.fluid.db
+        self.objects_url = db.base_url + '/objects/'
+        self.values_url = db.base_url + '/values'
+        # the (quoted) path of each tag, its MIME type and its path keyed by
+        # the name of its attribute on the class
+        self.tags = {}
+        content_types = set([PRIMITIVE_CONTENT_TYPE, JSON_CONTENT_TYPE])
+        for attribute, value in klass.__dict__.iteritems():
+            tagpath = getattr(value, 'tagpath', None)
+            if tagpath:
+                path = '/' + '/'.join(quote(part) for part in
+                                      tagpath.split('/'))
+                self.tags[attribute] = (path, value.content_type,
+                                        tagpath)
+                content_types.add(value.content_type)
+        content_types.discard(None)
+        self.headers = {}
+        for content_type in content_types:
+            headers = db.headers.copy()
+            headers['content-type'] = content_type
+            self.headers[content_type] = headers
+        # statistics
+        self.requests = 0
+
+    def send(self, method, url, body, headers, fluid=None):
+        """
+        Sends the request with the fluid session's transport (defaults to the
+        writer's session) and raises the appropriate fom error if it fails.
+        """
+        response = (fluid or self.fluid).db.session.request(method, url,
+                                                            data=body,
+                                                            headers=headers)
+        self.requests += 1
+        if response.status_code >= 400:
+            # let fom raise the error for the response
+            FluidResponse(response, response.text, False)
+        return response
+
+    def set_values(self, uid, tag_values, allowEmpty=True, fluid=None):
+        """
+        Sets the tag values (keyed by attribute name, see
+        flimp.utils.get_values) on the object with the given uid with a
+        request each.
+        """
+        prefix = self.objects_url + quote(uid)
+        tags = self.tags
+        cache = self.cache
+        count = 0
+        for attribute, value in tag_values.iteritems():
+            if value is None and not allowEmpty:
+                continue
+            tag = tags.get(attribute)
+            if tag is None:
+                logger.error('Unable to set %r (unknown attribute)' % attribute)
+                continue
+            path, content_type, tagpath = tag
+            if cache:
+                body, content_type = cache.encode(value, content_type,
+                                                  tagpath)
+            else:
+                body, content_type = encode(value, content_type)
+            self.send('PUT', prefix + path, body, self.headers[content_type],
+                      fluid)
+            count += 1
+        logger.info('Set %d tag values on %r' % (count, uid))
+
+    def put_values(self, uid, values, fluid=None):
+        """
+        Sets the values (in the form FluidDB's /values endpoint expects, see
+        flimp.utils.split_values) on the object with the given uid with a
+        single request.
+        """
+        body = json.dumps({'queries': [['fluiddb/id = "%s"' % uid, values]]})
+        self.send('PUT', self.values_url, body,
+                  self.headers[JSON_CONTENT_TYPE], fluid)
+        logger.info('Set %d tag values on %r' % (len(values), uid))
@@ -36,11 +36,12 @@ else:
     import json
 from fom.mapping import Object
 from flimp.utils import make_namespace, make_tag, make_namespace_path
+from flimp import green
 
 logger = logging.getLogger("flimp")
 
 def process(root_dir, fluiddb_path, name, desc, uuid=None, about=None,
-            preview=None):
+            preview=None, use_green=False):
     """
     Given a root directory will import the contents of the filesystem therein
     into FluidDB. Directories -> Namespaces, Files -> Tags, File-contents ->
@@ -62,6 +63,9 @@ def process(root_dir, fluiddb_path, name, desc, uuid=None, about=None,
     about - the fluiddb/about tag value of the object to be tagged
 
     preview - If true, will print out a preview and not import the data
+
+    use_green - If true, will push the files using green threads (see
+    flimp.green)
     """
     logger.info('Directory: %r' % root_dir)
     abs_path = os.path.abspath(root_dir)
@@ -85,7 +89,8 @@ def process(root_dir, fluiddb_path, name, desc, uuid=None, about=None,
         logger.info(result)
         print result
     else:
-        return push_to_fluiddb(abs_path, fluiddb_path, name, desc, uuid, about)
+        return push_to_fluiddb(abs_path, fluiddb_path, name, desc, uuid, about,
+                               use_green)
 
 def get_preview(directory, fluiddb_path):
     """
@@ -117,7 +122,7 @@ def get_preview(directory, fluiddb_path):
     return tag_paths
 
 def push_to_fluiddb(directory, fluiddb_path, name, desc, uuid=None,
-                    about=None):
+                    about=None, use_green=False):
     """
     Pushes the contents of the specified directory as tag-values on a
     specified object (if no uuid is given then it'll create a new object).
@@ -136,6 +141,9 @@ def push_to_fluiddb(directory, fluiddb_path, name, desc, uuid=None,
     uuid - the UUID to identify the object to be tagged
 
     about - the fluiddb/about tag value of the object to be tagged
+
+    use_green - If true, will push the files using green threads (see
+    flimp.green)
     """
     # get the object we'll be using
     obj = get_object(uuid, about)
@@ -143,6 +151,8 @@ def push_to_fluiddb(directory, fluiddb_path, name, desc, uuid=None,
     # make sure we have the appropriate "fluidinfo_path" based namespaces
     # underneath the user's root namespace
     root_namespace = make_namespace_path(fluiddb_path, name, desc)
+    if use_green:
+        return green.push_directory(obj, directory, root_namespace, name, desc)
 
     # iterate over the filesystem creating the namespaces and tags (where
     # appropriate) and adding the tag value to the object
@@ -27,69 +27,272 @@ THE SOFTWARE.
 import sys
 import os
 import logging
+import gzip
+import bz2
+import random
+from itertools import islice
 if sys.version_info < (2, 6):
     import simplejson as json
 else:
     import json
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        # No xz support
+        lzma = None
 from flimp.utils import process_data_list, validate
-from flimp.parser import parse_json, parse_yaml, parse_csv
+from flimp.dataset import Dataset
+from flimp import green, writers, pipeline as pipelines
+from flimp.parser import parse_json, parse_jsonl, parse_yaml, parse_csv
 
 VALID_FILETYPES = {
     '.json': parse_json,
+    '.jsonl': parse_jsonl,
+    '.ndjson': parse_jsonl,
     '.csv': parse_csv,
     '.yaml': parse_yaml
 }
 
+# Compressed files are recognised by a compound extension (e.g. data.csv.gz)
+# and decompressed as they are read by the parser
+COMPRESSED_FILETYPES = {
+    '.gz': gzip.GzipFile,
+    '.bz2': bz2.BZ2File,
+}
+if lzma:
+    COMPRESSED_FILETYPES['.xz'] = lzma.LZMAFile
+
+# The number of records read from the file to generate a preview
+PREVIEW_RECORDS = 1000
+
 logger = logging.getLogger("flimp")
 
 def process(filename, root_path, name, desc, about, preview=False,
-            check=False, allowEmpty=True):
+            check=False, allowEmpty=True, stream=False, processes=None,
+            compact=False, sample=None, random_sample=False, workers=1,
+            use_green=False, bulk=False, batch_size=None,
+            flush_interval=None, journal=None, delta=None, direct=False,
+            payload_cache=None, pipeline=None, transform_workers=1):
     """
     The recipe for grabbing the file and pushing it to FluidDB
+
+    A preview only reads the first PREVIEW_RECORDS records of the file (the
+    total number of records is estimated if there are more).
+
+    If stream is True the records are parsed and pushed one at a time rather
+    than being read into memory all at once.
+
+    If processes is given (and the parser supports it) the file is parsed in
+    parallel by that many processes.
+
+    If compact is True (and stream isn't) the records are held in a compact
+    flimp.dataset.Dataset rather than a list of dictionaries.
+
+    If sample is given a check only validates that many records: the first
+    ones in the file or, if random_sample is True, a random sample of the
+    whole file. The number of problems is extrapolated to the whole file.
+
+    If workers is more than 1 the records are pushed to FluidDB concurrently by
+    that many worker threads. If use_green is True they are pushed using
+    green threads instead (see flimp.green). If bulk is True each record's
+    tag values are set with a single request. If direct is True (and neither
+    use_green nor batch_size is given) the tag values are sent straight to
+    FluidDB (see flimp.direct.DirectWriter), encoded using payload_cache (see
+    flimp.direct.PayloadCache) if it's given.
+
+    If a pipeline (see flimp.pipeline.Pipeline) is given the file is parsed
+    while the records are checked (by transform_workers threads) and pushed
+    (by workers threads) at the same time (see flimp.pipeline).
+
+    If batch_size is given the tag values of that many records are set with
+    each request (see flimp.writers.BatchWriter), with a batch sent at least
+    every flush_interval seconds (if given).
+
+    If a journal (see flimp.journal.Journal) is given the records that have
+    already been imported are skipped and those imported now are recorded in
+    it.
+
+    If a delta index (see flimp.delta.DeltaIndex or RemoteDiff) is given only
+    the records and tag values that have changed since the last import are
+    pushed.
     """
-    # Turn the raw input file into a list data structure containing the items
-    # to import into FluidDB
-    raw_data = clean_data(filename)
-    number_of_records = len(raw_data)
     logger.info('Raw filename: %r' % filename)
     logger.info('Root namespace path: %r' % root_path)
     logger.info('About tag field key: %r' % about)
-    logger.info('%d records found' % number_of_records) 
-
-    if preview or check:
-        if preview:
-            # just print out/log a preview
-            logger.info('Generating preview...')
-            output = list()
-            output.append("Preview of processing %r\n" % filename)
-            output.append("The following namespaces/tags will be generated.\n")
-            output.extend(get_preview(raw_data, root_path))
-            output.append("\n%d records will be imported into FluidDB\n" %
-                          number_of_records)
+
+    if preview:
+        # just print out/log a preview based on the first few records
+        logger.info('Generating preview...')
+        records, total, exact = sample_data(filename, PREVIEW_RECORDS)
+        output = list()
+        output.append("Preview of processing %r\n" % filename)
+        output.append("The following namespaces/tags will be generated.\n")
+        output.extend(get_preview(records, root_path))
+        output.append("\n%s records will be imported into FluidDB\n" %
+                      describe_total(len(records), total, exact))
+        result = "\n".join(output)
+        logger.info(result)
+        return result
+    elif check and sample:
+        # check a sample of the file and extrapolate the results
+        logger.info('Validating a sample of %d records from %r\n' %
+                    (sample, filename))
+        records, total, exact = sample_data(filename, sample, random_sample)
+        output = list()
+        errors, warnings, problems = validate(records, True)
+        if errors:
+            output.append("The following ERRORS were found:\n")
+            output.extend(errors)
+            output.append('\n')
+        if warnings:
+            output.append("The following WARNINGS were generated:\n")
+            output.extend(warnings)
+            output.append('\n')
+        checked = "a sample of %d of %s records" % (len(records),
+            describe_total(len(records), total, exact).lower())
+        if problems:
+            output.append("Checked %s: %d (%.1f%%) had problems" % (checked,
+                          problems, 100.0 * problems / len(records)))
+            if total is not None:
+                output.append("Estimated number of records with problems:"
+                              " %d" % round(float(problems) * total /
+                                            len(records)))
             result = "\n".join(output)
-            logger.info(result)
-            return result
         else:
-            # check the file and display the results
-            logger.info('Validating %r\n' % filename)
-            output = list()
-            errors, warnings = validate(raw_data)
-            if errors:
-                output.append("The following ERRORS were found:\n")
-                output.extend(errors)
-                output.append('\n')
-            if warnings:
-                output.append("The following WARNINGS were generated:\n")
-                output.extend(warnings)
-            if output:
-                result = "\n".join(output)
-            else:
-                result = "Validation passed ok"
-            logger.info(result)
-            return result
+            result = "Validation passed ok (checked %s)" % checked
+        logger.info(result)
+        return result
+
+    # Turn the raw input file into a list data structure containing the items
+    # to import into FluidDB (or an iterator over them when streaming)
+    if pipeline and not check:
+        # the pipeline reads the records as they are parsed
+        stream = True
+    raw_data = clean_data(filename, stream, processes, compact)
+    if stream:
+        logger.info('Streaming records')
+    else:
+        logger.info('%d records found' % len(raw_data))
+
+    if check:
+        # check the file and display the results
+        logger.info('Validating %r\n' % filename)
+        output = list()
+        errors, warnings = validate(raw_data)
+        if errors:
+            output.append("The following ERRORS were found:\n")
+            output.extend(errors)
+            output.append('\n')
+        if warnings:
+            output.append("The following WARNINGS were generated:\n")
+            output.extend(warnings)
+        if output:
+            result = "\n".join(output)
+        else:
+            result = "Validation passed ok"
+        logger.info(result)
+        return result
+    else:
+        if batch_size:
+            number_of_records = writers.process_data_list(raw_data, root_path,
+                name, desc, about, allowEmpty, batch_size, flush_interval,
+                journal, delta)
+        elif pipeline:
+            number_of_records = pipelines.process_data_list(raw_data,
+                root_path, name, desc, about, allowEmpty, pipeline,
+                transform_workers, workers, bulk, journal, delta, direct,
+                payload_cache)
+        elif use_green:
+            number_of_records = green.process_data_list(raw_data, root_path,
+                name, desc, about, allowEmpty, bulk, journal, delta)
+        else:
+            number_of_records = process_data_list(raw_data, root_path, name,
+                desc, about, allowEmpty, workers, bulk=bulk, journal=journal,
+                delta=delta, direct=direct, payload_cache=payload_cache)
+        result = "Processed %d records" % number_of_records
+        if journal and journal.skipped:
+            result += (" (skipped %d imported by an earlier run)" %
+                       journal.skipped)
+        if delta:
+            result += "\nDelta: %s" % delta.stats()
+        if payload_cache:
+            result += "\n%s" % payload_cache.stats()
+        if pipeline:
+            result += "\n%s" % pipeline.stats()
+        return result
+
+def sample_data(filename, size, random_sample=False):
+    """
+    Reads a sample of (at most) size records from the referenced file without
+    parsing the whole thing (unless random_sample is True). Returns a tuple
+    containing:
+
+    * a list of the sampled records - the first record in the file is always
+      the first item (since it's used as the template)
+    * the total number of records in the file (estimated from how far through
+      the file we got when only the first records were read) or None if it
+      can't be worked out
+    * a flag to indicate if the total is exact
+
+    If random_sample is True the whole file is read (one record at a time) and
+    the sample is chosen at random by reservoir sampling.
+    """
+    parser, f = open_file(filename)
+    records = stream_data(parser, f)
+    try:
+        if random_sample:
+            result = list(islice(records, 1))
+            reservoir = list()
+            total = len(result)
+            for record in records:
+                total += 1
+                if len(reservoir) < size - 1:
+                    reservoir.append(record)
+                else:
+                    index = random.randint(0, total - 2)
+                    if index < size - 1:
+                        reservoir[index] = record
+            result.extend(reservoir)
+            return result, total, True
+        result = list(islice(records, size))
+        if not list(islice(records, 1)):
+            # we read the whole file
+            return result, len(result), True
+        return result, estimate_total(f, len(result) + 1), False
+    finally:
+        records.close()
+
+def estimate_total(f, count):
+    """
+    Given a (partially read) file and the number of records that have been
+    read from it will estimate the total number of records in the file based
+    upon how far through the file we are. Returns None if the size of the
+    file or the position within it can't be found (e.g. for bz2 files).
+    """
+    # compressed files keep the actual file in fileobj (e.g. gzip)
+    raw_file = getattr(f, 'fileobj', f)
+    if not isinstance(raw_file, file):
+        return None
+    position = raw_file.tell()
+    size = os.fstat(raw_file.fileno()).st_size
+    if not position:
+        return None
+    return max(count, int(round(float(count) * size / position)))
+
+def describe_total(count, total, exact):
+    """
+    Returns a description of the total number of records given the results
+    of sample_data and the number of records that were sampled.
+    """
+    if exact:
+        return "%d" % total
+    elif total is None:
+        return "More than %d" % count
     else:
-        process_data_list(raw_data, root_path, name, desc, about, allowEmpty)
-        return "Processed %d records" % number_of_records
+        return "About %d" % total
 
 def get_preview(raw_data, root_path):
     """
@@ -117,20 +320,92 @@ def traverse_preview(template, parent, tags):
             logger.info('Found tag: %r' % key)
             tags.append('/'.join([parent, key]))
 
-def clean_data(filename):
+def clean_data(filename, stream=False, processes=None, compact=False):
     """
     Given a filename will open it and pass it to the appropriate parser to
     turn it into a dictionary object for further processing
+
+    If stream is True a generator is returned that yields the records one at a
+    time as they are parsed (rather than a list of all of them).
+
+    Compressed files (e.g. data.csv.gz) are decompressed on the fly.
+
+    If processes is given and the parser is able to, the file is parsed in
+    parallel by that many processes (compressed files are always parsed by a
+    single process).
+
+    If compact is True (and stream isn't) the records are returned in a
+    flimp.dataset.Dataset which uses much less memory than a list of
+    dictionaries.
+    """
+    parser, f = open_file(filename)
+    records = None
+    if processes and hasattr(parser, 'iterparse_parallel'):
+        if isinstance(f, file):
+            f.close()
+            logger.info('Parsing %r with %d processes' % (filename,
+                                                          processes))
+            records = parser.iterparse_parallel(filename,
+                                                processes=processes)
+        else:
+            logger.warning('Unable to parse compressed file %r in parallel' %
+                           filename)
+    if stream:
+        logger.info('Streaming %r' % filename)
+        if records is None:
+            records = stream_data(parser, f)
+        return records
+    elif compact:
+        logger.info('Parsing %r into a compact dataset' % filename)
+        if records is None:
+            records = stream_data(parser, f)
+        return Dataset.from_records(records)
+    elif records is not None:
+        return list(records)
+    else:
+        logger.info('Parsing %r' % filename)
+        try:
+            result = parser.parse(f)
+        finally:
+            f.close()
+        return result
+
+def open_file(filename):
     """
-    extension = os.path.splitext(filename)[1]
+    Given a filename will return a tuple containing the parser to use for it
+    (based upon the file's extension) and the opened file. If the file has
+    been compressed (e.g. data.json.bz2) the returned file object will
+    decompress the data as it is read.
+    """
+    root, extension = os.path.splitext(filename)
+    if extension in COMPRESSED_FILETYPES:
+        opener = COMPRESSED_FILETYPES[extension]
+        mode = 'rb'
+        logger.info('Decompressing %r' % extension)
+        extension = os.path.splitext(root)[1]
+    else:
+        opener = open
+        mode = 'r'
     try:
         parser = VALID_FILETYPES[extension]
     except KeyError:
         raise TypeError('Unknown file extension %r to parse' % extension)
-    else:
-        f = open(filename, 'r')
-        logger.info('Parsing %r' % extension)
-        result = parser.parse(f)
-        f.close()
-        return result
+    return parser, opener(filename, mode)
+
+def stream_data(parser, f):
+    """
+    A generator that yields the records in the file f one at a time.
+    Parsers that provide an iterparse function are used incrementally,
+    otherwise we fall back to iterating over the list returned by parse.
 
+    The file is closed once the generator is exhausted (or closed).
+    """
+    try:
+        if hasattr(parser, 'iterparse'):
+            records = parser.iterparse(f)
+        else:
+            records = parser.parse(f)
+        for record in records:
+            yield record
+    finally:
+        f.close()
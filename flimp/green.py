@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Imports data into FluidDB using gevent's green threads (coroutines) rather
+than blocking on each request in turn. Object creation and tag-value writes
+each run in their own greenlet so a single process can keep hundreds of
+requests in flight, with a global limit on how many there are at any one time.
+
+gevent is an optional dependency. Call patch() (as early as possible) before
+using any of the other functions in this module.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import os
+import logging
+from mimetypes import guess_type
+try:
+    import gevent
+    from gevent import monkey
+    from gevent.pool import Pool
+    from gevent.lock import BoundedSemaphore
+except ImportError:
+    # No green thread support
+    gevent = None
+from flimp.utils import (prepare_import, make_object, compile_plan,
+                         set_tag_value, set_tag_values, make_namespace,
+                         make_tag)
+
+logger = logging.getLogger("flimp")
+
+# The default maximum number of requests to FluidDB in flight at any one time
+DEFAULT_CONCURRENCY = 100
+
+# The maximum number of requests in flight (set by patch) and the semaphore
+# each request must hold - shared by all the green imports in this process
+concurrency = None
+limit = None
+
+def patch(max_requests=DEFAULT_CONCURRENCY):
+    """
+    Monkey patches the standard library so the blocking network calls made by
+    fom yield to other greenlets instead of blocking the whole process and
+    sets the global limit on the number of requests to FluidDB that may be in
+    flight at any one time.
+
+    gevent should patch the standard library before anything else (fom,
+    requests, ssl, threading...) is imported. bin/flimp does that first
+    thing, as your own code should (with gevent.monkey.patch_all), and this
+    only patches it if that hasn't already been done.
+
+    Raises an ImportError if gevent isn't installed.
+    """
+    global concurrency, limit
+    if gevent is None:
+        raise ImportError('gevent is required to import data using green'
+                          ' threads')
+    if max_requests < 1:
+        raise ValueError('There must be at least one request in flight')
+    if not monkey.is_module_patched('socket'):
+        logger.warning('Patching the standard library for gevent after'
+                       ' modules that use it have been imported')
+        monkey.patch_all()
+    concurrency = max_requests
+    limit = BoundedSemaphore(max_requests)
+
+def check_patched():
+    """
+    Raises a RuntimeError if patch() hasn't been called.
+    """
+    if limit is None:
+        raise RuntimeError('Call flimp.green.patch() before importing data'
+                           ' using green threads')
+
+def process_data_list(raw_data, root_path, name, desc, about, allowEmpty=True,
+                      bulk=False, journal=None, delta=None):
+    """
+    The green equivalent of flimp.utils.process_data_list: creates the
+    required tags and namespaces and the FOM class and then uses
+    push_to_fluiddb (below) to push the data to FluidDB.
+
+    Returns the number of records that were processed.
+    """
+    check_patched()
+    fom_class, records = prepare_import(raw_data, root_path, name, desc)
+    logger.info('Starting to push records to FluidDB (with at most %d'
+                ' requests in flight)' % concurrency)
+    return push_to_fluiddb(records, root_path, fom_class, about, name,
+                           allowEmpty, bulk, journal, delta)
+
+def push_to_fluiddb(raw_data, root_path, klass, about, name, allowEmpty=True,
+                    bulk=False, journal=None, delta=None):
+    """
+    The green equivalent of flimp.utils.push_to_fluiddb. Each record is pushed
+    by its own greenlet which creates the object and then spawns a greenlet
+    to write each of the record's tag values. No more than the global limit of
+    records are being pushed, and requests made, at any one time.
+
+    If bulk is True the record's tag values are all written by a single
+    greenlet (see flimp.utils.set_tag_values).
+
+    If a journal (see flimp.journal.Journal) is given the records it says are
+    done are skipped and the others are recorded in it once they've been
+    pushed. If a delta index (see flimp.delta.DeltaIndex or RemoteDiff) is
+    given only the records and tag values that have changed since the last
+    import are pushed.
+
+    A record that fails doesn't stop the others but a RuntimeError is raised
+    once they have all been pushed.
+
+    Returns the number of records that were processed.
+    """
+    check_patched()
+    if delta and not about:
+        raise ValueError('Only records with an about tag value can be'
+                         ' imported as a delta')
+    if delta:
+        raw_data = delta.prefetch(raw_data, root_path, about, name,
+                                  journal and journal.imported)
+    # the records being pushed hold a place in the pool but only the requests
+    # themselves hold the (global) limit, so a record waiting for its tag
+    # values to be written can't starve them
+    pool = Pool(concurrency)
+    failed = []
+    plan = compile_plan(klass, root_path)
+
+    def push(index, item):
+        try:
+            tag_values = plan.values(item)
+            if delta:
+                about_value = "%s:%s" % (name, item[about])
+                tag_values, entry = delta.changes(about_value, tag_values)
+            if tag_values or not delta:
+                uid = push_values(item, tag_values)
+                logger.info('Record %d pushed to object %r' % (index, uid))
+                if delta:
+                    delta.update(about_value, entry)
+            if journal:
+                journal.record(index)
+        except Exception, e:
+            logger.error('Record %d failed: %r' % (index, e))
+            failed.append(index)
+
+    def push_values(item, tag_values):
+        with limit:
+            obj = make_object(item, klass, about, name)
+        if bulk:
+            writes = [gevent.spawn(write_all, obj, tag_values)]
+        else:
+            writes = [gevent.spawn(write, obj, key, value) for key, value in
+                      tag_values.iteritems()]
+        gevent.joinall(writes, raise_error=True)
+        return obj.uid
+
+    def write(obj, key, value):
+        with limit:
+            set_tag_value(klass, obj, key, value, allowEmpty)
+
+    def write_all(obj, tag_values):
+        with limit:
+            set_tag_values(klass, obj, tag_values, allowEmpty, plan)
+
+    counter = 0
+    for counter, item in enumerate(raw_data, 1):
+        if journal and journal.done(counter):
+            continue
+        # blocks while the pool is full
+        pool.spawn(push, counter, item)
+    pool.join()
+    if failed:
+        raise RuntimeError('%d of %d records failed to import (see the log'
+                           ' for details)' % (len(failed), counter))
+    return counter
+
+def push_directory(obj, directory, root_namespace, name, desc):
+    """
+    The green equivalent of walking the filesystem in
+    flimp.directory_handler.push_to_fluiddb. Namespaces are created as the
+    directories are found (parents before their children) and each file is
+    pushed to the object by its own greenlet.
+
+    Returns the object to which the tag-values have been added.
+    """
+    check_patched()
+    pushes = []
+    for path, children, files in os.walk(directory):
+        # ignore hidden directories
+        children[:] = [child for child in children if not
+                       child.startswith('.')]
+        new_ns_name = path.replace(directory, '')
+        if new_ns_name:
+            ns_path = '/'.join([root_namespace.path, new_ns_name[1:]])
+            with limit:
+                new_ns = make_namespace(ns_path, name, desc)
+        else:
+            new_ns = root_namespace
+        for f in files:
+            if not f.startswith('.'): # ignore hidden files
+                pushes.append(gevent.spawn(push_file, obj, new_ns,
+                                           os.path.join(path, f), name, desc))
+    gevent.joinall(pushes, raise_error=True)
+    logger.info('Finished tagging the object with the uuid %r' % obj.uid)
+    return obj
+
+def push_file(obj, namespace, file_path, name, desc):
+    """
+    Creates (or checks) the tag for the referenced file in the namespace and
+    sets the file's content as the tag's value on the object.
+    """
+    with limit:
+        new_tag = make_tag(namespace, os.path.basename(file_path), name, desc,
+                           False)
+    content_type, encoding = guess_type(file_path)
+    logger.info('Content-Type of %r detected' % content_type)
+    with limit:
+        # only read the file once it's our turn to push it
+        raw_file = open(file_path, 'r')
+        try:
+            logger.info('Pushing file %r to object %r on tag %r' %
+                        (file_path, obj.uid, new_tag.path))
+            obj.set(new_tag.path, raw_file.read(), content_type)
+        finally:
+            raw_file.close()
@@ -30,8 +30,17 @@ import sys
 from traceback import format_exception
 from optparse import OptionParser
 from getpass import getpass
-from file_handler import VALID_FILETYPES, process as process_file
+from file_handler import (VALID_FILETYPES, COMPRESSED_FILETYPES,
+                          process as process_file)
 from directory_handler import process as process_directory
+from green import patch as patch_green
+from transport import install as install_transport, DEFAULT_POOL_SIZE
+from scheduler import install as install_scheduler, DEFAULT_RETRIES
+from journal import Journal, fingerprint, journal_path
+from delta import DeltaIndex, RemoteDiff
+from cache import SchemaCache, DEFAULT_PATH as DEFAULT_SCHEMA_CACHE
+from direct import PayloadCache, DEFAULT_CACHE_SIZE
+from pipeline import Pipeline
 from fom.session import Fluid
 import flimp
 
@@ -42,8 +51,11 @@ def execute():
     """
     parser = OptionParser(version="%prog " + flimp.VERSION)
     parser.add_option('-f', '--file', dest='filename',
-                      help='The FILE to process (valid filetypes: %s)' %
-                      ', '.join(VALID_FILETYPES.keys()), metavar="FILE")
+                      help='The FILE to process (valid filetypes: %s,'\
+                      ' optionally compressed: %s)' %
+                      (', '.join(VALID_FILETYPES.keys()),
+                      ', '.join(COMPRESSED_FILETYPES.keys())),
+                      metavar="FILE")
     parser.add_option('-d', '--dir', dest='directory',
                       help="The root directory for a filesystem import into"\
                       " FluidDB")
@@ -68,6 +80,94 @@ def execute():
                       action="store_true", help="Validate the data file"\
                       " containing the data to import into FluidDB - don't"\
                       " import anything")
+    parser.add_option('-s', '--stream', dest='stream', default=False,
+                      action="store_true", help="Parse and import the"\
+                      " records in the FILE one at a time rather than reading"\
+                      " them all into memory first")
+    parser.add_option('-j', '--processes', dest='processes', default=None,
+                      type="int", help="Parse the (uncompressed csv) FILE in"\
+                      " parallel using this many processes")
+    parser.add_option('-m', '--compact', dest='compact', default=False,
+                      action="store_true", help="Hold the records in a"\
+                      " compact form that uses much less memory (when not"\
+                      " streaming)")
+    parser.add_option('--sample', dest='sample', default=None, type="int",
+                      help="Only check (see -c) a sample of this many records"\
+                      " and extrapolate the results")
+    parser.add_option('--random-sample', dest='random_sample',
+                      default=False, action="store_true", help="Check a"\
+                      " random sample of the records (rather than the first"\
+                      " ones)")
+    parser.add_option('-w', '--workers', dest='workers', default=1,
+                      type="int", help="Push the records to FluidDB"\
+                      " concurrently using this many worker threads")
+    parser.add_option('-g', '--green', dest='green', default=None,
+                      type="int", help="Import using green threads (requires"\
+                      " gevent) with at most this many requests to FluidDB in"\
+                      " flight at any one time")
+    parser.add_option('-b', '--bulk', dest='bulk', default=False,
+                      action="store_true", help="Set all the tag values of"\
+                      " each record with a single request to FluidDB")
+    parser.add_option('--direct', dest='direct', default=False,
+                      action="store_true", help="Send the tag values"\
+                      " straight to FluidDB rather than through fom's"\
+                      " object mapping (cannot be used with --green or"\
+                      " --batch-size)")
+    parser.add_option('--payload-cache', dest='payload_cache',
+                      default=DEFAULT_CACHE_SIZE, type="int", help="Remember"\
+                      " the encoded payloads of up to this many values with"\
+                      " --direct (defaults to %d, 0 turns it off)" %
+                      DEFAULT_CACHE_SIZE)
+    parser.add_option('--pipeline', dest='pipeline', default=False,
+                      action="store_true", help="Parse, check and push the"\
+                      " records of the FILE at the same time (pushing with"\
+                      " the number of --workers)")
+    parser.add_option('--transform-workers', dest='transform_workers',
+                      default=1, type="int", help="The number of threads"\
+                      " checking records in the --pipeline")
+    parser.add_option('--batch-size', dest='batch_size', default=None,
+                      type="int", help="Set the tag values of this many"\
+                      " records with each request to FluidDB")
+    parser.add_option('--flush-interval', dest='flush_interval',
+                      default=None, type="float", help="Send a batch (see"\
+                      " --batch-size) at least every this many seconds")
+    parser.add_option('--pool-size', dest='pool_size',
+                      default=DEFAULT_POOL_SIZE, type="int", help="Keep up to"\
+                      " this many idle connections to FluidDB open for reuse"\
+                      " (defaults to %d)" % DEFAULT_POOL_SIZE)
+    parser.add_option('--timeout', dest='timeout', default=None,
+                      type="float", help="Give up waiting for a response"\
+                      " from FluidDB after this many seconds")
+    parser.add_option('--retries', dest='retries', default=DEFAULT_RETRIES,
+                      type="int", help="Retry requests that fail because of"\
+                      " transient errors this many times (defaults to %d)" %
+                      DEFAULT_RETRIES)
+    parser.add_option('-r', '--resume', dest='resume', default=False,
+                      action="store_true", help="Keep a journal of the"\
+                      " records imported from the FILE and skip those that"\
+                      " were imported by an earlier (unfinished) run")
+    parser.add_option('--journal', dest='journal', default=None,
+                      help="Keep the journal of the records imported from the"\
+                      " FILE here (defaults to FILE.journal in the current"\
+                      " directory with -r)")
+    parser.add_option('--delta', dest='delta', default=None,
+                      help="Only push the records and tag values that have"\
+                      " changed since the last import that used this DELTA"\
+                      " index file (needs a key field for the about tag value)")
+    parser.add_option('--remote-diff', dest='remote_diff', default=False,
+                      action="store_true", help="Read the values already in"\
+                      " FluidDB in bulk and only push those that are"\
+                      " different (needs a key field for the about tag value)")
+    parser.add_option('--schema-cache', dest='schema_cache',
+                      default=DEFAULT_SCHEMA_CACHE, help="The file in which"\
+                      " to remember the namespaces and tags that exist"\
+                      " (defaults to ~/.flimp_schema_cache)")
+    parser.add_option('--no-schema-cache', dest='use_schema_cache',
+                      default=True, action="store_false", help="Always ask"\
+                      " FluidDB whether namespaces and tags exist")
+    parser.add_option('--refresh-schema', dest='refresh_schema',
+                      default=False, action="store_true", help="Forget the"\
+                      " namespaces and tags remembered in the schema cache")
     options, args = parser.parse_args()
 
     # Some options validation
@@ -80,6 +180,23 @@ def execute():
     if options.uuid and options.about:
         parser.error("You may only supply either an object's uuid OR its"\
                      " about tag value (not both).")
+    if options.random_sample and not options.sample:
+        parser.error("The --random-sample option needs a --sample size.")
+    if options.delta and options.remote_diff:
+        parser.error("You may only use either --delta OR --remote-diff (not"\
+                     " both).")
+    if options.direct and (options.green or options.batch_size):
+        parser.error("The --direct option can't be used with --green or"\
+                     " --batch-size.")
+    if options.pipeline and (options.green or options.batch_size):
+        parser.error("The --pipeline option can't be used with --green or"\
+                     " --batch-size.")
+    if options.green:
+        # patch the standard library before any connections are made
+        try:
+            patch_green(options.green)
+        except (ImportError, ValueError), e:
+            parser.error(str(e))
 
     # Setup logging properly
     logger = logging.getLogger("flimp")
@@ -129,24 +246,83 @@ def execute():
     fdb = Fluid(options.instance)
     fdb.bind()
     fdb.login(username, password)
+    # Reuse connections to FluidDB rather than opening one for each request
+    pool = install_transport(fdb, options.pool_size, options.timeout)
+    # Retry transient errors and adapt the number of requests in flight
+    scheduler = install_scheduler(fdb, retries=options.retries)
 
     # Process the file or directory
+    journal = delta = schema_cache = payload_cache = None
     try:
+        if options.use_schema_cache and not (options.preview or
+                                             options.check):
+            # don't ask FluidDB about namespaces and tags we know exist
+            schema_cache = SchemaCache(options.schema_cache, options.instance,
+                                       username)
+            if options.refresh_schema:
+                schema_cache.invalidate()
+            schema_cache.bind()
+        if options.direct and options.payload_cache > 0:
+            # don't encode the same values again and again
+            payload_cache = PayloadCache(options.payload_cache)
         print "Working... (this might take some time, why not: tail -f the"\
             " log?)"
         if options.filename:
+            if not (options.preview or options.check):
+                if options.resume or options.journal:
+                    # keep track of the records imported so we can resume
+                    journal = Journal(options.journal or
+                                      journal_path(options.filename),
+                                      fingerprint(options.filename), about,
+                                      options.resume)
+                if options.delta or options.remote_diff:
+                    if not about:
+                        raise ValueError('A delta import needs a key field'
+                                         ' for the about tag value')
+                    if options.delta:
+                        delta = DeltaIndex(options.delta)
+                    else:
+                        delta = RemoteDiff()
             msg = process_file(options.filename, root_path, name, desc, about,
-                         options.preview, options.check)
+                         options.preview, options.check,
+                         stream=options.stream,
+                         processes=options.processes,
+                         compact=options.compact,
+                         sample=options.sample,
+                         random_sample=options.random_sample,
+                         workers=options.workers,
+                         use_green=bool(options.green),
+                         bulk=options.bulk,
+                         direct=options.direct,
+                         payload_cache=payload_cache,
+                         pipeline=options.pipeline and Pipeline() or None,
+                         transform_workers=options.transform_workers,
+                         batch_size=options.batch_size,
+                         flush_interval=options.flush_interval,
+                         journal=journal,
+                         delta=delta)
+            if journal:
+                # finished so we don't need the journal any more
+                journal.close(finished=True)
+                journal = None
             logger.info(msg)
             print msg
         else:
             obj = process_directory(options.directory, root_path,
                                     name, desc, options.uuid, options.about,
-                                    options.preview)
+                                    options.preview, bool(options.green))
             if obj:
                 msg = 'Tags added to object with uuid: %s' % obj.uid
                 logger.info(msg)
                 print msg
+        if schema_cache:
+            msg = schema_cache.stats()
+            logger.info(msg)
+            print msg
+        if pool.opened:
+            for msg in (scheduler.stats(), pool.stats()):
+                logger.info(msg)
+                print msg
     except Exception, e:
         # We want to catch all exceptions so we can log them nicely
         ex_type, ex_val, ex_trace = sys.exc_info()
@@ -156,6 +332,14 @@ def execute():
         # flimp command line tool
         raise e
     finally:
+        if journal:
+            journal.close()
+        if delta:
+            delta.close()
+        if schema_cache:
+            # the namespaces and tags created so far exist regardless
+            schema_cache.save()
+        pool.close()
         logger.info('FINISHED!') # :-)
 
 def get_argument(description, default_value=None, required=True,
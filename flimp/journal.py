@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+An append-only journal of the records that have been imported from a file so
+an import that dies part of the way through can be resumed.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import os
+import sys
+import time
+import hashlib
+import logging
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+
+logger = logging.getLogger("flimp")
+
+# The version of the journal's format
+VERSION = 1
+
+# The number of bytes from each end of the file used in its fingerprint
+FINGERPRINT_BYTES = 1024 * 1024
+
+# The journal is flushed to disk at least this often (in seconds)
+FLUSH_INTERVAL = 1.0
+
+def fingerprint(filename):
+    """
+    Returns a fingerprint of the referenced file based on its size and the
+    content at its start and end (so it's quick to work out even for a huge
+    file).
+    """
+    size = os.path.getsize(filename)
+    digest = hashlib.sha1(str(size))
+    f = open(filename, 'rb')
+    try:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            digest.update(f.read())
+    finally:
+        f.close()
+    return digest.hexdigest()
+
+def journal_path(filename):
+    """
+    Returns the default path of the journal for the referenced file (in the
+    current directory).
+    """
+    return os.path.basename(filename) + '.journal'
+
+class Journal(object):
+    """
+    Records the (1-based) positions of the records in a file that have been
+    completely imported. The journal starts with a header that identifies the
+    file (by its fingerprint) and the field used for the about tag value so a
+    journal can't be used to resume the wrong import.
+
+    Each record is written as a line of its own but the file is only flushed
+    every FLUSH_INTERVAL seconds so recording a record is cheap. Records that
+    hadn't been flushed when an import died are imported again when it's
+    resumed.
+
+    Records finish out of order when they're pushed concurrently so the
+    journal remembers the position up to which every record is done and the
+    set of those done beyond it (which stays small).
+
+    Starting afresh (without resume) replaces the journal of a different
+    import but raises a ValueError rather than throw away the progress of
+    an unfinished import of the same file.
+    """
+
+    def __init__(self, path, fingerprint, about, resume=False):
+        self.path = path
+        self.header = {'version': VERSION, 'fingerprint': fingerprint,
+                       'about': about}
+        self.done_through = 0
+        self.done_after = set()
+        self.skipped = 0
+        if resume and os.path.exists(path):
+            complete = self.load()
+            self.file = open(path, 'a')
+            if not complete:
+                # start a fresh line after the one that was cut short
+                self.file.write('\n')
+            logger.info('Resuming from journal %r (%d records done)' %
+                        (path, self.done_through + len(self.done_after)))
+        else:
+            if os.path.exists(path):
+                try:
+                    self.load()
+                except ValueError:
+                    logger.warning('Replacing the journal %r of a different'
+                                   ' import' % path)
+                if self.done_through or self.done_after:
+                    raise ValueError('The journal %r records an unfinished'
+                                     ' import of this file: resume it (-r) or'
+                                     ' remove the journal to start again' %
+                                     path)
+            self.file = open(path, 'w')
+            self.file.write(json.dumps(self.header) + '\n')
+        self.flushed = time.time()
+
+    def load(self):
+        """
+        Reads the records that are done from the journal. Returns False if
+        the last line was cut short.
+
+        Raises a ValueError if the journal is for a different file or about
+        field.
+        """
+        f = open(self.path, 'r')
+        try:
+            try:
+                header = json.loads(f.readline())
+            except ValueError:
+                header = None
+            if header != self.header:
+                raise ValueError('The journal %r is not for this file and'
+                                 ' about field so the import cannot be'
+                                 ' resumed' % self.path)
+            line = '\n'
+            for line in f:
+                # the last line may have been cut short
+                if line.endswith('\n') and line.strip().isdigit():
+                    self.mark(int(line))
+        finally:
+            f.close()
+        return line.endswith('\n')
+
+    def mark(self, index):
+        """
+        Marks the record at the given position as done.
+        """
+        if index == self.done_through + 1:
+            self.done_through = index
+            while self.done_through + 1 in self.done_after:
+                self.done_through += 1
+                self.done_after.remove(self.done_through)
+        elif index > self.done_through:
+            self.done_after.add(index)
+
+    def imported(self, index):
+        """
+        Returns True if the record at the given position has already been
+        imported.
+        """
+        return index <= self.done_through or index in self.done_after
+
+    def done(self, index):
+        """
+        Returns True if the record at the given position has already been
+        imported (and counts it as skipped).
+        """
+        if self.imported(index):
+            self.skipped += 1
+            return True
+        return False
+
+    def record(self, index):
+        """
+        Records that the record at the given position has been imported.
+        """
+        self.mark(index)
+        self.file.write('%d\n' % index)
+        now = time.time()
+        if now - self.flushed >= FLUSH_INTERVAL:
+            self.file.flush()
+            self.flushed = now
+
+    def close(self, finished=False):
+        """
+        Closes the journal. If the import finished the journal is no longer
+        needed so it's removed.
+        """
+        self.file.close()
+        if finished:
+            os.remove(self.path)
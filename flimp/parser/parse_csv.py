@@ -2,6 +2,30 @@
 Turns a filename into a list of deserialized items based upon csv data
 """
 import csv
+import mmap
+from collections import deque
+from itertools import chain, islice, izip
+from multiprocessing import Pool, cpu_count
+from StringIO import StringIO
+
+# The (approximate) number of bytes of the file each process parses at a time
+# when parsing in parallel
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# The number of rows used to infer the type of each column
+SAMPLE_SIZE = 100
+
+# The characters (other than digits) a number may start with
+NUMERIC_CHARACTERS = frozenset('+-.')
+
+# The (lower case) words clean_row_item turns into something other than a
+# string (booleans and special floats)
+CAST_WORDS = frozenset(['true', 'false', 'inf', 'infinity', 'nan'])
+
+# The attributes of a csv dialect that are passed to the worker processes
+DIALECT_ATTRIBUTES = ('delimiter', 'doublequote', 'escapechar',
+                      'lineterminator', 'quotechar', 'quoting',
+                      'skipinitialspace')
 
 def clean_header(header):
     """
@@ -40,7 +64,97 @@ def clean_row_item(item):
         return None
     return item # just return it as the string that it is...
 
-def parse(raw_file, header_cleaner=clean_header, item_cleaner=clean_row_item):
+def convert_int(item):
+    """
+    Cleans an item found in a column that contains integers. Gives exactly
+    the same result as clean_row_item.
+    """
+    stripped_item = item.strip()
+    if stripped_item.isdigit():
+        return int(stripped_item)
+    return clean_row_item(item)
+
+def convert_float(item):
+    """
+    Cleans an item found in a column that contains floats. Gives exactly the
+    same result as clean_row_item.
+    """
+    stripped_item = item.strip()
+    if stripped_item.isdigit():
+        return int(stripped_item)
+    try:
+        return float(stripped_item)
+    except ValueError:
+        return clean_row_item(item)
+
+def convert_bool(item):
+    """
+    Cleans an item found in a column that contains booleans. Gives exactly the
+    same result as clean_row_item.
+    """
+    bool_check = item.strip().lower()
+    if bool_check == "true":
+        return True
+    elif bool_check == "false":
+        return False
+    return clean_row_item(item)
+
+def convert_string(item):
+    """
+    Cleans an item found in a column that contains strings. Gives exactly the
+    same result as clean_row_item but only tries to cast items that could
+    be a number or boolean.
+    """
+    stripped_item = item.strip()
+    if stripped_item:
+        first = stripped_item[0]
+        if first.isdigit() or first in NUMERIC_CHARACTERS:
+            return clean_row_item(item)
+        if stripped_item.lower() in CAST_WORDS:
+            return clean_row_item(item)
+        return item
+    return clean_row_item(item)
+
+# Converters for columns whose sampled values were all of the given type
+CONVERTERS = {
+    int: convert_int,
+    long: convert_int,
+    float: convert_float,
+    bool: convert_bool,
+    str: convert_string,
+    unicode: convert_string,
+}
+
+def infer_converters(rows, columns):
+    """
+    Given a sample of rows (lists of raw items) will return a list containing
+    a converter for each of the first "columns" columns. The converter is
+    chosen from the type clean_row_item gives the (non-empty) values in the
+    column. Columns with values of mixed types are cleaned with
+    clean_row_item.
+    """
+    found = [set() for i in range(columns)]
+    for row in rows:
+        for column_converters, item in izip(found, row):
+            value = clean_row_item(item)
+            if value is not None:
+                column_converters.add(CONVERTERS[type(value)])
+    converters = list()
+    for column_converters in found:
+        if len(column_converters) == 1:
+            converters.append(column_converters.pop())
+        elif column_converters == set([convert_int, convert_float]):
+            # e.g. "1" and "1.5"
+            converters.append(convert_float)
+        elif column_converters:
+            converters.append(clean_row_item)
+        else:
+            # nothing but empty values in the sample
+            converters.append(convert_string)
+    return converters
+
+def parse(raw_file, header_cleaner=clean_header, item_cleaner=clean_row_item,
+          infer_types=True):
     """
     Given a filename, will load it and attempt to de-serialize the csv
     therein.
@@ -51,29 +165,190 @@ def parse(raw_file, header_cleaner=clean_header, item_cleaner=clean_row_item):
 
     The header_cleaner argument is for a function to be called for each header
     in order to "clean" it into an appropriate tag name.
+
+    When the default item_cleaner is used (and infer_types is True) the type
+    of each column is inferred from the first SAMPLE_SIZE rows and the items
+    in each column are cleaned by a converter specialised for that type.
+    The result is exactly the same as calling clean_row_item for each item,
+    just quicker.
+    """
+    return list(iterparse(raw_file, header_cleaner, item_cleaner,
+                          infer_types))
+
+def iterparse(raw_file, header_cleaner=clean_header,
+              item_cleaner=clean_row_item, infer_types=True):
+    """
+    Exactly the same as parse but returns a generator that yields each record
+    as it is read from the file rather than building a list of all of them.
+    Memory use stays flat no matter how large the file is.
+
+    Raises ValueError (when the generator is consumed) if there are no headers
+    or no records.
+    """
+    dialect = sniff(raw_file)
+
+    # read in the file
+    raw = csv.reader(raw_file, dialect)
+
+    # grab /clean the headers
+    headers = [header_cleaner(header) for header in raw.next() if header]
+    found = False
+
+    if infer_types and item_cleaner is clean_row_item:
+        sample = list(islice(raw, SAMPLE_SIZE))
+        converters = infer_converters(sample, len(headers))
+        for row in chain(sample, raw):
+            found = True
+            yield dict(zip(headers, [convert(item) for convert, item in
+                                     izip(converters, row)]))
+    else:
+        # process each of the rows into a dictionary and yield it
+        for row in raw:
+            found = True
+            yield dict(zip(headers, [item_cleaner(item) for item in row]))
+
+    # Final check that we actually got some data.
+    if not found:
+        raise ValueError('No records found')
+
+def sniff(raw_file):
+    """
+    Given a file will try to determine some useful information about the
+    CSV therein. Returns the dialect and leaves the file at its start.
+
+    Raises a ValueError if the file doesn't appear to have headers.
     """
-    # try to determine some useful information about the CSV file
     header = csv.Sniffer().has_header(raw_file.read(1024))
     if not header:
         raise ValueError("The CSV file doesn't appear to contain headers")
     raw_file.seek(0)
     dialect = csv.Sniffer().sniff(raw_file.read(1024))
     raw_file.seek(0)
+    return dialect
 
-    # read in the file
-    raw = csv.reader(raw_file, dialect)
+def iterparse_parallel(filename, header_cleaner=clean_header,
+                       item_cleaner=clean_row_item, processes=None,
+                       chunk_size=CHUNK_SIZE, infer_types=True):
+    """
+    Exactly the same as iterparse but the file (referenced by filename) is
+    memory-mapped, cut into row-aligned ranges of roughly chunk_size bytes
+    and the ranges are parsed by a pool of processes (defaults to the number
+    of CPUs). The records are yielded in the same order as they appear in the
+    file.
 
-    # grab /clean the headers
-    headers = [header_cleaner(header) for header in raw.next() if header]
-    data = list()
+    The dialect is sniffed and the headers cleaned once, from the start of
+    the file, and used to parse every range. Quoted fields that contain
+    newlines are handled but quote characters must only appear in quoted
+    fields and be escaped by doubling them (the usual convention) rather
+    than with an escape character.
 
-    # process each of the rows into a dictionary and add to the result list
-    for row in raw:
-        item = dict(zip(headers, [item_cleaner(item) for item in row]))
-        data.append(item)
+    The item_cleaner must be a module level function so it can be sent to
+    the worker processes. Column types are inferred (see parse) from the
+    start of the first range of rows.
+    """
+    raw_file = open(filename, 'rb')
+    try:
+        dialect = sniff(raw_file)
+        data = mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        raw_file.close()
+    fmtparams = dict([(attribute, getattr(dialect, attribute)) for
+                      attribute in DIALECT_ATTRIBUTES])
+    pool = Pool(processes)
+    try:
+        ranges = split_rows(data, dialect.quotechar, chunk_size)
+        # grab /clean the headers from the first row
+        header_start, header_end = ranges.next()
+        raw = csv.reader(StringIO(data[header_start:header_end]), **fmtparams)
+        headers = [header_cleaner(header) for header in raw.next() if header]
+        first_range = list(islice(ranges, 1))
+        if infer_types and item_cleaner is clean_row_item and first_range:
+            # infer the converters from the start of the first range
+            start, end = first_range[0]
+            raw = csv.reader(StringIO(data[start:end]), **fmtparams)
+            converters = infer_converters(islice(raw, SAMPLE_SIZE),
+                                          len(headers))
+        else:
+            converters = None
+        # Only keep a few ranges in flight so the parsed records don't pile
+        # up in memory if they're consumed more slowly than they're parsed
+        in_flight = deque()
+        limit = 2 * (processes or cpu_count())
+        found = False
+        for start, end in chain(first_range, ranges):
+            in_flight.append(pool.apply_async(parse_range,
+                (filename, start, end, fmtparams, headers, item_cleaner,
+                 converters)))
+            if len(in_flight) >= limit:
+                for item in in_flight.popleft().get():
+                    found = True
+                    yield item
+        while in_flight:
+            for item in in_flight.popleft().get():
+                found = True
+                yield item
+    finally:
+        pool.terminate()
+        data.close()
 
     # Final check that we actually got some data.
-    if data:
-        return data
-    else:
+    if not found:
         raise ValueError('No records found')
+
+def split_rows(data, quotechar, chunk_size):
+    """
+    A generator that yields (start, end) byte offsets that divide the data
+    (a string or memory-mapped file) into ranges of complete rows. The first
+    range contains just the first row (the headers), the others are roughly
+    chunk_size bytes long.
+
+    A newline only ends a row if it is preceded by an even number of quote
+    characters within the row so newlines in quoted values are skipped.
+    """
+    size = len(data)
+    start = 0
+    target = 0
+    while start < size:
+        # count the quotes between the start of the row and the target
+        # position to work out whether the target is within a quoted value
+        quotes = data[start:target].count(quotechar)
+        position = target
+        while True:
+            newline = data.find('\n', position)
+            if newline == -1:
+                end = size
+                break
+            quotes += data[position:newline].count(quotechar)
+            position = newline + 1
+            if not quotes % 2:
+                end = position
+                break
+        yield start, end
+        start = end
+        target = start + chunk_size
+
+def parse_range(filename, start, end, fmtparams, headers, item_cleaner,
+                converters=None):
+    """
+    Parses the rows found between the start and end byte offsets of the
+    referenced file and returns a list of records. Used by the worker
+    processes in iterparse_parallel.
+
+    If a list of converters (one per column) is given they're used to clean
+    the items rather than the item_cleaner.
+    """
+    raw_file = open(filename, 'rb')
+    try:
+        data = mmap.mmap(raw_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            raw = csv.reader(StringIO(data[start:end]), **fmtparams)
+            if converters:
+                return [dict(zip(headers, [convert(item) for convert, item in
+                                           izip(converters, row)]))
+                        for row in raw]
+            return [dict(zip(headers, [item_cleaner(item) for item in row]))
+                    for row in raw]
+        finally:
+            data.close()
+    finally:
+        raw_file.close()
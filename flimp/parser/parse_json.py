@@ -3,12 +3,24 @@ Turns a filename into a list of deserialized items based upon json data
 """
 
 import sys
+import re
 
 if sys.version_info < (2, 6):
     import simplejson as json
 else:
     import json
 
+# How much of the file to read at a time when parsing incrementally
+CHUNK_SIZE = 64 * 1024
+
+# The whitespace allowed between JSON tokens
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# A number cut short by the end of the buffer can still decode as a shorter
+# number followed by up to this many characters of the rest of it (such as
+# "1." or "1e+", which decode as 1)
+NUMBER_TAIL = 2
+
 def parse(raw_file):
     """
     Given a filename, will load it and attempt to de-serialize the json
@@ -26,3 +38,76 @@ def parse(raw_file):
         return data
     else:
         raise ValueError('JSON list was empty.')
+
+def iterparse(raw_file, chunk_size=CHUNK_SIZE):
+    """
+    Given a file, will incrementally de-serialize the json list therein
+    yielding each item in the list as soon as it has been decoded. The file
+    is read chunk_size bytes at a time so neither the raw text nor the
+    decoded list is ever held in memory all at once.
+
+    Makes the same checks as parse (the file must contain a non-empty list)
+    but raises the errors as the generator is consumed.
+    """
+    decoder = json.JSONDecoder()
+    # Mutable state shared with the helper functions below: the current
+    # buffer, the position within it and whether we've reached the end of the
+    # file
+    state = {'buf': '', 'pos': 0, 'eof': False}
+
+    def fill():
+        # Throw away what we've already consumed and read the next chunk. The
+        # amount read grows with the buffer so decoding items that span many
+        # chunks doesn't become quadratic.
+        buf = state['buf'][state['pos']:]
+        data = raw_file.read(max(chunk_size, len(buf)))
+        state['buf'] = buf + data
+        state['pos'] = 0
+        state['eof'] = not data
+
+    def skip_whitespace():
+        # move past whitespace and return the next character ('' at the end)
+        while True:
+            state['pos'] = WHITESPACE.match(state['buf'], state['pos']).end()
+            if state['pos'] < len(state['buf']):
+                return state['buf'][state['pos']]
+            if state['eof']:
+                return ''
+            fill()
+
+    char = skip_whitespace()
+    if not char:
+        raise ValueError('No JSON object could be decoded')
+    if char != '[':
+        raise TypeError('The json file *MUST* supply a list of items to be '
+                        'turned into objects in FluidDB')
+    state['pos'] += 1
+    if skip_whitespace() == ']':
+        raise ValueError('JSON list was empty.')
+
+    while True:
+        try:
+            item, end = decoder.raw_decode(state['buf'], state['pos'])
+        except ValueError:
+            # the item is (probably) incomplete so read some more of it
+            if state['eof']:
+                raise
+            fill()
+            continue
+        if end + NUMBER_TAIL >= len(state['buf']) and not state['eof']:
+            # numbers can't be known to be complete until we see what comes
+            # next (see NUMBER_TAIL), so make sure there's more to look at
+            # and try again
+            fill()
+            continue
+        state['pos'] = end
+        yield item
+        char = skip_whitespace()
+        if char == ',':
+            state['pos'] += 1
+            skip_whitespace()
+        elif char == ']':
+            return
+        else:
+            raise ValueError('Expecting , delimiter or ] at position %d' %
+                             state['pos'])
@@ -0,0 +1,84 @@
+"""
+Turns a filename into a list of deserialized items based upon json lines
+(a.k.a. newline delimited json) data - one json object per line
+"""
+
+import sys
+import os
+
+if sys.version_info < (2, 6):
+    import simplejson as json
+else:
+    import json
+
+def parse(raw_file):
+    """
+    Given a filename, will load it and attempt to de-serialize each line of
+    json therein.
+
+    Also makes sure we have a non-empty list as a result.
+    """
+    return list(iterparse(raw_file))
+
+def iterparse(raw_file, start=0, end=None):
+    """
+    Given a file, will de-serialize it one line at a time yielding each
+    record as it goes. Blank lines are ignored.
+
+    The start and end arguments are byte offsets that restrict parsing to a
+    range of the file. A record belongs to the range if its line *starts*
+    within [start, end) so the ranges returned by split can be parsed
+    independently (and in any order) without losing or duplicating records.
+
+    Raises a ValueError that references the offending line (and its byte
+    offset) if a line doesn't contain valid json and a TypeError if it
+    doesn't contain a json object. If the whole file is being parsed a
+    ValueError is also raised if it contains no records.
+    """
+    if start:
+        # Move to the first line that starts at or after the start offset
+        raw_file.seek(start - 1)
+        raw_file.readline()
+    else:
+        raw_file.seek(0)
+    position = raw_file.tell()
+    line_number = 0
+    found = False
+    while end is None or position < end:
+        line = raw_file.readline()
+        if not line:
+            break
+        offset = position
+        position += len(line)
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError, ex:
+            raise ValueError('Invalid json on line %d (byte offset %d): %s' %
+                             (line_number, offset, ex))
+        if not isinstance(item, dict):
+            raise TypeError('Line %d (byte offset %d) *MUST* supply a json '
+                            'object to be turned into an object in FluidDB' %
+                            (line_number, offset))
+        found = True
+        yield item
+
+    # Final check that we actually got some data.
+    if not (found or start or end is not None):
+        raise ValueError('JSON lines file was empty.')
+
+def split(raw_file, chunks):
+    """
+    Given a file will return a list of (start, end) byte offsets that divide
+    it into the given number of (roughly) equal ranges. Each range can be
+    passed to iterparse to parse that part of the file independently. Line
+    numbers reported in errors are relative to the start of the range.
+    """
+    raw_file.seek(0, os.SEEK_END)
+    size = raw_file.tell()
+    raw_file.seek(0)
+    chunks = max(1, chunks)
+    offsets = [size * i // chunks for i in range(chunks)] + [size]
+    return zip(offsets[:-1], offsets[1:])
@@ -2,6 +2,30 @@
 Turns a filename into a list of deserialized items based upon yaml data
 """
 import yaml
+from yaml.composer import Composer
+from yaml.constructor import Constructor
+from yaml.resolver import Resolver
+try:
+    from yaml.cyaml import CParser
+except ImportError:
+    # PyYaml was built without libyaml
+    CParser = None
+
+if CParser:
+    class StreamLoader(CParser, Composer, Constructor, Resolver):
+        """
+        A loader that uses libyaml to scan and parse the yaml but composes
+        the nodes in Python so we're able to construct the items in a
+        sequence one at a time.
+        """
+
+        def __init__(self, stream):
+            CParser.__init__(self, stream)
+            Composer.__init__(self)
+            Constructor.__init__(self)
+            Resolver.__init__(self)
+else:
+    StreamLoader = yaml.Loader
 
 def parse(raw_file):
     """
@@ -20,3 +44,57 @@ def parse(raw_file):
         return data
     else:
         raise ValueError('YAML list was empty.')
+
+def iterparse(raw_file):
+    """
+    Given a file, will de-serialize the yaml therein yielding each item as
+    soon as it has been constructed. Uses libyaml (if it's installed).
+
+    The file may contain several documents (separated by "---"). A document
+    that is a list supplies a record for each of its items whereas a document
+    that is a dictionary is itself a record. Empty documents are ignored.
+
+    Raises a TypeError if a document is neither a list nor a dictionary and a
+    ValueError if there are no records.
+    """
+    loader = StreamLoader(raw_file)
+    found = False
+    try:
+        # StreamStartEvent
+        loader.get_event()
+        while not loader.check_event(yaml.StreamEndEvent):
+            # DocumentStartEvent
+            loader.get_event()
+            event = loader.peek_event()
+            if (isinstance(event, yaml.SequenceStartEvent) and
+                event.anchor is None and event.tag is None):
+                # construct the items of a top level list one at a time
+                loader.get_event()
+                while not loader.check_event(yaml.SequenceEndEvent):
+                    node = loader.compose_node(None, None)
+                    found = True
+                    yield loader.construct_document(node)
+                loader.get_event()
+            else:
+                node = loader.compose_node(None, None)
+                document = loader.construct_document(node)
+                if isinstance(document, list):
+                    for item in document:
+                        found = True
+                        yield item
+                elif isinstance(document, dict):
+                    found = True
+                    yield document
+                elif document is not None:
+                    raise TypeError('Each yaml document *MUST* supply a list '
+                                    'of items or a single item to be turned '
+                                    'into objects in FluidDB')
+            # DocumentEndEvent
+            loader.get_event()
+            loader.anchors = {}
+    finally:
+        loader.dispose()
+
+    # Final check that we actually got some data.
+    if not found:
+        raise ValueError('YAML list was empty.')
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+Imports records through a pipeline of stages (parse, transform and push) that
+run at the same time, each with its own threads, joined by bounded queues.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import time
+import logging
+import threading
+from Queue import Queue
+from fom.session import Fluid
+from flimp.utils import (prepare_import, peek, compile_plan, validate_dict,
+                         make_object, annotate)
+from flimp.direct import DirectWriter
+from flimp.workers import clone_session, DEFAULT_WORKERS
+
+logger = logging.getLogger("flimp")
+
+# The default number of items waiting for each stage
+DEFAULT_QUEUE_SIZE = 1000
+
+class Stage(object):
+    """
+    A stage of a Pipeline: calls function(index, item, local) for each item
+    in its queue using workers threads and passes on what it returns (unless
+    it's None) to the next stage. If setup is given each thread calls it once
+    and passes the result to function as local (otherwise local is None).
+
+    A thread whose setup fails leaves the items to the stage's other threads
+    or, if it was the last of them, fails every item instead (so the pipeline
+    still finishes).
+    """
+
+    def __init__(self, name, function, workers=1, setup=None,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.setup = setup
+        self.queue = Queue(queue_size)
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        # statistics
+        self.processed = 0
+        self.failed = 0
+        # the number of threads whose setup failed
+        self.broken = 0
+        # time spent working and waiting for room in the next stage's queue
+        # (summed over the threads)
+        self.busy = 0.0
+        self.blocked = 0.0
+        # the number of items found waiting when an item was queued
+        self.waiting = 0
+        self.queued = 0
+
+    def occupancy(self):
+        """
+        Returns how full the stage's queue was, on average, when items were
+        added to it (between 0 and 1).
+        """
+        if not self.queued:
+            return 0.0
+        return float(self.waiting) / self.queued / self.queue_size
+
+class Pipeline(object):
+    """
+    Passes items from a source (such as a parser) through a series of stages
+    that all run at the same time. Each stage has its own threads and a
+    bounded queue of items waiting for them, so a stage is held up once it's
+    queue_size items ahead of the next one and the number of items in memory
+    is bounded.
+
+    The time each stage spends busy and how full its queue is are kept so the
+    bottleneck can be found (see stats): it's the busiest stage, and the
+    queues before it are full while those after it are empty.
+    """
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE, source='parse'):
+        self.queue_size = queue_size
+        # the source is read by the thread that calls run
+        self.source = Stage(source, None)
+        # the source's items are read ahead by this (see run)
+        self.prefetcher = None
+        self.stages = []
+        self.elapsed = 0.0
+
+    def add(self, name, function, workers=1, setup=None):
+        """
+        Adds a stage to the end of the pipeline (see Stage).
+        """
+        if workers < 1:
+            raise ValueError('The %s stage needs at least one worker' % name)
+        self.stages.append(Stage(name, function, workers, setup,
+                                 self.queue_size))
+
+    @property
+    def failed(self):
+        """
+        The number of items that failed in any of the stages.
+        """
+        return sum(stage.failed for stage in self.stages)
+
+    def put(self, stage, task, sender):
+        """
+        Adds the task to the stage's queue (blocking while it's full) and
+        keeps the statistics of both stages.
+        """
+        waiting = stage.queue.qsize()
+        started = time.time()
+        stage.queue.put(task)
+        blocked = time.time() - started
+        with stage.lock:
+            stage.waiting += waiting
+            stage.queued += 1
+        with sender.lock:
+            sender.blocked += blocked
+
+    def work(self, stage, following):
+        """
+        Processes the items in the stage's queue until it finds a None.
+        """
+        local = error = None
+        if stage.setup:
+            try:
+                local = stage.setup()
+            except Exception, error:
+                logger.error('A thread of the %s stage failed to start: %r' %
+                             (stage.name, error))
+                with stage.lock:
+                    stage.broken += 1
+                    if stage.broken < stage.workers:
+                        # the stage's other threads carry on without it
+                        return
+        while True:
+            task = stage.queue.get()
+            if task is None:
+                break
+            index, item = task
+            started = time.time()
+            try:
+                if error:
+                    raise error
+                result = stage.function(index, item, local)
+                failed = 0
+            except Exception, e:
+                logger.error('Record %d failed in the %s stage: %r' %
+                             (index, stage.name, e))
+                result = None
+                failed = 1
+            with stage.lock:
+                stage.busy += time.time() - started
+                stage.processed += 1
+                stage.failed += failed
+            if result is not None and following:
+                self.put(following, (index, result), stage)
+
+    def read(self, items):
+        """
+        Yields the items, adding the time it takes to read each of them to the
+        source's busy time.
+        """
+        source = self.source
+        items = iter(items)
+        while True:
+            reading = time.time()
+            try:
+                item = items.next()
+            except StopIteration:
+                return
+            finally:
+                source.busy += time.time() - reading
+            source.processed += 1
+            yield item
+
+    def run(self, items, skip=None, prefetch=None):
+        """
+        Passes the items through the stages and returns the number of items
+        read from the source once they've all been through the pipeline.
+
+        If skip is given it's called with the (1-based) position of each item
+        and the item isn't passed on if it returns True.
+
+        If prefetch is given it's called with an iterator over the items and
+        returns an iterator over the same items read ahead (such as
+        flimp.delta.RemoteDiff.prefetch). It runs in the calling thread, as
+        the source does, but the time it takes is counted separately.
+        """
+        if not self.stages:
+            raise ValueError('The pipeline has no stages')
+        started = time.time()
+        threads = []
+        for position, stage in enumerate(self.stages):
+            following = None
+            if position + 1 < len(self.stages):
+                following = self.stages[position + 1]
+            stage_threads = []
+            for i in range(stage.workers):
+                thread = threading.Thread(target=self.work,
+                                          args=(stage, following))
+                thread.daemon = True
+                thread.start()
+                stage_threads.append(thread)
+            threads.append(stage_threads)
+        source = self.source
+        items = self.read(items)
+        if prefetch:
+            self.prefetcher = Stage('prefetch', None)
+            items = iter(prefetch(items))
+        # the time spent reading items from the source and prefetch
+        reading = 0.0
+        count = 0
+        try:
+            while True:
+                read_started = time.time()
+                try:
+                    item = items.next()
+                except StopIteration:
+                    break
+                finally:
+                    reading += time.time() - read_started
+                count += 1
+                if skip and skip(count):
+                    continue
+                self.put(self.stages[0], (count, item), source)
+        finally:
+            if prefetch:
+                self.prefetcher.busy = reading - source.busy
+                self.prefetcher.processed = count
+            # once a stage's threads have dealt with everything in its queue
+            # the next stage can be told to stop
+            for stage, stage_threads in zip(self.stages, threads):
+                for thread in stage_threads:
+                    stage.queue.put(None)
+                for thread in stage_threads:
+                    thread.join()
+            self.elapsed = time.time() - started
+        return count
+
+    def stats(self):
+        """
+        Returns a summary of how busy each stage was and how full its queue
+        was.
+        """
+        lines = ['Pipeline: %d records in %.1fs' % (self.source.processed,
+                                                   self.elapsed)]
+        elapsed = self.elapsed or 1.0
+        sources = [self.source]
+        if self.prefetcher:
+            sources.append(self.prefetcher)
+        for stage in sources + self.stages:
+            line = '  %s (%d thread%s): %.0f%% busy, %.0f%% blocked' % (
+                stage.name, stage.workers, stage.workers != 1 and 's' or '',
+                100.0 * stage.busy / stage.workers / elapsed,
+                100.0 * stage.blocked / stage.workers / elapsed)
+            if stage not in sources:
+                line += ', queue %.0f%% full' % (100.0 * stage.occupancy())
+            if stage.failed:
+                line += ', %d failed' % stage.failed
+            lines.append(line)
+        return '\n'.join(lines)
+
+def process_data_list(raw_data, root_path, name, desc, about, allowEmpty=True,
+                      pipeline=None, transform_workers=1,
+                      workers=DEFAULT_WORKERS, bulk=False, journal=None,
+                      delta=None, direct=False, payload_cache=None):
+    """
+    The pipeline equivalent of flimp.utils.process_data_list: creates the
+    required tags and namespaces and the FOM class (from the first record) and
+    then uses push_to_fluiddb (below) to push the data to FluidDB while the
+    rest of the records are being read.
+
+    Returns the number of records that were processed.
+    """
+    fom_class, records = prepare_import(raw_data, root_path, name, desc,
+                                        workers)
+    logger.info('Starting to push records to FluidDB through a pipeline')
+    return push_to_fluiddb(records, root_path, fom_class, about, name,
+                           allowEmpty, pipeline, transform_workers, workers,
+                           bulk, journal, delta, direct, payload_cache)
+
+def push_to_fluiddb(raw_data, root_path, klass, about, name, allowEmpty=True,
+                    pipeline=None, transform_workers=1,
+                    workers=DEFAULT_WORKERS, bulk=False, journal=None,
+                    delta=None, direct=False, payload_cache=None):
+    """
+    The pipeline equivalent of flimp.utils.push_to_fluiddb. The records are
+    read from raw_data (usually a parser's iterator, see
+    flimp.file_handler.clean_data) by the calling thread while they're checked
+    against the first record and their tag values are taken by
+    transform_workers threads and they're pushed to FluidDB by workers
+    threads (each with its own session).
+
+    The stages are added to the given pipeline (a new Pipeline is used if it
+    isn't given) so its statistics can be reported afterwards.
+
+    bulk, journal, delta, direct and payload_cache are the same as for
+    flimp.utils.push_to_fluiddb. A record that fails doesn't stop the others
+    but a RuntimeError is raised once they have all been pushed.
+
+    Returns the number of records that were processed.
+    """
+    if delta and not about:
+        raise ValueError('Only records with an about tag value can be'
+                         ' imported as a delta')
+    try:
+        # the records are checked against the first one
+        template, raw_data = peek(raw_data)
+    except ValueError:
+        return 0
+    prefetch = None
+    if delta:
+        def prefetch(records):
+            return delta.prefetch(records, root_path, about, name,
+                                  journal and journal.imported)
+    if pipeline is None:
+        pipeline = Pipeline()
+    plan = compile_plan(klass, root_path)
+    writer = direct and DirectWriter(klass, cache=payload_cache) or None
+    fluid = Fluid.bound
+    # journal entries are written by more than one thread
+    lock = threading.Lock()
+
+    def record(index):
+        if journal:
+            with lock:
+                journal.record(index)
+
+    def transform(index, item, local):
+        problems = []
+        try:
+            validate_dict(template, item, index, problems, problems)
+        except (KeyError, TypeError):
+            problems.append("Record %d doesn't match the first record" % index)
+        for problem in problems:
+            logger.warning(problem)
+        tag_values = plan.values(item)
+        entry = None
+        if delta:
+            about_value = "%s:%s" % (name, item[about])
+            tag_values, entry = delta.changes(about_value, tag_values)
+            if not tag_values:
+                logger.info('Object about %r is unchanged' % about_value)
+                record(index)
+                return None
+        return item, tag_values, entry
+
+    def push(index, task, session):
+        item, tag_values, entry = task
+        obj = make_object(item, klass, about, name, session)
+        annotate(obj, klass, tag_values, allowEmpty, bulk, plan, writer,
+                 session)
+        logger.info('Record %d pushed to object %r' % (index, obj.uid))
+        if delta:
+            delta.update("%s:%s" % (name, item[about]), entry)
+        record(index)
+
+    pipeline.add('transform', transform, transform_workers)
+    pipeline.add('push', push, workers, lambda: clone_session(fluid))
+    counter = pipeline.run(raw_data, journal and journal.done or None,
+                           prefetch)
+    logger.info(pipeline.stats())
+    if pipeline.failed:
+        raise RuntimeError('%d of %d records failed to import (see the log'
+                           ' for details)' % (pipeline.failed, counter))
+    return counter
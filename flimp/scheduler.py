@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Schedules the requests made to FluidDB: retries requests that fail because
+of transient errors and adapts the number of requests in flight to how well
+FluidDB is coping.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import sys
+import time
+import socket
+import random
+import httplib
+import logging
+import threading
+from urlparse import urlsplit
+from requests.exceptions import RequestException
+from fom.session import Fluid
+from flimp.transport import IDEMPOTENT_METHODS
+
+logger = logging.getLogger("flimp")
+
+# The errors (from flimp.transport or the requests library) worth retrying
+TRANSIENT_ERRORS = (socket.error, httplib.HTTPException, RequestException)
+
+# The default number of times a request is retried
+DEFAULT_RETRIES = 5
+
+# Latencies (in seconds) shorter than this are too noisy to compare
+MIN_LATENCY = 0.01
+
+# The fraction of the way each slower response moves the baseline latency of
+# its kind of request towards it, so the fastest response is slowly forgotten
+BASELINE_DECAY = 0.01
+
+def endpoint(method, url):
+    """
+    Returns the kind of request made (its method and the first part of its
+    path, such as ('PUT', 'values')). The latencies of different kinds of
+    request aren't compared with each other.
+    """
+    return method.upper(), urlsplit(url).path.strip('/').split('/')[0]
+
+class Scheduler(object):
+    """
+    Wraps an HTTP session (such as a flimp.transport.ConnectionPool) and has
+    the same request method so it can be used by fom (see install).
+
+    Idempotent requests that fail with a 5xx response or a transient error
+    (such as a timeout) are retried up to retries times. Before each retry
+    the scheduler waits for a random time (jitter) of up to backoff seconds,
+    doubling each time up to max_backoff.
+
+    The number of requests in flight at any one time is limited using AIMD
+    (additive increase, multiplicative decrease). Starting at limit, each
+    successful request adds 1/limit to the limit (so it grows by about one per
+    round of requests) up to max_limit (if given). The limit is multiplied by
+    decrease (but not below min_limit) when a request fails or the average
+    latency of its kind of request (see endpoint) climbs to more than
+    latency_factor times the baseline for that kind (or MIN_LATENCY if that's
+    longer). The baseline is the fastest response seen, slowly aged towards
+    the slower ones (see BASELINE_DECAY) so that a single fast response
+    doesn't keep the limit down for good. The limit is decreased at most once
+    per average latency so a burst of errors only counts once.
+    """
+
+    def __init__(self, session, retries=DEFAULT_RETRIES, backoff=0.5,
+                 max_backoff=30.0, limit=4, min_limit=1, max_limit=None,
+                 decrease=0.5, latency_factor=3.0):
+        self.session = session
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        # the moving average latency and, for each endpoint, its moving
+        # average and baseline latency
+        self.latency = None
+        self.latencies = {}
+        self.last_decrease = 0
+        # statistics
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+
+    def acquire(self):
+        """
+        Waits until there's room for another request in flight.
+        """
+        with self.condition:
+            while self.in_flight >= max(int(self.limit), 1):
+                self.condition.wait()
+            self.in_flight += 1
+            self.requests += 1
+
+    def release(self, elapsed=None, ok=True, endpoint=None):
+        """
+        Marks a request as finished, adjusting the limit to the request's
+        latency (if given) and outcome.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if elapsed is not None:
+                self.adjust(elapsed, ok, endpoint)
+            self.condition.notify_all()
+
+    def adjust(self, elapsed, ok, endpoint=None):
+        """
+        Applies AIMD to the limit (the caller must hold the condition).
+        """
+        congested = not ok
+        if ok:
+            if self.latency is None:
+                self.latency = elapsed
+            else:
+                self.latency = 0.8 * self.latency + 0.2 * elapsed
+            latencies = self.latencies.get(endpoint)
+            if latencies is None:
+                latencies = self.latencies[endpoint] = [elapsed, elapsed]
+            else:
+                average, baseline = latencies
+                latencies[0] = 0.8 * average + 0.2 * elapsed
+                if elapsed < baseline:
+                    latencies[1] = elapsed
+                else:
+                    latencies[1] += (elapsed - baseline) * BASELINE_DECAY
+            average, baseline = latencies
+            congested = average > (max(baseline, MIN_LATENCY) *
+                                   self.latency_factor)
+        if congested:
+            now = time.time()
+            if now - self.last_decrease > max(self.latency or 0, MIN_LATENCY):
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self.last_decrease = now
+                logger.info('In-flight request limit decreased to %.1f' %
+                            self.limit)
+        else:
+            self.limit += 1.0 / self.limit
+            if self.max_limit is not None:
+                self.limit = min(self.max_limit, self.limit)
+
+    def request(self, method, url, data=None, headers=None):
+        """
+        Makes the request (see the class docstring) and returns the response.
+        """
+        kind = endpoint(method, url)
+        attempt = 0
+        while True:
+            self.acquire()
+            start = time.time()
+            try:
+                response = self.session.request(method, url, data=data,
+                                                headers=headers)
+            except TRANSIENT_ERRORS, e:
+                ex_type, ex_val, ex_trace = sys.exc_info()
+                self.release(time.time() - start, False, kind)
+                if not self.retry(method, url, attempt, e):
+                    raise ex_type, ex_val, ex_trace
+            except:
+                self.release()
+                raise
+            else:
+                ok = response.status_code < 500
+                self.release(time.time() - start, ok, kind)
+                if ok or not self.retry(method, url, attempt,
+                                        response.status_code):
+                    return response
+            attempt += 1
+
+    def retry(self, method, url, attempt, reason):
+        """
+        Returns True (after waiting) if the failed request should be tried
+        again.
+        """
+        if method.upper() not in IDEMPOTENT_METHODS or attempt >= self.retries:
+            self.failed += 1
+            return False
+        delay = random.uniform(0, min(self.max_backoff,
+                                      self.backoff * 2 ** attempt))
+        logger.warning('%s %s failed (%s), retrying in %.2fs' % (method, url,
+                       reason, delay))
+        self.retried += 1
+        time.sleep(delay)
+        return True
+
+    def stats(self):
+        """
+        Returns a summary of the scheduler's statistics.
+        """
+        return 'Requests: %d made, %d retried, %d failed (in-flight limit'\
+            ' %.1f)' % (self.requests, self.retried, self.failed, self.limit)
+
+def install(fluid=None, **kwargs):
+    """
+    Wraps the HTTP session used by the fluid session (defaults to the bound
+    session) in a Scheduler (created with the given keyword arguments).
+
+    Returns the scheduler.
+    """
+    if fluid is None:
+        fluid = Fluid.bound
+    scheduler = Scheduler(fluid.db.session, **kwargs)
+    fluid.db.session = scheduler
+    return scheduler
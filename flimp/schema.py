@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Plans the namespaces and tags needed to import a dataset, reads what already
+exists in FluidDB and creates only what is missing.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import logging
+from collections import namedtuple
+from fom.mapping import tag_value
+from fom.errors import Fluid404Error, Fluid412Error
+from flimp import NAMESPACE_DESC, TAG_DESC
+from flimp.cache import SchemaCache, NAMESPACES, TAGS
+from flimp.workers import push_records, DEFAULT_WORKERS
+
+logger = logging.getLogger("flimp")
+
+# A namespace in the schema: its path and the names of the namespaces and tags
+# it should contain
+Node = namedtuple('Node', 'path namespaces tags')
+
+def default_type(value):
+    """
+    Returns the MIME type to use for values like the given value (or None if
+    FluidDB's primitive types will do).
+    """
+    if isinstance(value, list) and not all(isinstance(x, basestring) for
+                                           x in value):
+        logger.info("Found list that's not all strings, setting JSON tag value "
+                    "with MIME type 'application/json'")
+        return 'application/json'
+    return None
+
+def plan(template, root_path):
+    """
+    Given a template record and the path of the namespace to import it into
+    will return a tuple containing the levels of the schema (a list for each
+    depth of the tree containing a Node for each namespace at that depth,
+    starting with the root namespace) and a dict of tag_value instances (keyed
+    by tag path) to use to generate the FOM class.
+    """
+    levels = []
+    tags = {}
+    level = [(root_path, template)]
+    while level:
+        nodes = []
+        below = []
+        for path, template in level:
+            namespaces = []
+            tag_names = []
+            for key, value in template.iteritems():
+                # drop all the white space
+                key = key.strip()
+                child_path = path + '/' + key
+                if isinstance(value, dict):
+                    namespaces.append(key)
+                    below.append((child_path, value))
+                else:
+                    tag_names.append(key)
+                    # set the value straight away rather than wait for the
+                    # object to be saved (which flimp never does)
+                    tags[child_path] = tag_value(child_path,
+                                                 default_type(value),
+                                                 lazy_save=False)
+            nodes.append(Node(path, namespaces, tag_names))
+        levels.append(nodes)
+        level = below
+    return levels, tags
+
+def children(node):
+    """
+    Returns a list of (kind, path) tuples for the namespaces and tags that
+    should be in the node.
+    """
+    return ([(NAMESPACES, node.path + '/' + name) for name in node.namespaces] +
+            [(TAGS, node.path + '/' + name) for name in node.tags])
+
+def list_namespace(node, session):
+    """
+    Returns a tuple containing the sets of the names of the namespaces and
+    tags in the node's namespace.
+    """
+    response = session.namespaces[node.path].get(returnNamespaces=True,
+                                                 returnTags=True)
+    return (set(response.value['namespaceNames']),
+            set(response.value['tagNames']))
+
+def read_tree(levels, workers=DEFAULT_WORKERS, fluid=None):
+    """
+    Reads the namespaces in the schema's levels (see plan) that exist, a level
+    at a time with the namespaces in each level read concurrently. The root
+    namespace must exist.
+
+    Namespaces whose contents are all known to the bound SchemaCache aren't
+    read.
+
+    Returns the set of the paths of the namespaces and tags that exist.
+    """
+    cache = SchemaCache.bound
+    existing = set([levels[0][0].path])
+    for level in levels:
+        nodes = []
+        for node in level:
+            if node.path not in existing:
+                # so neither does anything in it
+                continue
+            paths = children(node)
+            if cache and all(cache.known(kind, path) for kind, path in paths):
+                existing.update(path for kind, path in paths)
+            else:
+                nodes.append(node)
+        for result in push_records(list_namespace, nodes, workers,
+                                   fluid=fluid):
+            node = nodes[result.index - 1]
+            if isinstance(result.error, Fluid404Error):
+                # it has gone since it was cached
+                existing.discard(node.path)
+                continue
+            elif result.error:
+                raise result.error
+            namespaces, tags = result.value
+            for kind, path in children(node):
+                name = path.rsplit('/', 1)[1]
+                if name in (namespaces if kind == NAMESPACES else tags):
+                    existing.add(path)
+                    if cache:
+                        cache.add(kind, path)
+    return existing
+
+def create_missing(levels, existing, name, desc, workers=DEFAULT_WORKERS,
+                   fluid=None):
+    """
+    Creates the namespaces and tags in the schema's levels (see plan) that
+    aren't in existing. Namespaces are created a level at a time, along with
+    the tags in the level above, concurrently.
+
+    name and desc are the name and description of the dataset (used when
+    setting the descriptions of the new namespaces and tags).
+
+    Returns the number of namespaces and tags created.
+    """
+    cache = SchemaCache.bound
+
+    def create(task, session):
+        kind, path = task
+        parent, child = path.rsplit('/', 1)
+        try:
+            logger.info('Creating %r' % path)
+            if kind == NAMESPACES:
+                session.namespaces[parent].post(child,
+                                                NAMESPACE_DESC % (child, name,
+                                                                  desc))
+            else:
+                session.tags[parent].post(child, TAG_DESC % (child, name, desc),
+                                          False)
+        except Fluid412Error:
+            # 412 simply means it was created in the meantime
+            logger.info('%r already existed' % path)
+        if cache:
+            cache.add(kind, path)
+
+    created = 0
+    for depth in range(1, len(levels) + 1):
+        tasks = []
+        if depth < len(levels):
+            tasks.extend((NAMESPACES, node.path) for node in levels[depth])
+        for node in levels[depth - 1]:
+            tasks.extend((TAGS, node.path + '/' + tag) for tag in node.tags)
+        tasks = [task for task in tasks if task[1] not in existing]
+        for result in push_records(create, tasks, workers, fluid=fluid):
+            if result.error:
+                raise result.error
+            created += 1
+    return created
+
+def build_schema(template, root_path, name, desc, workers=DEFAULT_WORKERS,
+                 fluid=None):
+    """
+    Given a template record, the path of the (existing) namespace to import it
+    into and the dataset's name and description will make sure the namespaces
+    and tags needed to import the dataset exist. Uses workers concurrent
+    requests.
+
+    Returns a dict of tag_value instances (keyed by tag path) to use to
+    generate the FOM class.
+    """
+    levels, tags = plan(template, root_path)
+    existing = read_tree(levels, workers, fluid)
+    created = create_missing(levels, existing, name, desc, workers, fluid)
+    logger.info('Schema: %d namespaces and tags existed, %d created' %
+                (len(existing) - 1, created))
+    return tags
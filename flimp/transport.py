@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+A pool of persistent (keep-alive) HTTP connections to FluidDB that can stand
+in for the HTTP session used by fom. Reusing connections saves setting up a
+new TCP connection (and TLS session) for every request.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import socket
+import httplib
+import logging
+import threading
+from urlparse import urlsplit
+from Queue import LifoQueue, Empty, Full
+from fom.session import Fluid
+
+logger = logging.getLogger("flimp")
+
+# The default number of idle connections kept open
+DEFAULT_POOL_SIZE = 10
+
+CONNECTION_TYPES = {
+    'http': httplib.HTTPConnection,
+    'https': httplib.HTTPSConnection,
+}
+
+# Requests that can safely be made more than once
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+
+class Headers(dict):
+    """
+    The headers of a response, looked up regardless of case. As with the
+    headers of a response from the requests library a header that is missing
+    is None rather than a KeyError (fom reads the content-type of every
+    response, but FluidDB doesn't send one with a 204).
+    """
+
+    def __init__(self, items=()):
+        if hasattr(items, 'items'):
+            items = items.items()
+        dict.__init__(self, ((key.lower(), value) for key, value in items))
+
+    def __getitem__(self, key):
+        return dict.get(self, key.lower())
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key.lower())
+
+    def get(self, key, default=None):
+        return dict.get(self, key.lower(), default)
+
+class Response(object):
+    """
+    The parts of a response from the requests library that fom makes use of.
+    """
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        if not isinstance(headers, Headers):
+            headers = Headers(headers)
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        """
+        The content of the response decoded as unicode (using the charset
+        given in the content-type header if there is one).
+        """
+        encoding = 'utf-8'
+        for param in (self.headers['content-type'] or '').split(';')[1:]:
+            key, sep, value = param.strip().partition('=')
+            if key.lower() == 'charset' and value:
+                encoding = value.strip('"\'')
+        return self.content.decode(encoding, 'replace')
+
+class ConnectionPool(object):
+    """
+    A thread safe pool of keep-alive connections to the host in base_url. It
+    has the same request method as a requests session so it can be used by
+    fom (see install).
+
+    Up to size idle connections are kept open to be reused. If more requests
+    than that are made at the same time extra connections are opened and then
+    closed once they have been used.
+
+    Counts the connections that are opened, reused and closed.
+    """
+
+    def __init__(self, base_url, size=DEFAULT_POOL_SIZE, timeout=None):
+        if size < 1:
+            raise ValueError('The pool must hold at least one connection')
+        parts = urlsplit(base_url)
+        if parts.scheme not in CONNECTION_TYPES:
+            raise ValueError('Unsupported URL scheme %r' % parts.scheme)
+        self.connection_type = CONNECTION_TYPES[parts.scheme]
+        self.host = parts.netloc
+        self.size = size
+        self.timeout = timeout
+        self.idle = LifoQueue(size)
+        self.lock = threading.Lock()
+        # statistics
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+
+    def count(self, stat):
+        """
+        Increments the referenced statistic.
+        """
+        with self.lock:
+            setattr(self, stat, getattr(self, stat) + 1)
+
+    def get_connection(self):
+        """
+        Returns a tuple containing an idle connection (or a new one if there
+        are none) and a flag to indicate if it has been used before.
+        """
+        try:
+            connection = self.idle.get_nowait()
+            self.count('reused')
+            return connection, True
+        except Empty:
+            self.count('opened')
+            if self.timeout is None:
+                return self.connection_type(self.host), False
+            return self.connection_type(self.host, timeout=self.timeout), False
+
+    def put_connection(self, connection):
+        """
+        Returns the connection to the pool (or closes it if the pool is
+        full).
+        """
+        try:
+            self.idle.put_nowait(connection)
+        except Full:
+            self.close_connection(connection)
+
+    def close_connection(self, connection):
+        """
+        Closes the connection.
+        """
+        connection.close()
+        self.count('closed')
+
+    def request(self, method, url, data=None, headers=None):
+        """
+        Makes the request using a connection from the pool and returns the
+        Response.
+
+        If a connection that has been used before fails (the server may have
+        closed it while it was idle) the request is tried again with a new
+        one. Once the request has been sent that is only done for idempotent
+        methods: the server may have acted on a POST whose response was lost,
+        and sending it again would, for example, create a second object.
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        while True:
+            connection, reused = self.get_connection()
+            sent = False
+            try:
+                connection.request(method, path, data, headers or {})
+                sent = True
+                response = connection.getresponse()
+                content = response.read()
+            except (httplib.HTTPException, socket.error), e:
+                self.close_connection(connection)
+                retry = not sent or method.upper() in IDEMPOTENT_METHODS
+                if reused and retry:
+                    logger.info('Reused connection failed (%r), retrying' %
+                                e)
+                    continue
+                raise
+            break
+        if response.will_close:
+            self.close_connection(connection)
+        else:
+            self.put_connection(connection)
+        return Response(response.status, Headers(response.getheaders()),
+                        content)
+
+    def close(self):
+        """
+        Closes all the idle connections.
+        """
+        while True:
+            try:
+                connection = self.idle.get_nowait()
+            except Empty:
+                break
+            self.close_connection(connection)
+
+    def stats(self):
+        """
+        Returns a summary of the connection statistics.
+        """
+        return 'Connections: %d opened, %d reused, %d closed' % (
+            self.opened, self.reused, self.closed)
+
+def install(fluid=None, size=DEFAULT_POOL_SIZE, timeout=None):
+    """
+    Replaces the HTTP session used by the fluid session (defaults to the bound
+    session) with a ConnectionPool. Everything that uses the session, such as
+    flimp.utils.process_data_list and flimp.directory_handler.push_to_fluiddb,
+    then reuses the pool's connections.
+
+    Returns the pool.
+    """
+    if fluid is None:
+        fluid = Fluid.bound
+    pool = ConnectionPool(fluid.db.base_url, size, timeout)
+    fluid.db.session = pool
+    return pool
@@ -24,10 +24,26 @@ THE SOFTWARE.
 """
 import os
 import logging
+from itertools import chain
+from collections import namedtuple
 logger = logging.getLogger("flimp")
-from fom.errors import Fluid412Error
-from fom.mapping import Namespace, Tag, Object, tag_value
+from fom.errors import Fluid404Error, Fluid412Error
+from fom.mapping import Namespace, Tag, Object
 from flimp import NAMESPACE_DESC, TAG_DESC
+from flimp.workers import push_records, DEFAULT_WORKERS
+from flimp.cache import SchemaCache, NAMESPACES, TAGS
+from flimp.schema import build_schema
+from flimp.direct import DirectWriter
+
+# A tag value to take from each record (see compile_plan): the keys that lead
+# to the value in the record, the name of the attribute on the FOM class, the
+# tag's path and whether the value may be set with FluidDB's /values endpoint
+# (only if the tag doesn't have a MIME type of its own)
+Step = namedtuple('Step', 'keys attribute tagpath plain')
+
+# The paths of the namespaces this process knows to exist (so they're never
+# checked or created twice)
+_resolved = set()
 
 def make_namespace(path, name, desc):
     """
@@ -41,17 +57,37 @@ def make_namespace(path, name, desc):
 
     desc - the description of the dataset that's causing the namespace to be
     create (used when setting the description of the new namespace)
+
+    If the namespace has already been resolved by this process, or a
+    SchemaCache is bound and knows the namespace exists, then FluidDB isn't
+    asked.
     """
+    cache = SchemaCache.bound
+    if path in _resolved or (cache and cache.known(NAMESPACES, path)):
+        logger.info('%r is known to exist' % path)
+        _resolved.add(path)
+        return Namespace(path)
+    ns_head, ns_tail = os.path.split(path)
+    result = Namespace(path)
     try:
         logger.info('Checking namespace %r' % path)
-        ns_head, ns_tail = os.path.split(path)
-        result = Namespace(path)
-        result.create(NAMESPACE_DESC % (ns_tail, name, desc))
+        try:
+            result.create(NAMESPACE_DESC % (ns_tail, name, desc))
+        except Fluid404Error:
+            # the parent doesn't exist although the cache said it did
+            if not (cache and '/' in ns_head):
+                raise
+            logger.info('%r has gone, refreshing the cache' % ns_head)
+            forget_namespace(ns_head)
+            make_namespace_path(ns_head, name, desc)
+            result.create(NAMESPACE_DESC % (ns_tail, name, desc))
         logger.info('Done')
     except Fluid412Error:
         # 412 simply means the namespace already exists
-        result = Namespace(path)
         logger.info('%r already existed' % result.path)
+    _resolved.add(path)
+    if cache:
+        cache.add(NAMESPACES, path)
     return result
 
 def make_tag(parent_ns, name, dataset, desc, indexed=False):
@@ -71,15 +107,36 @@ def make_tag(parent_ns, name, dataset, desc, indexed=False):
 
     indexed - flag to indicate if the tag is to be indexed for full text
     search
+
+    If a SchemaCache is bound and knows the tag exists then FluidDB isn't
+    asked.
     """
+    path = parent_ns.path + '/' + name
+    cache = SchemaCache.bound
+    if cache and cache.known(TAGS, path):
+        logger.info('%r is known to exist' % path)
+        return Tag(path)
     try:
         logger.info('Creating new tag "%r" under %r' % (name, parent_ns.path))
-        tag = parent_ns.create_tag(name, TAG_DESC % (name, dataset, desc), False)
+        try:
+            tag = parent_ns.create_tag(name, TAG_DESC % (name, dataset, desc),
+                                       False)
+        except Fluid404Error:
+            # the namespace doesn't exist although the cache said it did
+            if not (cache and '/' in parent_ns.path):
+                raise
+            logger.info('%r has gone, refreshing the cache' % parent_ns.path)
+            forget_namespace(parent_ns.path)
+            make_namespace_path(parent_ns.path, dataset, desc)
+            tag = parent_ns.create_tag(name, TAG_DESC % (name, dataset, desc),
+                                       False)
         logger.info('Tag %r created' % tag.path)
     except Fluid412Error:
         # 412 simply means the tag already exists
-        tag = Tag(parent_ns.path + '/' + name)
+        tag = Tag(path)
         logger.info('%r already existed' % tag.path)
+    if cache:
+        cache.add(TAGS, path)
     return tag
 
 def make_namespace_path(path, name, desc):
@@ -88,6 +145,12 @@ def make_namespace_path(path, name, desc):
     namespaces exist or else create them. Will return the final namespace
     (referring to "baz" in the example given just now).
 
+    Only the missing namespaces at the end of the path are created. The
+    deepest namespace that exists is found by checking the whole path and
+    then bisecting on depth, starting below the deepest namespace known to
+    exist (see make_namespace), so an existing path takes at most one
+    request.
+
     path - the path to be checked/created
 
     name - the name of the dataset that is causing the namespaces to be
@@ -96,28 +159,104 @@ def make_namespace_path(path, name, desc):
     desc - the description of the dataset that's causing the namespace to
     be created (used when setting the description of the new tag)
     """
-    namespace_path = path.split('/')
-    # put the user's root namespace in the checked_namespaces since it will
-    # (should) already exist and we can't create it anyway!
-    checked_namespaces = namespace_path[0]
-    for namespace in namespace_path[1:]:
-        if checked_namespaces:
-            ns_path = os.path.join(checked_namespaces, namespace)
-        else:
-            ns_path = namespace
-        ns = make_namespace(ns_path, name, desc)
-        checked_namespaces = ns.path
+    segments = path.split('/')
+    paths = ['/'.join(segments[:depth + 1]) for depth in range(len(segments))]
+    cache = SchemaCache.bound
+    # the user's root namespace (at depth 0) will (should) already exist and
+    # we can't create it anyway!
+    found = 0
+    for depth in range(len(paths) - 1, 0, -1):
+        if paths[depth] in _resolved or (cache and
+                                         cache.known(NAMESPACES, paths[depth])):
+            found = depth
+            break
+    if found < len(paths) - 1:
+        # the namespaces in (found, missing) are yet to be checked
+        missing = len(paths)
+        depth = len(paths) - 1
+        while missing - found > 1:
+            if namespace_exists(paths[depth]):
+                found = depth
+            else:
+                missing = depth
+            depth = (found + missing) // 2
+    for known in paths[1:found + 1]:
+        _resolved.add(known)
+        if cache:
+            cache.add(NAMESPACES, known)
+    ns = Namespace(paths[found])
+    for missing_path in paths[found + 1:]:
+        ns = make_namespace(missing_path, name, desc)
     return ns
 
-def process_data_list(raw_data, root_path, name, desc, about, allowEmpty=True):
+def namespace_exists(path):
+    """
+    Returns True if the namespace with the given path exists.
+    """
+    logger.info('Checking namespace %r exists' % path)
+    try:
+        Namespace(path).fluid.namespaces[path].get()
+    except Fluid404Error:
+        return False
+    return True
+
+def forget_namespace(path):
+    """
+    Forgets that the namespace with the given path (and everything underneath
+    it) was known to exist - for example because it has since been deleted.
+    """
+    for known in list(_resolved):
+        if known == path or known.startswith(path + '/'):
+            _resolved.discard(known)
+    cache = SchemaCache.bound
+    if cache:
+        cache.invalidate(path)
+
+def process_data_list(raw_data, root_path, name, desc, about, allowEmpty=True,
+                      workers=1, queue_size=None, bulk=False, journal=None,
+                      delta=None, direct=False, payload_cache=None):
     """
     Given a raw-data list of dictionaries that represent objects to be tagged
     in FluidDB this function will create the required tags and namespaces,
     create the FOM class and then use it to push the data to FluidDB
+
+    raw_data may also be an iterator (for example, the generator returned by a
+    parser's iterparse function) in which case the records are consumed one
+    at a time and never held in memory all at once.
+
+    The records are pushed to FluidDB concurrently if workers is more than 1
+    (see push_to_fluiddb). If bulk is True each record's tag values are set
+    with a single request. If a journal is given the records already imported
+    are skipped. If a delta index is given only what has changed since the
+    last import is pushed. If direct is True the tag values are sent straight
+    to FluidDB (see flimp.direct.DirectWriter) with their payloads encoded
+    using payload_cache (if given).
+
+    Returns the number of records that were processed.
+    """
+    fom_class, records = prepare_import(raw_data, root_path, name, desc,
+                                        workers)
+
+    # Given the newly existing class push all the data to FluidDB
+    logger.info('Starting to push records to FluidDB')
+    return push_to_fluiddb(records, root_path, fom_class, about, name,
+                           allowEmpty, workers, queue_size, bulk, journal,
+                           delta, direct, payload_cache)
+
+def prepare_import(raw_data, root_path, name, desc, workers=DEFAULT_WORKERS):
+    """
+    Given the raw data (a list or iterator of dictionaries) will create the
+    required tags and namespaces (using the first record as a template and
+    workers concurrent requests) and the FOM class to use to push the data to
+    FluidDB.
+
+    Returns a tuple containing the FOM class and an iterator over *all* the
+    records (see peek).
     """
     # Use the first item in the list of items
+    template, records = peek(raw_data)
     logger.info('Creating namespace/tag schema in FluidDB')
-    tag_dict = create_schema(raw_data, root_path, name, desc)
+    tag_dict = create_schema([template], root_path, name, desc, workers)
     logger.info('Created %d new tag[s]' % len(tag_dict))
     logger.info(tag_dict.keys())
 
@@ -126,27 +265,50 @@ def process_data_list(raw_data, root_path, name, desc, about, allowEmpty=True):
     logger.info('Creating new FOM Object class')
     fom_class = create_class(tag_dict)
     logger.info(dir(fom_class))
+    return fom_class, records
 
-    # Given the newly existing class push all the data to FluidDB
-    logger.info('Starting to push records to FluidDB')
-    push_to_fluiddb(raw_data, root_path, fom_class, about, name, allowEmpty)
+def peek(raw_data):
+    """
+    Given a list (or any other iterable) of records will return a tuple
+    containing the first record (to be used as a template) and an iterator
+    over *all* the records including the first one.
 
-def validate(raw_data):
+    Raises a ValueError if there are no records.
+    """
+    records = iter(raw_data)
+    try:
+        first = records.next()
+    except StopIteration:
+        raise ValueError('No records found')
+    return first, chain([first], records)
+
+def validate(raw_data, count_problems=False):
     """
     Given the raw data as a list of dictionaries this function will check
     each record to make sure it is valid. "Valid" in this case means that the
     shape of each dictionary is the same - they have the same keys.
 
-    Returns lists indicating location of missing and extra fields.
+    Returns lists indicating location of missing and extra fields (followed
+    by the number of records that had problems if count_problems is True).
+
+    raw_data may also be an iterator, in which case the records are checked as
+    they are consumed.
     """
     # We use the first record as the template
-    default = raw_data[0]
+    records = iter(raw_data)
+    default = records.next()
     # To store the results of the validation
     missing_log = []
     extras_log = []
-    for record in raw_data[1:]:
+    problems = 0
+    for record in records:
+        found = len(missing_log) + len(extras_log)
         validate_dict(default, record, record, missing_log, extras_log)
+        if len(missing_log) + len(extras_log) > found:
+            problems += 1
     # return the correct response
+    if count_problems:
+        return missing_log, extras_log, problems
     return missing_log, extras_log
 
 def validate_dict(template, to_be_checked, parent, missing_log, extras_log):
@@ -167,7 +329,7 @@ def validate_dict(template, to_be_checked, parent, missing_log, extras_log):
             # check the inner dictionary
             validate_dict(val, to_be_checked[key], parent, missing_log, extras_log)
 
-def create_schema(raw_data, root_path, name, desc):
+def create_schema(raw_data, root_path, name, desc, workers=DEFAULT_WORKERS):
     """
     Given the raw data, root_path, dataset name and description will use the
     first record in raw_data as a template for generating namespaces and tags
@@ -175,51 +337,32 @@ def create_schema(raw_data, root_path, name, desc):
 
     e.g. username/name/...
 
+    The namespaces and tags that already exist are read (a level of the tree
+    at a time) and only those that are missing are created, using workers
+    concurrent requests (see flimp.schema.build_schema).
+
     Returns an appropriate dict object to use as the basis of generating the
     attributes on a new FOM Object class.
     """
     template = raw_data[0]
-    root_ns = make_namespace_path(root_path, name, desc)
-    tags = {}
-    generate(root_ns, None, template, desc, name, tags)
-    return tags
+    make_namespace_path(root_path, name, desc)
+    return build_schema(template, root_path, name, desc, workers)
 
-def generate(parent, child_name, template, description, name, tags):
+def generate(parent, child_name, template, description, name, tags,
+             workers=DEFAULT_WORKERS):
     """
-    A recursive function that traverses the "tree" in a dict to create new
-    namespaces and/or tags as required.
+    Creates the namespaces and tags needed for the "tree" in the template dict
+    underneath the child_name namespace (if given) of the parent namespace
+    (see flimp.schema.build_schema).
 
     Populates the "tags" dict with tag_value instances so it's possible to
     generate FOM Object based classes based on the newly created tags.
     """
-    # Create the child namespace
+    path = parent.path
     if child_name:
-        ns = make_namespace('/'.join([parent.path, child_name]), name, description)
-    else:
-        ns = parent
-
-    for key, value in template.iteritems():
-        # drop all the white space
-        key = key.strip()
-        # lets see what's in here
-        if isinstance(value, dict):
-            # ok... we have another dict, so we're doing depth first traversal
-            # and jump right in
-            generate(ns, key, value, description, name, tags)
-        else:
-            # it must be a tag so create the tag within the current namespace
-            tag = make_tag(ns, key, description, False)
-            # Create the tag_value instance...
-            # Lets make sure we specify the right sort of mime
-            defaultType = None
-            if isinstance(value, list) and not all(isinstance(x, basestring) for
-                                                 x in value):
-                defaultType = 'application/json'
-                logger.info("Found list that's not all strings, setting JSON tag value "
-                            "with MIME type %r" % defaultType)
-            attribute_name = tag.path
-            logger.info('Mapping tag: %r to attribute: %r' % (tag.path, attribute_name))
-            tags[attribute_name] = tag_value(tag.path, defaultType)
+        path = make_namespace('/'.join([path, child_name]), name,
+                              description).path
+    tags.update(build_schema(template, path, name, description, workers))
 
 def create_class(tags):
     """
@@ -228,37 +371,167 @@ def create_class(tags):
     """
     return type('fom_class', (Object, ), tags)
 
-def push_to_fluiddb(raw_data, root_path, klass, about, name, allowEmpty=True):
+def push_to_fluiddb(raw_data, root_path, klass, about, name, allowEmpty=True,
+                    workers=1, queue_size=None, bulk=False, journal=None,
+                    delta=None, direct=False, payload_cache=None):
     """
     Given the raw data and a class derived from FOM's Object class will import
     the data into FluidDB. Each item in the list mapping to a new object in
     FluidDB. The 'about' and 'name' arguments are used to automate the
     generation of the about tag and associated value.
+
+    raw_data may be a list or an iterator. In the latter case records are
+    counted (and reported) as they are processed.
+
+    If workers is more than 1 the records are pushed concurrently by that many
+    worker threads (see flimp.workers.push_records) with at most queue_size
+    records waiting for a worker. A record that fails doesn't stop the others
+    but a RuntimeError is raised once they have all been pushed.
+
+    If bulk is True each record's tag values are set with a single request
+    (see set_tag_values).
+
+    If a journal (see flimp.journal.Journal) is given the records it says are
+    done are skipped and the others are recorded in it once they've been
+    pushed.
+
+    If a delta index (see flimp.delta.DeltaIndex or RemoteDiff) is given only
+    the records and tag values that are new or have changed since the last
+    import are pushed. This needs the about field.
+
+    If direct is True the tag values are set with requests sent straight to
+    the session's transport rather than through klass (see
+    flimp.direct.DirectWriter). If a payload_cache (see
+    flimp.direct.PayloadCache) is given the values are encoded with it.
+
+    Returns the number of records that were processed.
     """
-    length = len(raw_data)
-    for counter, item in enumerate(raw_data):
-        logger.info("Processing record %d of %d" % (counter + 1, length))
-        # create the object
-        if about:
-            about_value = "%s:%s" % (name, item[about])
-            logger.info('Creating new object with about tag value: %r' %
-                     about_value)
-            obj = klass(about=about_value)
-        else:
-            logger.info('Creating a new anonymous object')
-            obj = klass()
-            obj.create()
-        logger.info('Object %r successfully created' % obj.uid)
-        # annotate it
-        tag_values = get_values(item, root_path)
-        for key, value in tag_values.iteritems():
-            set_tag_value(klass, obj, key, value, allowEmpty)
-        if about:
-            logger.info('Finished annotating Object about %r with id: %r' %
-                         (about_value, obj.uid))
+    if delta and not about:
+        raise ValueError('Only records with an about tag value can be'
+                         ' imported as a delta')
+    if delta:
+        raw_data = delta.prefetch(raw_data, root_path, about, name,
+                                  journal and journal.imported)
+    plan = compile_plan(klass, root_path)
+    writer = direct and DirectWriter(klass, cache=payload_cache) or None
+    if workers > 1:
+        def push(item, session):
+            obj = push_record(item, root_path, klass, about, name,
+                              allowEmpty, session, bulk, delta, plan, writer)
+            return obj and obj.uid
+        counter = failed = 0
+        skip = journal and journal.done or None
+        for counter, result in enumerate(push_records(push, raw_data, workers,
+                                                      queue_size, skip=skip),
+                                         1):
+            if result.error is None:
+                if result.value:
+                    logger.info('Record %d pushed to object %r' %
+                                (result.index, result.value))
+                if journal:
+                    journal.record(result.index)
+            else:
+                failed += 1
+        if failed:
+            raise RuntimeError('%d of %d records failed to import (see the'
+                               ' log for details)' % (failed, counter))
+        return counter
+    try:
+        length = len(raw_data)
+    except TypeError:
+        # an iterator so we can't know the length up front
+        length = None
+    counter = 0
+    for counter, item in enumerate(raw_data, 1):
+        if journal and journal.done(counter):
+            continue
+        if length is None:
+            logger.info("Processing record %d" % counter)
         else:
-            logger.info('Finished annotating anonymous Object with id: %r' %
-                         obj.uid)
+            logger.info("Processing record %d of %d" % (counter, length))
+        push_record(item, root_path, klass, about, name, allowEmpty,
+                    bulk=bulk, delta=delta, plan=plan, writer=writer)
+        if journal:
+            journal.record(counter)
+    return counter
+
+def push_record(item, root_path, klass, about, name, allowEmpty=True,
+                fluid=None, bulk=False, delta=None, plan=None, writer=None):
+    """
+    Given a single record (dictionary) and a class derived from FOM's Object
+    class will create (or get) the object for the record and tag it with the
+    record's values. The object is created using the fluid session (defaults
+    to the bound session).
+
+    If bulk is True the tag values are set with a single request (see
+    set_tag_values) rather than one request each.
+
+    If a delta index (see flimp.delta.DeltaIndex) is given only the tag
+    values that are new or have changed since the last import are set.
+
+    The record's values are taken using plan (see compile_plan) which is
+    compiled from klass if it isn't given. If a writer (see
+    flimp.direct.DirectWriter) is given the values are set with it.
+
+    Returns the resulting object (or None if the record hasn't changed).
+    """
+    if plan is None:
+        plan = compile_plan(klass, root_path)
+    tag_values = plan.values(item)
+    if delta:
+        about_value = "%s:%s" % (name, item[about])
+        tag_values, entry = delta.changes(about_value, tag_values)
+        if not tag_values:
+            logger.info('Object about %r is unchanged' % about_value)
+            return None
+    obj = make_object(item, klass, about, name, fluid)
+    annotate(obj, klass, tag_values, allowEmpty, bulk, plan, writer, fluid)
+    if about:
+        logger.info('Finished annotating Object about %r with id: %r' %
+                     ("%s:%s" % (name, item[about]), obj.uid))
+    else:
+        logger.info('Finished annotating anonymous Object with id: %r' %
+                     obj.uid)
+    if delta:
+        delta.update(about_value, entry)
+    return obj
+
+def annotate(obj, klass, tag_values, allowEmpty=True, bulk=False, plan=None,
+             writer=None, fluid=None):
+    """
+    Sets the tag values (see get_values) taken from a record using plan (see
+    compile_plan) on the record's object (see push_record for bulk and
+    writer).
+    """
+    if writer and bulk:
+        values, others = plan.split(tag_values, allowEmpty)
+        if values:
+            writer.put_values(obj.uid, values, fluid)
+        writer.set_values(obj.uid, others, allowEmpty, fluid)
+    elif writer:
+        writer.set_values(obj.uid, tag_values, allowEmpty, fluid)
+    elif bulk:
+        set_tag_values(klass, obj, tag_values, allowEmpty, plan)
+    else:
+        plan.set_values(obj, tag_values, allowEmpty)
+
+def make_object(item, klass, about, name, fluid=None):
+    """
+    Given a single record (dictionary) will return a new instance of klass
+    for the object about the record's about field (prefixed with the name of
+    the dataset) or a new anonymous object if about isn't given.
+    """
+    if about:
+        about_value = "%s:%s" % (name, item[about])
+        logger.info('Creating new object with about tag value: %r' %
+                 about_value)
+        obj = klass(about=about_value, fluid=fluid)
+    else:
+        logger.info('Creating a new anonymous object')
+        obj = klass(fluid=fluid)
+        obj.create()
+    logger.info('Object %r successfully created' % obj.uid)
+    return obj
 
 def set_tag_value(klass, obj, key, value, allowEmpty):
     if key in klass.__dict__:
@@ -272,6 +545,64 @@ def set_tag_value(klass, obj, key, value, allowEmpty):
         # ToDo: Do we want to handle unknown tag values..?
         logger.error('Unable to set %r (unknown attribute)' % key)
 
+def set_tag_values(klass, obj, tag_values, allowEmpty, plan=None):
+    """
+    Given a dict of tag values (see get_values) will set them all on the
+    object with a single request to FluidDB's /values endpoint. Values the
+    endpoint can't handle (those with a MIME type other than FluidDB's
+    primitive type, such as the application/json lists found by generate) are
+    set one at a time by set_tag_value.
+
+    If the plan the values were taken with (see compile_plan) is given it's
+    used to split them rather than klass.
+    """
+    if plan:
+        values, others = plan.split(tag_values, allowEmpty)
+    else:
+        values, others = split_values(klass, tag_values, allowEmpty)
+    if values:
+        obj.fluid.values.put('fluiddb/id = "%s"' % obj.uid, values)
+        logger.info('Set %d tag values on %r' % (len(values), obj.uid))
+    for key, value in others.iteritems():
+        set_tag_value(klass, obj, key, value, allowEmpty)
+
+def split_values(klass, tag_values, allowEmpty):
+    """
+    Given a FOM class and a dict of tag values (see get_values) returns a
+    tuple containing:
+
+    * a dict of the values that can be set with FluidDB's /values endpoint
+      in the form it expects: {tag path: {'value': value}}
+    * a dict of the remaining values (attribute name -> value) that need to
+      be set one at a time with set_tag_value
+
+    Unknown attributes and empty values (unless allowEmpty) are dropped in the
+    same way as set_tag_value.
+    """
+    values = {}
+    others = {}
+    for key, value in tag_values.iteritems():
+        attribute = klass.__dict__.get(key)
+        if attribute is None:
+            logger.error('Unable to set %r (unknown attribute)' % key)
+        elif not (allowEmpty or not value is None):
+            logger.info('%r ignored because it was empty' % key)
+        elif attribute.content_type or not is_primitive(value):
+            others[key] = value
+        else:
+            values[attribute.tagpath] = {'value': value}
+    return values, others
+
+def is_primitive(value):
+    """
+    Returns True if the value is of one of FluidDB's primitive types (None,
+    booleans, numbers, strings and lists of strings).
+    """
+    if isinstance(value, (list, tuple)):
+        return all(isinstance(x, basestring) for x in value)
+    return value is None or isinstance(value, (bool, int, long, float,
+                                               basestring))
+
 def get_values(item, parent):
     """
     Given a dictionary that represents data to import into FluidDB this method
@@ -285,3 +616,100 @@ def get_values(item, parent):
         else:
             vals[os.path.join(parent, key)] = value
     return vals
+
+def compile_plan(klass, root_path):
+    """
+    Given a FOM class (see create_class) and the path of the namespace the
+    dataset is imported into will return a FlatteningPlan for taking the
+    class's tag values from each record.
+    """
+    steps = []
+    prefix = root_path + '/'
+    for attribute, value in klass.__dict__.iteritems():
+        if attribute.startswith(prefix):
+            keys = tuple(attribute[len(prefix):].split('/'))
+            steps.append(Step(keys, attribute,
+                              getattr(value, 'tagpath', attribute),
+                              not getattr(value, 'content_type', None)))
+    steps.sort()
+    return FlatteningPlan(steps)
+
+class FlatteningPlan(object):
+    """
+    The tag values to take from each record, worked out once from the
+    template (see compile_plan) rather than for every record. A drop-in
+    replacement for get_values, split_values and set_tag_value for records
+    that follow the template, except that values whose keys aren't in the
+    template are ignored rather than logged.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        # (key, attribute) for the values at the top of each record
+        self.flat = [(step.keys[0], step.attribute) for step in steps if
+                     len(step.keys) == 1]
+        # (keys, attribute) for the values in nested dicts
+        self.nested = [(step.keys, step.attribute) for step in steps if
+                       len(step.keys) > 1]
+        self.attributes = dict((step.attribute, step) for step in steps)
+
+    def values(self, item):
+        """
+        Returns a dict of the record's values keyed by the name of their
+        attribute on the FOM class (see get_values).
+        """
+        vals = {}
+        for key, attribute in self.flat:
+            if key in item:
+                value = item[key]
+                # a nested dict where the template had a value can't be set
+                if not isinstance(value, dict):
+                    vals[attribute] = value
+        for keys, attribute in self.nested:
+            value = item
+            try:
+                for key in keys:
+                    value = value[key]
+            except (KeyError, TypeError):
+                # the record doesn't have this value
+                continue
+            if not isinstance(value, dict):
+                vals[attribute] = value
+        return vals
+
+    def split(self, tag_values, allowEmpty):
+        """
+        Given a dict of tag values (see values) returns a tuple containing the
+        dict of values to set with FluidDB's /values endpoint and the dict of
+        the others (see split_values).
+        """
+        values = {}
+        others = {}
+        attributes = self.attributes
+        for attribute, value in tag_values.iteritems():
+            if value is None and not allowEmpty:
+                continue
+            step = attributes.get(attribute)
+            if step is None:
+                logger.error('Unable to set %r (unknown attribute)' % attribute)
+            elif step.plain and is_primitive(value):
+                values[step.tagpath] = {'value': value}
+            else:
+                others[attribute] = value
+        return values, others
+
+    def set_values(self, obj, tag_values, allowEmpty):
+        """
+        Sets the tag values (see values) on the object one at a time (see
+        set_tag_value).
+        """
+        count = 0
+        for attribute, value in tag_values.iteritems():
+            if value is None and not allowEmpty:
+                continue
+            if attribute in self.attributes:
+                setattr(obj, attribute, value)
+                count += 1
+            else:
+                logger.error('Unable to set %r (unknown attribute)' % attribute)
+        logger.info('Set %d tag values on %r' % (count, obj.uid))
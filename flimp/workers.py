@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+A small engine for pushing records to FluidDB concurrently. Each worker thread
+has its own fom session so the HTTP requests for different records don't have
+to wait for each other.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import logging
+import threading
+from collections import namedtuple
+from Queue import Queue, Empty
+from fom.session import Fluid
+from flimp.transport import ConnectionPool
+from flimp.scheduler import Scheduler
+logger = logging.getLogger("flimp")
+
+# The default number of worker threads
+DEFAULT_WORKERS = 8
+
+# The outcome of pushing a single record: its (1-based) position in the input,
+# the value returned by the push function and the exception raised (if any)
+PushResult = namedtuple('PushResult', 'index value error')
+
+def clone_session(fluid):
+    """
+    Given a fom session will return a new session that talks to the same
+    FluidDB instance with the same credentials. It has its own connections
+    unless the session uses a (thread safe) flimp.transport.ConnectionPool or
+    flimp.scheduler.Scheduler, in which case that is shared.
+    """
+    session = Fluid(fluid.db.base_url)
+    session.db.headers.update(fluid.db.headers)
+    if isinstance(fluid.db.session, (ConnectionPool, Scheduler)):
+        session.db.session = fluid.db.session
+    return session
+
+def push_records(push, records, workers=DEFAULT_WORKERS, queue_size=None,
+                 fluid=None, skip=None):
+    """
+    Calls push(record, session) for each record in records using a pool of
+    worker threads. Each worker is given its own clone of the fluid session
+    (defaults to the bound session).
+
+    records may be a list or an iterator. At most queue_size records (defaults
+    to twice the number of workers) are waiting for a worker at any one time
+    so an iterator is only consumed as quickly as the records can be pushed.
+
+    If skip is given it's called with the position of each record and the
+    record isn't pushed (and no result is yielded for it) if it returns True.
+
+    A generator that yields a PushResult for each record in the order in
+    which they were finished. Exceptions raised by push are caught and
+    returned in the result rather than stopping the other workers.
+    """
+    if workers < 1:
+        raise ValueError('There must be at least one worker')
+    if fluid is None:
+        fluid = Fluid.bound
+    tasks = Queue(queue_size or workers * 2)
+    results = Queue()
+
+    def work(session):
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            index, record = task
+            try:
+                result = PushResult(index, push(record, session), None)
+            except Exception, e:
+                logger.error('Record %d failed: %r' % (index, e))
+                result = PushResult(index, None, e)
+            results.put(result)
+
+    threads = []
+    for i in range(workers):
+        thread = threading.Thread(target=work, args=(clone_session(fluid),))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    pending = 0
+    try:
+        for task in enumerate(records, 1):
+            if skip and skip(task[0]):
+                continue
+            # blocks while the queue of waiting records is full
+            tasks.put(task)
+            pending += 1
+            # hand back whatever has been finished in the meantime
+            while True:
+                try:
+                    result = results.get_nowait()
+                except Empty:
+                    break
+                pending -= 1
+                yield result
+        while pending:
+            yield results.get()
+            pending -= 1
+    finally:
+        # tell the workers to stop once they've dealt with the queued records
+        for thread in threads:
+            tasks.put(None)
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Writers that push records to FluidDB with fewer requests than setting each
+tag value on each object one at a time.
+
+Copyright (c) 2010 Fluidinfo Inc.
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL
+THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+import time
+import logging
+from collections import namedtuple
+from fom.session import Fluid
+from flimp.utils import (prepare_import, make_object, compile_plan,
+                         set_tag_value)
+
+logger = logging.getLogger("flimp")
+
+# The default number of records whose tag values are set with each request
+DEFAULT_BATCH_SIZE = 100
+
+# A record waiting to be written: its (1-based) position in the input, the
+# about value or uid of its object, the values that can be set with the
+# /values endpoint and those that have to be set one at a time (see
+# flimp.utils.split_values) and the record's entry in the delta index (if
+# there is one)
+Pending = namedtuple('Pending', 'index about uid values others entry')
+
+def about_query(about_value):
+    """
+    Returns a FluidDB query that matches the object with the given about value
+    (quoting the value as required by the query language).
+    """
+    return 'fluiddb/about = "%s"' % about_value.replace('\\', '\\\\').replace(
+        '"', '\\"')
+
+def id_query(uid):
+    """
+    Returns a FluidDB query that matches the object with the given uid.
+    """
+    return 'fluiddb/id = "%s"' % uid
+
+class BatchWriter(object):
+    """
+    Gathers records together and sets the tag values of batch_size of them
+    with a single request to FluidDB's /values endpoint (one query per record).
+
+    Records with an about value are identified by a query on their about tag
+    (FluidDB creates the object if it doesn't already exist) so they cost no
+    requests of their own. An anonymous object is created for each record
+    without one as it is added.
+
+    A batch is sent once it holds batch_size records or, if flush_interval is
+    given, when a record is added more than flush_interval seconds after the
+    first record in the batch. If a batch fails it is split in half and each
+    half is sent in turn so only the records that are really at fault fail.
+    Their positions and errors are kept in the failed list.
+
+    Values the /values endpoint can't handle are set one at a time once the
+    rest of the record's batch has been written.
+
+    If a journal (see flimp.journal.Journal) is given the records it says are
+    done are skipped and the others are recorded in it once they've been
+    written. If a delta index (see flimp.delta.DeltaIndex or RemoteDiff) is
+    given only the records and tag values that have changed since the last
+    import are written (records must be passed through the index's prefetch
+    method before they're added).
+    """
+
+    def __init__(self, klass, root_path, about, name, allowEmpty=True,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_interval=None,
+                 fluid=None, journal=None, delta=None):
+        if batch_size < 1:
+            raise ValueError('The batch size must be at least 1')
+        if delta and not about:
+            raise ValueError('Only records with an about tag value can be'
+                             ' imported as a delta')
+        self.klass = klass
+        self.root_path = root_path
+        self.about = about
+        self.name = name
+        self.allowEmpty = allowEmpty
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fluid = fluid or Fluid.bound
+        self.journal = journal
+        self.delta = delta
+        self.plan = compile_plan(klass, root_path)
+        self.batch = []
+        self.started = None
+        # statistics
+        self.records = 0
+        self.requests = 0
+        self.failed = []
+
+    def add(self, item):
+        """
+        Adds a record to the current batch (sending it if it's full).
+        """
+        self.records += 1
+        if self.journal and self.journal.done(self.records):
+            return
+        tag_values = self.plan.values(item)
+        entry = None
+        if self.delta:
+            about_value = "%s:%s" % (self.name, item[self.about])
+            tag_values, entry = self.delta.changes(about_value, tag_values)
+            if not tag_values:
+                if self.journal:
+                    self.journal.record(self.records)
+                return
+        values, others = self.plan.split(tag_values, self.allowEmpty)
+        if self.about:
+            about_value = "%s:%s" % (self.name, item[self.about])
+            pending = Pending(self.records, about_value, None, values, others,
+                              entry)
+        else:
+            try:
+                obj = make_object(item, self.klass, None, self.name,
+                                  self.fluid)
+            except Exception, e:
+                self.fail(self.records, e)
+                return
+            finally:
+                self.requests += 1
+            pending = Pending(self.records, None, obj.uid, values, others,
+                              entry)
+        if not self.batch:
+            self.started = time.time()
+        self.batch.append(pending)
+        if len(self.batch) >= self.batch_size or (self.flush_interval is not
+                None and time.time() - self.started >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Sends the current batch (if there is one).
+        """
+        batch, self.batch = self.batch, []
+        if batch:
+            self.send(batch)
+
+    def send(self, batch):
+        """
+        Sets the tag values of the records in the batch with a single request
+        and then those values that have to be set one at a time. If the
+        request fails the batch is split in half and each half sent in turn.
+        """
+        queries = []
+        for pending in batch:
+            if pending.values:
+                if pending.about is None:
+                    query = id_query(pending.uid)
+                else:
+                    query = about_query(pending.about)
+                queries.append([query, pending.values])
+        if queries:
+            try:
+                self.requests += 1
+                self.fluid.values('PUT', payload={'queries': queries})
+                logger.info('Set the tag values of %d records with one'
+                            ' request' % len(queries))
+            except Exception, e:
+                if len(batch) == 1:
+                    self.fail(batch[0].index, e)
+                else:
+                    logger.warning('Batch of %d records failed (%r),'
+                                   ' splitting it' % (len(batch), e))
+                    middle = len(batch) / 2
+                    self.send(batch[:middle])
+                    self.send(batch[middle:])
+                return
+        for pending in batch:
+            if pending.others and not self.send_others(pending):
+                continue
+            if self.delta:
+                self.delta.update(pending.about, pending.entry)
+            if self.journal:
+                self.journal.record(pending.index)
+
+    def send_others(self, pending):
+        """
+        Sets the values of the record that can't be set with the /values
+        endpoint one at a time. Returns True if they were all set.
+        """
+        try:
+            self.requests += 1
+            if pending.about is None:
+                obj = self.klass(uid=pending.uid, fluid=self.fluid)
+            else:
+                # gets the object's uid
+                obj = self.klass(about=pending.about, fluid=self.fluid)
+            for key, value in pending.others.iteritems():
+                self.requests += 1
+                set_tag_value(self.klass, obj, key, value, self.allowEmpty)
+        except Exception, e:
+            self.fail(pending.index, e)
+            return False
+        return True
+
+    def fail(self, index, error):
+        """
+        Records that the record at the given position failed.
+        """
+        logger.error('Record %d failed: %r' % (index, error))
+        self.failed.append((index, error))
+
+def process_data_list(raw_data, root_path, name, desc, about, allowEmpty=True,
+                      batch_size=DEFAULT_BATCH_SIZE, flush_interval=None,
+                      journal=None, delta=None):
+    """
+    The batched equivalent of flimp.utils.process_data_list: creates the
+    required tags and namespaces and the FOM class and then uses
+    push_to_fluiddb (below) to push the data to FluidDB.
+
+    Returns the number of records that were processed.
+    """
+    fom_class, records = prepare_import(raw_data, root_path, name, desc)
+    logger.info('Starting to push records to FluidDB in batches of %d' %
+                batch_size)
+    return push_to_fluiddb(records, root_path, fom_class, about, name,
+                           allowEmpty, batch_size, flush_interval, journal,
+                           delta)
+
+def push_to_fluiddb(raw_data, root_path, klass, about, name, allowEmpty=True,
+                    batch_size=DEFAULT_BATCH_SIZE, flush_interval=None,
+                    journal=None, delta=None):
+    """
+    The batched equivalent of flimp.utils.push_to_fluiddb (see BatchWriter).
+
+    A record that fails doesn't stop the others but a RuntimeError is raised
+    once they have all been pushed.
+
+    Returns the number of records that were processed.
+    """
+    writer = BatchWriter(klass, root_path, about, name, allowEmpty,
+                         batch_size, flush_interval, journal=journal,
+                         delta=delta)
+    if delta:
+        raw_data = delta.prefetch(raw_data, root_path, about, name,
+                                  journal and journal.imported)
+    for item in raw_data:
+        writer.add(item)
+    writer.flush()
+    logger.info('Pushed %d records with %d requests' % (writer.records,
+                                                        writer.requests))
+    if writer.failed:
+        raise RuntimeError('%d of %d records failed to import (see the log'
+                           ' for details)' % (len(writer.failed),
+                                              writer.records))
+    return writer.records
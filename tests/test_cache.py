@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+from fom.session import Fluid
+from fom.errors import Fluid404Error
+from fom.mapping import Namespace
+from flimp import utils
+from flimp.cache import SchemaCache, NAMESPACES, TAGS
+from flimp.utils import make_namespace, make_tag, make_namespace_path
+from tests.test_schema import FakeTree
+
+class TestSchemaCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'schema_cache')
+        self.fluid = Fluid('https://sandbox.fluidinfo.com')
+        self.fluid.bind()
+        utils._resolved.clear()
+        self.tree = FakeTree(['test'], [])
+        self.fluid.db.session = self.tree
+
+    def tearDown(self):
+        SchemaCache.bound = None
+        shutil.rmtree(self.directory)
+
+    def test_known(self):
+        cache = SchemaCache(self.path, 'http://fluiddb', 'test')
+        self.assertFalse(cache.known(NAMESPACES, 'test/foo'))
+        cache.add(NAMESPACES, 'test/foo')
+        cache.add(TAGS, 'test/foo/bar')
+        self.assertTrue(cache.known(NAMESPACES, 'test/foo'))
+        self.assertFalse(cache.known(TAGS, 'test/foo'))
+        cache.save()
+        # the cache is kept for each instance and user
+        self.assertTrue(SchemaCache(self.path, 'http://fluiddb',
+                                    'test').known(TAGS, 'test/foo/bar'))
+        self.assertFalse(SchemaCache(self.path, 'http://fluiddb',
+                                     'other').known(TAGS, 'test/foo/bar'))
+        self.assertFalse(SchemaCache(self.path, 'http://sandbox',
+                                     'test').known(TAGS, 'test/foo/bar'))
+        # paths expire
+        cache = SchemaCache(self.path, 'http://fluiddb', 'test', ttl=0)
+        self.assertFalse(cache.known(TAGS, 'test/foo/bar'))
+        cache.save()
+        cache = SchemaCache(self.path, 'http://fluiddb', 'test')
+        self.assertEqual({}, cache.paths[TAGS])
+
+    def test_invalidate(self):
+        cache = SchemaCache(self.path, 'http://fluiddb', 'test')
+        for path in ['test/foo', 'test/foo/bar', 'test/foobar']:
+            cache.add(NAMESPACES, path)
+        cache.add(TAGS, 'test/foo/bar/baz')
+        cache.invalidate('test/foo')
+        self.assertEqual(['test/foobar'], cache.paths[NAMESPACES].keys())
+        self.assertEqual({}, cache.paths[TAGS])
+        cache.invalidate()
+        self.assertEqual({}, cache.paths[NAMESPACES])
+
+    def test_no_requests(self):
+        SchemaCache(self.path, 'http://fluiddb', 'test').bind()
+        ns = make_namespace_path('test/foo/bar', 'data', 'desc')
+        make_tag(ns, 'baz', 'data', 'desc')
+        self.assertEqual(['GET', 'GET', 'POST', 'POST', 'POST'],
+                         [method for method, kind, path in self.tree.requests])
+        SchemaCache.bound.save()
+        # a repeat import into the same schema (by another process) doesn't
+        # ask FluidDB
+        utils._resolved.clear()
+        cache = SchemaCache(self.path, 'http://fluiddb', 'test')
+        cache.bind()
+        ns = make_namespace_path('test/foo/bar', 'data', 'desc')
+        tag = make_tag(ns, 'baz', 'data', 'desc')
+        self.assertEqual('test/foo/bar/baz', tag.path)
+        self.assertEqual(5, len(self.tree.requests))
+        self.assertEqual(2, cache.hits)
+
+    def test_stale(self):
+        cache = SchemaCache(self.path, 'http://fluiddb', 'test')
+        cache.add(NAMESPACES, 'test/foo')
+        cache.add(NAMESPACES, 'test/foo/bar')
+        cache.bind()
+        # test/foo has been deleted so the cache is out of date
+        ns = make_namespace('test/foo/bar/baz', 'data', 'desc')
+        self.assertEqual('test/foo/bar/baz', ns.path)
+        make_tag(Namespace('test/foo/qux'), 'tag', 'data', 'desc')
+        self.assertTrue(set(['test/foo', 'test/foo/bar', 'test/foo/bar/baz',
+                             'test/foo/qux']) <= self.tree.namespaces)
+        self.assertTrue('test/foo/qux/tag' in self.tree.tags)
+        self.assertTrue(cache.known(NAMESPACES, 'test/foo/bar'))
+        self.assertTrue(cache.known(TAGS, 'test/foo/qux/tag'))
+        # without a cache there's nothing to refresh
+        SchemaCache.bound = None
+        self.assertRaises(Fluid404Error, make_namespace, 'test/gone/foo',
+                          'data', 'desc')
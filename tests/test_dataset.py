@@ -0,0 +1,58 @@
+import unittest
+from flimp.dataset import Dataset, Record
+from flimp.utils import validate, get_values
+from flimp.file_handler import get_preview
+
+RECORDS = [
+    {'foo': 'a', 'bar': 1, 'baz': None},
+    {'foo': 'b', 'bar': 2, 'baz': True},
+    {'foo': 'c', 'bar': 3},
+    {'foo': 'd', 'bar': 4, 'baz': False, 'qux': 'extra'},
+]
+
+class TestDataset(unittest.TestCase):
+
+    def test_from_records(self):
+        dataset = Dataset.from_records(iter(RECORDS))
+        self.assertEqual(4, len(dataset))
+        self.assertEqual(set(['foo', 'bar', 'baz']), set(dataset.columns))
+        # records that fit the columns are compact, the others are left alone
+        self.assertTrue(isinstance(dataset[0], Record))
+        self.assertTrue(isinstance(dataset[1], Record))
+        self.assertTrue(isinstance(dataset[2], dict))
+        self.assertTrue(isinstance(dataset[3], dict))
+        self.assertEqual(RECORDS, list(dataset))
+        self.assertEqual(RECORDS[1:3], list(dataset[1:3]))
+        self.assertRaises(ValueError, Dataset.from_records, [])
+
+    def test_duplicate_columns(self):
+        self.assertRaises(ValueError, Dataset, ['foo', 'bar', 'foo'])
+
+    def test_record(self):
+        dataset = Dataset.from_records(RECORDS)
+        record = dataset[1]
+        self.assertEqual(3, len(record))
+        self.assertEqual('b', record['foo'])
+        self.assertRaises(KeyError, record.__getitem__, 'qux')
+        self.assertTrue('bar' in record)
+        self.assertFalse('qux' in record)
+        self.assertEqual(None, record.get('qux'))
+        self.assertEqual(RECORDS[1], dict(record))
+        self.assertEqual(sorted(RECORDS[1].items()), sorted(record.items()))
+        self.assertEqual(sorted(RECORDS[1].keys()), sorted(record))
+        self.assertEqual(RECORDS[1], record)
+        self.assertNotEqual(RECORDS[0], record)
+        # records don't carry any baggage around with them
+        self.assertRaises(AttributeError, setattr, record, 'foo', 'bar')
+
+    def test_utils(self):
+        # the dataset works with the functions that expect dictionaries
+        dataset = Dataset.from_records(RECORDS)
+        missing, extras = validate(dataset)
+        self.assertEqual(1, len(missing))
+        self.assertEqual(1, len(extras))
+        self.assertEqual(validate(RECORDS), (missing, extras))
+        self.assertEqual(get_values(RECORDS[0], 'test'),
+                         get_values(dataset[0], 'test'))
+        self.assertEqual(sorted(get_preview(RECORDS, 'test')),
+                         sorted(get_preview(dataset, 'test')))
@@ -0,0 +1,220 @@
+import os
+import shelve
+import shutil
+import tempfile
+import unittest
+from fom.session import Fluid
+from fom.mapping import tag_value
+from flimp.utils import create_class, push_to_fluiddb
+from flimp.writers import BatchWriter
+from flimp.delta import DeltaIndex, RemoteDiff, value_hash
+from tests.test_writers import FakeFluid
+
+RECORDS = [{'id': i, 'foo': 'value %d' % i, 'bar': {'baz': [u'a', 'b']}} for
+           i in range(10)]
+
+class TestDelta(unittest.TestCase):
+
+    def setUp(self):
+        # no requests are made to FluidDB by these tests
+        Fluid('https://sandbox.fluidinfo.com').bind()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.index')
+        self.created = []
+        def create(obj, about=None):
+            self.created.append(about)
+            obj.uid = about
+        self.fom_class = create_class({
+            'test/id': tag_value('test/id'),
+            'test/foo': tag_value('test/foo'),
+            'test/bar/baz': tag_value('test/bar/baz'),
+            'create': create})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_value_hash(self):
+        self.assertEqual(value_hash({'a': 1, 'b': 2}),
+                         value_hash({'b': 2, 'a': 1}))
+        self.assertEqual(value_hash(u'abc'), value_hash('abc'))
+        self.assertNotEqual(value_hash(1), value_hash('1'))
+
+    def test_changes(self):
+        index = DeltaIndex(self.path)
+        tag_values = {'test/foo': 'a', 'test/bar': 1}
+        changes, entry = index.changes(u'data:\xe9', tag_values)
+        self.assertEqual(tag_values, changes)
+        index.update(u'data:\xe9', entry)
+        index.close()
+        index = DeltaIndex(self.path)
+        self.assertEqual({}, index.changes(u'data:\xe9', tag_values)[0])
+        changes, entry = index.changes(u'data:\xe9', {'test/foo': 'a',
+                                                      'test/bar': 2})
+        self.assertEqual({'test/bar': 2}, changes)
+        # records only count as changed once they've been pushed
+        self.assertEqual('0 new, 0 changed and 1 unchanged records',
+                         index.stats())
+        index.update(u'data:\xe9', entry)
+        self.assertEqual('0 new, 1 changed and 1 unchanged records',
+                         index.stats())
+        index.close()
+
+    def test_sync(self):
+        index = DeltaIndex(self.path)
+        sync = index.db.sync
+        synced = []
+        def count_sync():
+            synced.append(True)
+            sync()
+        index.db.sync = count_sync
+        index.update('data:1', index.changes('data:1', {'test/foo': 1})[1])
+        self.assertEqual([], synced)
+        # the index is written to disk every so often while it's open
+        index.synced = 0
+        index.update('data:2', index.changes('data:2', {'test/foo': 2})[1])
+        self.assertEqual([True], synced)
+        reader = shelve.open(self.path, 'r')
+        self.assertEqual(['data:1', 'data:2'], sorted(reader.keys()))
+        reader.close()
+        index.close()
+
+    def test_push_to_fluiddb(self):
+        index = DeltaIndex(self.path)
+        push_to_fluiddb(RECORDS, 'test', self.fom_class, 'id', 'data',
+                        delta=index)
+        self.assertEqual(10, len(self.created))
+        # only the changed record is pushed the next time
+        records = [dict(r) for r in RECORDS]
+        records[3]['foo'] = 'changed'
+        self.created = []
+        self.assertEqual(10, push_to_fluiddb(records, 'test', self.fom_class,
+                                             'id', 'data', delta=index))
+        self.assertEqual(['data:3'], self.created)
+        self.assertEqual((10, 1, 9), (index.new, index.changed,
+                                      index.unchanged))
+        index.close()
+        self.assertRaises(ValueError, push_to_fluiddb, RECORDS, 'test',
+                          self.fom_class, None, 'data', delta=index)
+
+    def test_batch_writer(self):
+        index = DeltaIndex(self.path)
+        fluid = FakeFluid()
+        writer = BatchWriter(self.fom_class, 'test', 'id', 'data',
+                             batch_size=4, fluid=fluid, delta=index)
+        for item in RECORDS:
+            writer.add(item)
+        writer.flush()
+        self.assertEqual(3, len(fluid.requests))
+        records = [dict(r) for r in RECORDS]
+        records[7]['foo'] = 'changed'
+        fluid.requests = []
+        writer = BatchWriter(self.fom_class, 'test', 'id', 'data',
+                             batch_size=4, fluid=fluid, delta=index)
+        for item in records:
+            writer.add(item)
+        writer.flush()
+        # a single request with a single changed value
+        self.assertEqual([[['fluiddb/about = "data:7"',
+                            {'test/foo': {'value': 'changed'}}]]],
+                         fluid.requests)
+        index.close()
+
+class FakeValues(object):
+    """
+    Answers bulk reads from the /values endpoint with the values of the
+    objects in "existing" (about value -> tag values).
+    """
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.requests = []
+
+    def get(self, query, taglist):
+        self.requests.append((query, taglist))
+        results = {}
+        for about_value, values in self.existing.iteritems():
+            if 'fluiddb/about = "%s"' % about_value in query:
+                result = {'fluiddb/about': {'value': about_value}}
+                for tag, value in values.iteritems():
+                    if tag in taglist:
+                        result[tag] = value
+                results['uid-' + about_value] = result
+        return type('FakeResponse', (object, ),
+                    {'value': {'results': {'id': results}}})
+
+class TestRemoteDiff(unittest.TestCase):
+
+    def setUp(self):
+        Fluid('https://sandbox.fluidinfo.com').bind()
+        self.created = []
+        def create(obj, about=None):
+            self.created.append(about)
+            obj.uid = about
+        self.fom_class = create_class({
+            'test/id': tag_value('test/id'),
+            'test/foo': tag_value('test/foo'),
+            'test/bar/baz': tag_value('test/bar/baz'),
+            'create': create})
+        existing = {}
+        for record in RECORDS[:8]:
+            existing['data:%d' % record['id']] = {
+                'test/id': {'value': record['id']},
+                'test/foo': {'value': unicode(record['foo'])},
+                # an opaque value
+                'test/bar/baz': {'value-type': 'application/json',
+                                 'size': 10}}
+        existing['data:2']['test/foo'] = {'value': u'changed'}
+        del existing['data:3']['test/bar/baz']
+        values = FakeValues(existing)
+        self.fluid = type('FakeFluid', (object, ), {'values': values})()
+
+    def test_changes(self):
+        diff = RemoteDiff(batch_size=4, fluid=self.fluid)
+        records = list(diff.prefetch(iter(RECORDS), 'test', 'id', 'data'))
+        self.assertEqual(RECORDS, records)
+        # read 4 records at a time
+        self.assertEqual(3, len(self.fluid.values.requests))
+        query, taglist = self.fluid.values.requests[0]
+        self.assertEqual(' or '.join('fluiddb/about = "data:%d"' % i for i
+                                     in range(4)), query)
+        self.assertEqual(['fluiddb/about', 'test/bar/baz', 'test/foo',
+                          'test/id'], taglist)
+        tag_values = {'test/id': 1, 'test/foo': 'value 1'}
+        self.assertEqual(({}, None), diff.changes('data:1', tag_values))
+        tag_values = {'test/id': 2, 'test/foo': 'value 2'}
+        self.assertEqual({'test/foo': 'value 2'},
+                         diff.changes('data:2', tag_values)[0])
+        # opaque values always count as changed
+        tag_values = {'test/id': 0, 'test/bar/baz': ['a', 'b']}
+        self.assertEqual({'test/bar/baz': ['a', 'b']},
+                         diff.changes('data:0', tag_values)[0])
+        self.assertEqual((tag_values, 'new'), diff.changes('data:9',
+                                                           tag_values))
+        # records only count as new or changed once they've been pushed
+        self.assertEqual((0, 0, 1), (diff.new, diff.changed, diff.unchanged))
+        diff.update('data:9', 'new')
+        diff.update('data:2', 'changed')
+        diff.update('data:0', 'changed')
+        self.assertEqual((1, 2, 1), (diff.new, diff.changed, diff.unchanged))
+
+    def test_skip(self):
+        diff = RemoteDiff(batch_size=4, fluid=self.fluid)
+        # the records a journal says are done aren't read
+        done = set([1, 2, 3, 4, 6])
+        records = list(diff.prefetch(iter(RECORDS), 'test', 'id', 'data',
+                                     done.__contains__))
+        self.assertEqual(RECORDS, records)
+        self.assertEqual(2, len(self.fluid.values.requests))
+        query, taglist = self.fluid.values.requests[0]
+        self.assertEqual('fluiddb/about = "data:4" or fluiddb/about = "data:6"'
+                         ' or fluiddb/about = "data:7"', query)
+        self.assertEqual(['data:4', 'data:6', 'data:7'],
+                         sorted(diff.current))
+
+    def test_push_to_fluiddb(self):
+        diff = RemoteDiff(batch_size=4, fluid=self.fluid)
+        records = [{'id': i, 'foo': 'value %d' % i} for i in range(10)]
+        self.assertEqual(10, push_to_fluiddb(records, 'test', self.fom_class,
+                                             'id', 'data', delta=diff))
+        # the changed record and the new ones
+        self.assertEqual(['data:2', 'data:8', 'data:9'], self.created)
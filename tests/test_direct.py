@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import json
+import threading
+import unittest
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from fom.errors import Fluid404Error
+from fom.mapping import tag_value
+from fom.session import Fluid
+from flimp.direct import DirectWriter, PayloadCache, encode, TRIAL_SIZE
+from flimp.transport import install
+from flimp.utils import create_class, push_record
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Records every PUT and answers it as FluidDB does: with no content (and no
+    content type) or a 404 if the path ends with "missing". Every POST creates
+    the object with the id 1234.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps({'id': '1234', 'URI': 'http://fluiddb/objects/1234'})
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.command, self.path,
+                                     self.headers.get('Content-Type'),
+                                     self.headers.get('Authorization'), body))
+        if self.path.endswith('missing'):
+            self.send_response(404)
+            self.send_header('X-FluidDB-Error-Class', 'TNonexistentTag')
+        else:
+            self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+# as created by flimp.schema.plan
+TAGS = {
+    'test/data/foo': tag_value('test/data/foo', lazy_save=False),
+    'test/data/bar/baz': tag_value('test/data/bar/baz', lazy_save=False),
+    u'test/data/café au lait': tag_value(u'test/data/café au lait',
+                                        lazy_save=False),
+    'test/data/json': tag_value('test/data/json', 'application/json'),
+    'test/data/missing': tag_value('test/data/missing', lazy_save=False),
+}
+
+VALUES = {
+    'test/data/foo': 'Hello',
+    'test/data/bar/baz': 1.5,
+    u'test/data/café au lait': [u'ham', u'éggs'],
+    'test/data/json': [{'a': 1}, None],
+}
+
+class TestDirect(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05, ))
+        self.thread.daemon = True
+        self.thread.start()
+        self.fluid = Fluid('http://127.0.0.1:%d' % self.server.server_port)
+        self.fluid.bind()
+        self.fluid.login('test', 'test')
+        self.pool = install(self.fluid)
+        self.klass = create_class(TAGS)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_encode(self):
+        self.assertEqual(('1', 'application/vnd.fluiddb.value+json'),
+                         encode(1))
+        self.assertEqual(('{"a": 1}', 'application/json'), encode({'a': 1}))
+        self.assertEqual(('raw', 'text/plain'), encode('raw', 'text/plain'))
+        self.assertRaises(ValueError, encode, [1, 2])
+        self.assertRaises(ValueError, encode, object())
+
+    def test_same_requests(self):
+        # what fom sends...
+        for tagpath, value in VALUES.iteritems():
+            self.fluid.objects['1234'][tagpath].put(value,
+                                                    TAGS[tagpath].content_type)
+        self.fluid.values.put('fluiddb/id = "1234"',
+                              {'test/data/foo': {'value': 'Hello'}})
+        expected = self.server.requests
+        self.server.requests = []
+        # ...is what the writer sends
+        writer = DirectWriter(self.klass)
+        writer.set_values('1234', VALUES)
+        writer.put_values('1234', {'test/data/foo': {'value': 'Hello'}})
+        self.assertEqual(sorted(expected), sorted(self.server.requests))
+        self.assertEqual(5, writer.requests)
+        self.assertEqual(self.fluid.db.headers['Authorization'],
+                         expected[0][3])
+
+    def test_push_record(self):
+        # (fom can't set attributes whose names aren't ASCII)
+        item = {'foo': 'Hello', 'bar': {'baz': 1.5}, 'json': [{'a': 1}, None]}
+        # make_object and fom's own PUTs over the pool...
+        obj = push_record(item, 'test/data', self.klass, None, 'data')
+        self.assertEqual('1234', obj.uid)
+        expected = self.server.requests
+        self.assertEqual(3, len(expected))
+        self.server.requests = []
+        # ...and the writer send the same requests
+        obj = push_record(item, 'test/data', self.klass, None, 'data',
+                          writer=DirectWriter(self.klass))
+        self.assertEqual('1234', obj.uid)
+        self.assertEqual(sorted(expected), sorted(self.server.requests))
+
+    def test_errors(self):
+        writer = DirectWriter(self.klass)
+        writer.set_values('1234', {'test/data/foo': None}, allowEmpty=False)
+        writer.set_values('1234', {'test/data/unknown': 1})
+        self.assertEqual([], self.server.requests)
+        self.assertRaises(Fluid404Error, writer.set_values, '1234',
+                          {'test/data/missing': 1})
+
+    def test_payload_cache(self):
+        cache = PayloadCache(4)
+        self.assertEqual(('"GB"', 'application/vnd.fluiddb.value+json'),
+                         cache.encode('GB', None, 'country'))
+        self.assertEqual(('"GB"', 'application/vnd.fluiddb.value+json'),
+                         cache.encode('GB', None, 'country'))
+        # equal values of different types are encoded differently
+        self.assertEqual('1', cache.encode(1, None, 'flag')[0])
+        self.assertEqual('true', cache.encode(True, None, 'flag')[0])
+        self.assertEqual(('true', 'application/json'),
+                         cache.encode(True, 'application/json', 'flag'))
+        # lists are kept under a tuple of their items...
+        self.assertEqual('["a"]', cache.encode(['a'], None, 'keywords')[0])
+        self.assertEqual('["a"]', cache.encode(['a'], None, 'keywords')[0])
+        self.assertEqual('[1, true]', cache.encode([1, True],
+                         'application/json', 'keywords')[0])
+        self.assertEqual('[true, 1]', cache.encode([True, 1],
+                         'application/json', 'keywords')[0])
+        # ...unless they can't be
+        self.assertEqual('[{"a": 1}]', cache.encode([{'a': 1}],
+                         'application/json', 'keywords')[0])
+        self.assertEqual(4, len(cache.payloads))
+        self.assertEqual({'country': 1, 'keywords': 1}, cache.hits)
+        self.assertEqual({'country': 1, 'flag': 3, 'keywords': 4},
+                         cache.misses)
+        # the least recently used payloads are dropped
+        self.assertEqual('true', cache.encode(True, 'application/json',
+                                              'flag')[0])
+        self.assertEqual('"FR"', cache.encode('FR', None, 'country')[0])
+        self.assertEqual('["a"]', cache.encode(['a'], None, 'keywords')[0])
+        self.assertEqual('true', cache.encode(True, 'application/json',
+                                              'flag')[0])
+        self.assertEqual(4, len(cache.payloads))
+        self.assertEqual({'country': 1, 'flag': 2, 'keywords': 1}, cache.hits)
+        self.assertEqual({'country': 2, 'flag': 3, 'keywords': 5},
+                         cache.misses)
+        self.assertEqual('Payload cache: 4 hits, 10 misses (29%)\n'
+                         '  country: 33% of 3\n'
+                         '  flag: 40% of 5\n'
+                         '  keywords: 17% of 6', cache.stats())
+
+    def test_uncached(self):
+        # a column whose values don't repeat isn't cached for long
+        cache = PayloadCache(10)
+        for i in range(TRIAL_SIZE + 10):
+            self.assertEqual(str(i), cache.encode(i, None, 'id')[0])
+            self.assertEqual('"GB"', cache.encode('GB', None, 'country')[0])
+        self.assertEqual(set(['id']), cache.uncached)
+        self.assertEqual((0, TRIAL_SIZE), (cache.hits.get('id', 0),
+                                           cache.misses['id']))
+        self.assertEqual(TRIAL_SIZE + 9, cache.hits['country'])
+        self.assertTrue('  id: 0% of 1000 (then no longer cached)' in
+                        cache.stats())
+
+    def test_cached_requests(self):
+        writer = DirectWriter(self.klass)
+        writer.set_values('1234', VALUES)
+        expected = self.server.requests
+        self.server.requests = []
+        cache = PayloadCache()
+        writer = DirectWriter(self.klass, cache=cache)
+        writer.set_values('1234', VALUES)
+        writer.set_values('1234', VALUES)
+        self.assertEqual(sorted(expected * 2), sorted(self.server.requests))
+        # (the list of dicts isn't cached)
+        self.assertEqual({'test/data/foo': 1, 'test/data/bar/baz': 1,
+                          u'test/data/café au lait': 1}, cache.hits)
+        self.assertEqual(2, cache.misses['test/data/json'])
@@ -1,14 +1,21 @@
 import os
 import unittest
 import uuid
+import gzip
+import bz2
+import shutil
+import tempfile
 from flimp.file_handler import (get_preview, clean_data, traverse_preview,
-                                process)
+                                process, sample_data)
+from flimp.dataset import Dataset
 from fom.session import Fluid
 from fom.mapping import Object
 
 PATH_TO_FILES = os.path.join(os.getcwd(), os.path.dirname(__file__))
 
 GOOD_JSON = os.path.join(PATH_TO_FILES, 'good.json')
+GOOD_CSV = os.path.join(PATH_TO_FILES, 'good.csv')
+GOOD_JSONL = os.path.join(PATH_TO_FILES, 'good.jsonl')
 UNKNOWN_TYPE = os.path.join(PATH_TO_FILES, 'unknown.txt')
 
 # good data structure
@@ -92,5 +99,68 @@ test/%s/foo
         # good
         result = clean_data(GOOD_JSON)
         self.assertTrue(isinstance(result, list))
+        # streamed
+        result = clean_data(GOOD_JSON, stream=True)
+        self.assertFalse(isinstance(result, list))
+        self.assertEqual(2, len(list(result)))
+        # compact
+        result = clean_data(GOOD_CSV, compact=True)
+        self.assertTrue(isinstance(result, Dataset))
+        self.assertEqual(clean_data(GOOD_CSV), list(result))
         # bad
         self.assertRaises(TypeError, clean_data, UNKNOWN_TYPE)
+
+    def test_sample_data(self):
+        # small files are read completely
+        records, total, exact = sample_data(GOOD_JSON, 10)
+        self.assertEqual(clean_data(GOOD_JSON), records)
+        self.assertEqual(2, total)
+        self.assertTrue(exact)
+        # only the start of larger files is read and the total estimated
+        temp_file = tempfile.NamedTemporaryFile(suffix='.jsonl')
+        for i in range(10000):
+            temp_file.write('{"foo": "%s", "bar": %d}\n' % ('x' * 50, i))
+        temp_file.flush()
+        records, total, exact = sample_data(temp_file.name, 10)
+        self.assertEqual(range(10), [record['bar'] for record in records])
+        self.assertFalse(exact)
+        self.assertTrue(5000 < total < 20000)
+        # a random sample has to read everything but keeps the first record
+        records, total, exact = sample_data(temp_file.name, 10, True)
+        self.assertEqual(10, len(records))
+        self.assertEqual(0, records[0]['bar'])
+        self.assertEqual(10000, total)
+        self.assertTrue(exact)
+        temp_file.close()
+
+    def test_process_sample(self):
+        # preview and sampled checks don't need to talk to FluidDB
+        preview = process(GOOD_JSON, 'test/flimp', 'flimp', 'test', None,
+                          preview=True)
+        self.assertTrue('2 records will be imported' in preview)
+        check = process(GOOD_JSON, 'test/flimp', 'flimp', 'test', None,
+                        check=True, sample=5)
+        self.assertEqual('Validation passed ok (checked a sample of 2 of 2'
+                         ' records)', check)
+
+    def test_clean_data_compressed(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            for source in [GOOD_JSON, GOOD_CSV, GOOD_JSONL]:
+                expected = clean_data(source)
+                for extension, opener in [('.gz', gzip.GzipFile),
+                                          ('.bz2', bz2.BZ2File)]:
+                    filename = os.path.join(temp_dir,
+                        os.path.basename(source) + extension)
+                    compressed = opener(filename, 'wb')
+                    compressed.write(open(source, 'rb').read())
+                    compressed.close()
+                    self.assertEqual(expected, clean_data(filename))
+                    self.assertEqual(expected,
+                                     list(clean_data(filename, stream=True)))
+            # the compressed file must still have a known extension
+            filename = os.path.join(temp_dir, 'unknown.txt.gz')
+            gzip.GzipFile(filename, 'wb').close()
+            self.assertRaises(TypeError, clean_data, filename)
+        finally:
+            shutil.rmtree(temp_dir)
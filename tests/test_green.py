@@ -0,0 +1,114 @@
+import os
+import sys
+import unittest
+from flimp import green
+from flimp.green import push_to_fluiddb, push_directory
+
+class FakeObject(object):
+    """
+    Stands in for a FOM Object class so nothing is sent to FluidDB.
+    """
+
+    def __init__(self, about=None, fluid=None):
+        self.uid = about
+        self.tags = {}
+
+    def create(self):
+        self.uid = 'anonymous'
+
+    def set(self, tag, value, content_type):
+        self.tags[tag] = value
+
+class FakeNamespace(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def create_tag(self, name, description, indexed):
+        return FakeNamespace(self.path + '/' + name)
+
+@unittest.skipIf(green.gevent is None, 'gevent is not installed')
+class TestGreen(unittest.TestCase):
+
+    def setUp(self):
+        # set the limit without monkey patching the standard library
+        self.concurrency, self.limit = green.concurrency, green.limit
+        green.concurrency = 5
+        green.limit = green.BoundedSemaphore(5)
+
+    def tearDown(self):
+        green.concurrency, green.limit = self.concurrency, self.limit
+
+    def test_push_to_fluiddb(self):
+        objects = []
+        class Klass(FakeObject):
+            def __init__(self, about=None, fluid=None):
+                FakeObject.__init__(self, about, fluid)
+                objects.append(self)
+        setattr(Klass, 'test/foo', None)
+        setattr(Klass, 'test/bar/baz', None)
+        records = [{'foo': i, 'bar': {'baz': None}} for i in range(20)]
+        self.assertEqual(20, push_to_fluiddb(iter(records), 'test', Klass,
+                                             'foo', 'data', False))
+        self.assertEqual(20, len(objects))
+        self.assertEqual(set('data:%d' % i for i in range(20)),
+                         set(obj.uid for obj in objects))
+        for obj in objects:
+            # empty values were ignored
+            self.assertEqual('data:%d' % getattr(obj, 'test/foo'), obj.uid)
+            self.assertFalse('test/bar/baz' in obj.__dict__)
+
+    def test_push_to_fluiddb_errors(self):
+        class Klass(FakeObject):
+            def create(self):
+                raise ValueError('Oops')
+        self.assertRaises(RuntimeError, push_to_fluiddb, [{'foo': 1}], 'test',
+                          Klass, None, 'data')
+
+    def test_push_directory(self):
+        obj = FakeObject('test')
+        directory = os.path.abspath(os.path.join('tests', 'test'))
+        make_namespace = green.make_namespace
+        green.make_namespace = lambda path, name, desc: FakeNamespace(path)
+        try:
+            push_directory(obj, directory, FakeNamespace('test/root'), 'name',
+                           'desc')
+        finally:
+            green.make_namespace = make_namespace
+        for tag, value in obj.tags.iteritems():
+            file_path = os.path.join(directory, tag[len('test/root/'):])
+            self.assertEqual(open(file_path).read(), value)
+        self.assertTrue(obj.tags)
+
+class TestPatch(unittest.TestCase):
+
+    def setUp(self):
+        self.concurrency, self.limit = green.concurrency, green.limit
+        green.concurrency, green.limit = None, None
+
+    def tearDown(self):
+        green.concurrency, green.limit = self.concurrency, self.limit
+
+    def test_not_patched(self):
+        self.assertRaises(RuntimeError, push_to_fluiddb, [{'foo': 1}],
+                          'test', FakeObject, None, 'data')
+
+    @unittest.skipIf(green.gevent is not None, 'gevent is installed')
+    def test_no_gevent(self):
+        self.assertRaises(ImportError, green.patch)
+
+    def test_wants_green(self):
+        # bin/flimp works out whether to patch before it imports flimp
+        script = {'__name__': 'flimp_script'}
+        argv, sys.argv = sys.argv, ['flimp']
+        try:
+            execfile(os.path.join('bin', 'flimp'), script)
+        finally:
+            sys.argv = argv
+        wants_green = script['wants_green']
+        for args in (['-g', '5'], ['-g5'], ['-vg', '5'], ['-cvg5'],
+                     ['--green=5'], ['--gr', '5'], ['-f', 'x.csv', '-vbg5']):
+            self.assertTrue(wants_green(args), args)
+        for args in ([], ['-v'], ['-fgood.csv'], ['-f', '-g.csv'],
+                     ['-vfg.csv'], ['-w', '5', '--', '-g'], ['--log=g']):
+            self.assertFalse(wants_green(args), args)
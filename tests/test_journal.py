@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+from fom.session import Fluid
+from flimp.journal import Journal, fingerprint, journal_path
+from flimp.workers import push_records
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'test.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_fingerprint(self):
+        filename = os.path.join(self.directory, 'data.csv')
+        f = open(filename, 'w')
+        f.write('a,b\n1,2\n')
+        f.close()
+        original = fingerprint(filename)
+        self.assertEqual(original, fingerprint(filename))
+        f = open(filename, 'a')
+        f.write('3,4\n')
+        f.close()
+        self.assertNotEqual(original, fingerprint(filename))
+        self.assertEqual('data.csv.journal', journal_path(filename))
+
+    def test_resume(self):
+        journal = Journal(self.path, 'abc', 'id')
+        # records finish out of order
+        for index in [1, 2, 4, 5, 7, 3]:
+            journal.record(index)
+        self.assertEqual(5, journal.done_through)
+        self.assertEqual(set([7]), journal.done_after)
+        journal.close()
+        # the last line was cut short when the import died
+        f = open(self.path, 'a')
+        f.write('1')
+        f.close()
+        journal = Journal(self.path, 'abc', 'id', resume=True)
+        self.assertEqual([1, 2, 3, 4, 5, 7],
+                         [i for i in range(1, 10) if journal.done(i)])
+        self.assertEqual(6, journal.skipped)
+        # asking without skipping
+        self.assertTrue(journal.imported(7))
+        self.assertFalse(journal.imported(6))
+        self.assertEqual(6, journal.skipped)
+        journal.record(6)
+        journal.close()
+        journal = Journal(self.path, 'abc', 'id', resume=True)
+        self.assertEqual(7, journal.done_through)
+        self.assertEqual(set(), journal.done_after)
+        journal.close(finished=True)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_start_again(self):
+        journal = Journal(self.path, 'abc', 'id')
+        journal.close()
+        # not resuming means starting from scratch...
+        journal = Journal(self.path, 'abc', 'id')
+        journal.record(1)
+        journal.close()
+        # ...but not at the expense of an unfinished import of the same file
+        self.assertRaises(ValueError, Journal, self.path, 'abc', 'id')
+        journal = Journal(self.path, 'abc', 'id', resume=True)
+        self.assertTrue(journal.done(1))
+        journal.close()
+        # the journal of a different import is replaced
+        journal = Journal(self.path, 'def', 'id')
+        self.assertFalse(journal.done(1))
+        journal.close()
+        os.remove(self.path)
+        journal = Journal(self.path, 'abc', 'id')
+        self.assertFalse(journal.done(1))
+        journal.close()
+
+    def test_wrong_journal(self):
+        journal = Journal(self.path, 'abc', 'id')
+        journal.close()
+        self.assertRaises(ValueError, Journal, self.path, 'def', 'id', True)
+        self.assertRaises(ValueError, Journal, self.path, 'abc', 'name', True)
+        f = open(self.path, 'w')
+        f.write('rubbish\n')
+        f.close()
+        self.assertRaises(ValueError, Journal, self.path, 'abc', 'id', True)
+
+    def test_skip_records(self):
+        journal = Journal(self.path, 'abc', 'id')
+        for index in [1, 2, 5]:
+            journal.record(index)
+        fdb = Fluid('https://sandbox.fluidinfo.com')
+        results = push_records(lambda record, session: record, 'abcdef', 2,
+                               fluid=fdb, skip=journal.done)
+        self.assertEqual([3, 4, 6], sorted(r.index for r in results))
+        self.assertEqual(3, journal.skipped)
+        journal.close()
@@ -1,7 +1,11 @@
 import os
 import unittest
+import json
+import tempfile
+from StringIO import StringIO
+import yaml
 from types import NoneType
-from flimp.parser import parse_json, parse_csv, parse_yaml
+from flimp.parser import parse_json, parse_jsonl, parse_csv, parse_yaml
 
 PATH_TO_FILES = os.path.join(os.getcwd(), os.path.dirname(__file__))
 
@@ -9,6 +13,10 @@ PATH_TO_FILES = os.path.join(os.getcwd(), os.path.dirname(__file__))
 GOOD_JSON = os.path.join(PATH_TO_FILES, 'good.json')
 BAD_JSON = os.path.join(PATH_TO_FILES, 'bad.json')
 EMPTY_JSON = os.path.join(PATH_TO_FILES, 'empty.json')
+# JSON lines files
+GOOD_JSONL = os.path.join(PATH_TO_FILES, 'good.jsonl')
+BAD_JSONL = os.path.join(PATH_TO_FILES, 'bad.jsonl')
+EMPTY_JSONL = os.path.join(PATH_TO_FILES, 'empty.jsonl')
 # CSV files
 GOOD_CSV = os.path.join(PATH_TO_FILES, 'good.csv')
 BAD_CSV = os.path.join(PATH_TO_FILES, 'bad.csv')
@@ -31,6 +39,76 @@ class TestParseJson(unittest.TestCase):
         self.assertRaises(TypeError, parse_json.parse, bad)
         self.assertRaises(ValueError, parse_json.parse, empty)
 
+    def test_iterparse(self):
+        good = open(GOOD_JSON, 'r')
+        bad = open(BAD_JSON, 'r')
+        empty = open(EMPTY_JSON, 'r')
+
+        result = parse_json.iterparse(good)
+        self.assertFalse(isinstance(result, list))
+        self.assertEqual([{'foo': 'bar'}, {'foo': 'bar'}], list(result))
+        self.assertRaises(TypeError, list, parse_json.iterparse(bad))
+        self.assertRaises(ValueError, list, parse_json.iterparse(empty))
+
+    def test_iterparse_chunks(self):
+        # items (including numbers) that span the chunks are decoded properly
+        data = [{'foo': u'bar \u2603'}, 12345, [1, 2, {'baz': None}], 6.7,
+                'qux', True]
+        raw = StringIO(' \n' + json.dumps(data) + ' ')
+        self.assertEqual(data, list(parse_json.iterparse(raw, chunk_size=3)))
+        # broken json is reported
+        raw = StringIO('[{"foo": "bar"} {"foo": "baz"}]')
+        self.assertRaises(ValueError, list,
+                          parse_json.iterparse(raw, chunk_size=3))
+        raw = StringIO('[{"foo": "bar"}, {"foo": ')
+        self.assertRaises(ValueError, list,
+                          parse_json.iterparse(raw, chunk_size=3))
+
+    def test_iterparse_cut(self):
+        # numbers and strings cut by the end of a chunk (at a ".", "e" and so
+        # on) are decoded whole
+        raw = '[{"a": 1.5}, 12.75, 3]'
+        self.assertEqual(json.loads(raw), list(parse_json.iterparse(
+                         StringIO(raw), chunk_size=8)))
+        raw = ('[1.5, -12.75, 3e10, 2.5E-3, 1e+2, "a\\"b", "\\u2603 1.5",'
+               ' [0.25, "x"], 7]')
+        for chunk_size in range(1, len(raw) + 1):
+            self.assertEqual(json.loads(raw), list(parse_json.iterparse(
+                             StringIO(raw), chunk_size=chunk_size)))
+
+class TestParseJsonLines(unittest.TestCase):
+
+    def test_parse(self):
+        good = open(GOOD_JSONL, 'r')
+        bad = open(BAD_JSONL, 'r')
+        empty = open(EMPTY_JSONL, 'r')
+
+        result = parse_jsonl.parse(good)
+        self.assertTrue(isinstance(result, list))
+        self.assertEqual(3, len(result))
+        self.assertEqual([1, 2, 3], [item['baz'] for item in result])
+        self.assertRaises(ValueError, parse_jsonl.parse, empty)
+        # the error tells us where the problem is
+        try:
+            parse_jsonl.parse(bad)
+        except ValueError, ex:
+            self.assertTrue('line 2 (byte offset 15)' in str(ex))
+        else:
+            self.fail('Bad json lines file parsed')
+        self.assertRaises(TypeError, parse_jsonl.parse,
+                          StringIO('{"foo": "bar"}\n["baz"]\n'))
+
+    def test_split(self):
+        good = open(GOOD_JSONL, 'r')
+        expected = parse_jsonl.parse(good)
+        for chunks in range(1, 10):
+            ranges = parse_jsonl.split(good, chunks)
+            self.assertEqual(chunks, len(ranges))
+            result = list()
+            for start, end in ranges:
+                result.extend(parse_jsonl.iterparse(good, start, end))
+            self.assertEqual(expected, result)
+
 class TestParseCsv(unittest.TestCase):
 
     def test_parse(self):
@@ -61,6 +139,46 @@ class TestParseCsv(unittest.TestCase):
         for item in result:
             self.assertEqual(3, len(item))
 
+    def test_iterparse(self):
+        good = open(GOOD_CSV, 'r')
+        header = open(HEADER_ONLY_CSV, 'r')
+
+        result = parse_csv.iterparse(good)
+        # we get a generator rather than a list
+        self.assertFalse(isinstance(result, list))
+        first = result.next()
+        self.assertTrue(isinstance(first, dict))
+        self.assertEqual(3, len(first))
+        self.assertEqual(2, len(list(result)))
+        # errors are raised as the generator is consumed
+        self.assertRaises(ValueError, list, parse_csv.iterparse(header))
+
+    def test_iterparse_parallel(self):
+        # the same records, in the same order, as the ordinary parser
+        for filename in [GOOD_CSV, BAD_CSV, BLANK_CSV]:
+            expected = parse_csv.parse(open(filename, 'r'))
+            for chunk_size in [1, 10, 1024]:
+                result = parse_csv.iterparse_parallel(filename, processes=2,
+                                                      chunk_size=chunk_size)
+                self.assertEqual(expected, list(result))
+        self.assertRaises(ValueError, list,
+                          parse_csv.iterparse_parallel(HEADER_ONLY_CSV))
+        # newlines and quotes within quoted values don't split the rows
+        rows = ['name,count,note\n']
+        for i in range(100):
+            rows.append('row,%d,"multi\nline, ""quoted"""\n' % (i + 100))
+        temp_file = tempfile.NamedTemporaryFile(suffix='.csv')
+        temp_file.write(''.join(rows))
+        temp_file.flush()
+        expected = parse_csv.parse(open(temp_file.name, 'r'))
+        self.assertEqual(100, len(expected))
+        self.assertEqual('multi\nline, "quoted"', expected[0]['note'])
+        for chunk_size in [1, 50, 1024]:
+            result = parse_csv.iterparse_parallel(temp_file.name, processes=2,
+                                                  chunk_size=chunk_size)
+            self.assertEqual(expected, list(result))
+        temp_file.close()
+
     def test_clean_header(self):
         header = "  THIS IS A TEST   "
         self.assertEqual("this_is_a_test", parse_csv.clean_header(header))
@@ -82,6 +200,38 @@ class TestParseCsv(unittest.TestCase):
         for key, value in test_items.iteritems():
             self.assertTrue(isinstance(parse_csv.clean_row_item(key), value))
 
+    def test_converters(self):
+        # the converters give exactly the same results as clean_row_item
+        items = ["test string", u"test unicode", "1", " 1 ", "1.2", " 1.2 ",
+                 "True", " false ", "", "   ", "+1", "-2.5", ".5", "1e5",
+                 "inf", "NaN", "nice", "Tree", "x1", "99999999999999999999",
+                 u"\u0661", "1 2", "Infinity", "-inf", "FR"]
+        converters = [parse_csv.convert_int, parse_csv.convert_float,
+                      parse_csv.convert_bool, parse_csv.convert_string]
+        for item in items:
+            expected = parse_csv.clean_row_item(item)
+            for convert in converters:
+                result = convert(item)
+                self.assertEqual(type(expected), type(result))
+                if expected == expected: # NaN != NaN
+                    self.assertEqual(expected, result)
+
+    def test_infer_converters(self):
+        rows = [
+            ['1', '1.5', 'True', 'foo', '1', '', 'bar'],
+            ['2', '2', 'false', 'baz', 'qux', '', ''],
+        ]
+        expected = [parse_csv.convert_int, parse_csv.convert_float,
+                    parse_csv.convert_bool, parse_csv.convert_string,
+                    parse_csv.clean_row_item, parse_csv.convert_string,
+                    parse_csv.convert_string]
+        self.assertEqual(expected, parse_csv.infer_converters(rows, 7))
+        # parsing with and without inferring types gives the same result
+        for filename in [GOOD_CSV, BAD_CSV, BLANK_CSV]:
+            expected = parse_csv.parse(open(filename, 'r'), infer_types=False)
+            result = parse_csv.parse(open(filename, 'r'))
+            self.assertEqual(expected, result)
+
 class TestParseYaml(unittest.TestCase):
 
     def test_parse(self):
@@ -92,3 +242,34 @@ class TestParseYaml(unittest.TestCase):
         self.assertTrue(isinstance(parse_yaml.parse(good), list))
         self.assertRaises(TypeError, parse_yaml.parse, bad)
         self.assertRaises(ValueError, parse_yaml.parse, empty)
+
+    def test_iterparse(self):
+        good = open(GOOD_YAML, 'r')
+        bad = open(BAD_YAML, 'r')
+        empty = open(EMPTY_YAML, 'r')
+
+        result = parse_yaml.iterparse(good)
+        self.assertFalse(isinstance(result, list))
+        self.assertEqual([{'foo': 'bar'}, {'foo': 'bar'}], list(result))
+        # a single dictionary is a single record
+        self.assertEqual(1, len(list(parse_yaml.iterparse(bad))))
+        self.assertRaises(ValueError, list, parse_yaml.iterparse(empty))
+        self.assertRaises(TypeError, list,
+                          parse_yaml.iterparse(StringIO('--- 1\n')))
+
+    def test_iterparse_documents(self):
+        raw = ('- {foo: 1}\n- &bar {foo: [2, 3]}\n- *bar\n'
+               '---\nfoo: 4\n'
+               '---\n'
+               '---\n- {foo: 5}\n')
+        expected = [{'foo': 1}, {'foo': [2, 3]}, {'foo': [2, 3]}, {'foo': 4},
+                    {'foo': 5}]
+        self.assertEqual(expected, list(parse_yaml.iterparse(StringIO(raw))))
+        # the pure Python loader gives the same results
+        loader = parse_yaml.StreamLoader
+        parse_yaml.StreamLoader = yaml.Loader
+        try:
+            result = list(parse_yaml.iterparse(StringIO(raw)))
+        finally:
+            parse_yaml.StreamLoader = loader
+        self.assertEqual(expected, result)
@@ -0,0 +1,184 @@
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from fom.session import Fluid
+from fom.mapping import tag_value
+from flimp.delta import DeltaIndex
+from flimp.journal import Journal
+from flimp.pipeline import Pipeline, push_to_fluiddb
+from flimp.utils import create_class
+
+RECORDS = [{'id': i, 'foo': 'value %d' % i, 'bar': {'baz': i % 3 == 0}} for
+           i in range(50)]
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        # no requests are made to FluidDB by these tests
+        Fluid('https://sandbox.fluidinfo.com').bind()
+        self.directory = tempfile.mkdtemp()
+        self.created = {}
+        self.lock = threading.Lock()
+        def create(obj, about=None):
+            if about == 'data:13':
+                raise ValueError('Oops')
+            with self.lock:
+                self.created[about] = obj
+            obj.uid = about
+        self.fom_class = create_class({
+            'test/id': tag_value('test/id'),
+            'test/foo': tag_value('test/foo'),
+            'test/bar/baz': tag_value('test/bar/baz'),
+            'create': create})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_run(self):
+        results = []
+        def check(index, item, local):
+            if item % 7 == 0:
+                raise ValueError(item)
+            return item
+        pipeline = Pipeline()
+        pipeline.add('double', lambda index, item, local: item * 2, 3)
+        pipeline.add('check', check, 2)
+        pipeline.add('collect', lambda index, item, local:
+                     results.append((index, item)))
+        self.assertEqual(20, pipeline.run(xrange(20),
+                                          skip=lambda index: index == 20))
+        # the items that were skipped (19) or failed (0, 7 and 14) aren't
+        # passed on
+        self.assertEqual(3, pipeline.failed)
+        self.assertEqual(16, len(results))
+        self.assertEqual((2, 2), sorted(results)[0])
+        self.assertEqual([20, 19, 19, 16],
+                         [stage.processed for stage in
+                          [pipeline.source] + pipeline.stages])
+        stats = pipeline.stats()
+        self.assertTrue('parse (1 thread)' in stats)
+        self.assertTrue('double (3 threads)' in stats)
+        self.assertTrue('check (2 threads)' in stats and '3 failed' in stats)
+
+    def test_bounded(self):
+        # a slow stage holds up the stages (and source) before it
+        read = []
+        finished = []
+        lag = []
+        def items():
+            for i in range(30):
+                read.append(i)
+                lag.append(len(read) - len(finished))
+                yield i
+        def slow(index, item, local):
+            time.sleep(0.005)
+            finished.append(item)
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add('pass', lambda index, item, local: item)
+        pipeline.add('slow', slow)
+        pipeline.run(items())
+        self.assertEqual(30, len(finished))
+        # at most two waiting for each stage and one being processed by each
+        self.assertTrue(max(lag) <= 7)
+        self.assertTrue(pipeline.stages[1].occupancy() > 0.5)
+        self.assertTrue(pipeline.stages[0].blocked > 0)
+
+    def test_setup_fails(self):
+        results = []
+        lock = threading.Lock()
+        started = []
+        def setup():
+            with lock:
+                started.append(True)
+                if len(started) == 1:
+                    raise ValueError('No session')
+            return 'session'
+        def collect(index, item, local):
+            results.append(local)
+        # the stage's other thread takes over...
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add('collect', collect, 2, setup)
+        self.assertEqual(10, pipeline.run(xrange(10)))
+        self.assertEqual(['session'] * 10, results)
+        self.assertEqual((1, 0), (pipeline.stages[0].broken, pipeline.failed))
+        # ...but if there isn't one the items fail rather than hang
+        del started[:]
+        pipeline = Pipeline(queue_size=2)
+        pipeline.add('pass', lambda index, item, local: item)
+        pipeline.add('collect', collect, 1, setup)
+        self.assertEqual(10, pipeline.run(xrange(10)))
+        self.assertEqual(10, pipeline.failed)
+        self.assertTrue('collect (1 thread)' in pipeline.stats() and
+                        '10 failed' in pipeline.stats())
+
+    def test_prefetch(self):
+        def prefetch(items):
+            for item in items:
+                time.sleep(0.002)
+                yield item
+        pipeline = Pipeline()
+        pipeline.add('pass', lambda index, item, local: item)
+        self.assertEqual(20, pipeline.run(xrange(20), prefetch=prefetch))
+        # the time spent reading ahead isn't counted against the source
+        self.assertTrue(pipeline.prefetcher.busy >= 0.04)
+        self.assertTrue(pipeline.source.busy < 0.01)
+        self.assertEqual(20, pipeline.prefetcher.processed)
+        stats = pipeline.stats().splitlines()
+        self.assertTrue(stats[2].startswith('  prefetch (1 thread): '))
+        self.assertFalse('queue' in stats[2])
+
+    def test_elapsed(self):
+        def items():
+            for i in range(5):
+                time.sleep(0.05)
+                yield i
+        def work(index, item, local):
+            time.sleep(0.02)
+            return item
+        pipeline = Pipeline()
+        pipeline.add('work', work, 2)
+        self.assertEqual(5, pipeline.run(items(), prefetch=iter))
+        # the run takes at least as long as reading the source...
+        self.assertTrue(pipeline.elapsed >= 0.25)
+        self.assertTrue(pipeline.source.busy >= 0.25)
+        # ...and no stage is busy for longer than that
+        for stage in [pipeline.source, pipeline.prefetcher] + pipeline.stages:
+            self.assertTrue(stage.busy / stage.workers <= pipeline.elapsed)
+        for line in pipeline.stats().splitlines()[1:]:
+            busy = int(line.split(': ')[1].split('%')[0])
+            self.assertTrue(busy <= 100, line)
+
+    def test_push_to_fluiddb(self):
+        pipeline = Pipeline()
+        journal = Journal(os.path.join(self.directory, 'journal'), 'abc',
+                          'id')
+        self.assertRaises(RuntimeError, push_to_fluiddb, iter(RECORDS), 'test',
+                          self.fom_class, 'id', 'data', pipeline=pipeline,
+                          transform_workers=2, workers=4, journal=journal)
+        self.assertEqual(49, len(self.created))
+        obj = self.created['data:12']
+        self.assertEqual('value 12', getattr(obj, 'test/foo'))
+        self.assertEqual(True, getattr(obj, 'test/bar/baz'))
+        self.assertEqual(1, pipeline.failed)
+        # only the record that failed is left for the next run
+        self.assertEqual(13, journal.done_through)
+        self.assertEqual(set(range(15, 51)), journal.done_after)
+        journal.close()
+
+    def test_delta(self):
+        index = DeltaIndex(os.path.join(self.directory, 'index'))
+        records = RECORDS[:10]
+        self.assertEqual(10, push_to_fluiddb(records, 'test', self.fom_class,
+                                             'id', 'data', workers=2,
+                                             delta=index))
+        self.created = {}
+        records[4] = dict(records[4], foo='changed')
+        push_to_fluiddb(records, 'test', self.fom_class, 'id', 'data',
+                        workers=2, delta=index)
+        self.assertEqual(['data:4'], self.created.keys())
+        index.close()
+        self.assertEqual(0, push_to_fluiddb([], 'test', self.fom_class, 'id',
+                                            'data'))
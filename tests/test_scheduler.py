@@ -0,0 +1,143 @@
+import time
+import socket
+import threading
+import unittest
+from flimp.transport import Response
+from flimp.scheduler import Scheduler, endpoint
+
+class FakeSession(object):
+    """
+    Answers each request with the next of the given outcomes: a status code or
+    an exception to raise.
+    """
+
+    def __init__(self, outcomes=None, delay=0):
+        self.outcomes = list(outcomes or [])
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+
+    def request(self, method, url, data=None, headers=None):
+        with self.lock:
+            self.requests.append((method, url))
+            self.in_flight += 1
+            self.most_in_flight = max(self.in_flight, self.most_in_flight)
+            outcome = self.outcomes.pop(0) if self.outcomes else 200
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return Response(outcome, {}, '')
+
+class TestScheduler(unittest.TestCase):
+
+    def test_retry(self):
+        session = FakeSession([503, socket.timeout('timed out'), 200])
+        scheduler = Scheduler(session, backoff=0)
+        response = scheduler.request('PUT', 'http://fluiddb/values')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(session.requests))
+        self.assertEqual((3, 2, 0), (scheduler.requests, scheduler.retried,
+                                     scheduler.failed))
+
+    def test_give_up(self):
+        session = FakeSession([500] * 4)
+        scheduler = Scheduler(session, retries=2, backoff=0)
+        response = scheduler.request('GET', 'http://fluiddb/objects')
+        # the last response is handed back (fom raises the error)
+        self.assertEqual(500, response.status_code)
+        self.assertEqual(3, len(session.requests))
+        self.assertEqual(1, scheduler.failed)
+        session = FakeSession([socket.error('reset')] * 4)
+        scheduler = Scheduler(session, retries=1, backoff=0)
+        self.assertRaises(socket.error, scheduler.request, 'GET',
+                          'http://fluiddb/objects')
+        self.assertEqual(2, len(session.requests))
+
+    def test_not_idempotent(self):
+        session = FakeSession([503, 200])
+        scheduler = Scheduler(session, backoff=0)
+        response = scheduler.request('POST', 'http://fluiddb/objects')
+        self.assertEqual(503, response.status_code)
+        self.assertEqual(1, len(session.requests))
+
+    def test_other_errors(self):
+        session = FakeSession([ValueError('bug')])
+        scheduler = Scheduler(session, backoff=0)
+        self.assertRaises(ValueError, scheduler.request, 'GET', 'http://x')
+        self.assertEqual(0, scheduler.in_flight)
+
+    def test_aimd(self):
+        scheduler = Scheduler(FakeSession(), limit=4, min_limit=1,
+                              max_limit=6)
+        # additive increase while all is well
+        for i in range(4):
+            scheduler.request('GET', 'http://x')
+        self.assertTrue(4.9 < scheduler.limit < 5)
+        for i in range(100):
+            scheduler.request('GET', 'http://x')
+        self.assertEqual(6, scheduler.limit)
+        # multiplicative decrease (only once per round of requests)
+        scheduler.session.outcomes = [503, 503]
+        scheduler.retries = 0
+        scheduler.request('GET', 'http://x')
+        scheduler.request('GET', 'http://x')
+        self.assertEqual(3, scheduler.limit)
+        # the limit doesn't drop below min_limit
+        for i in range(5):
+            scheduler.last_decrease = 0
+            scheduler.adjust(0, False)
+        self.assertEqual(1, scheduler.limit)
+
+    def test_latency(self):
+        scheduler = Scheduler(FakeSession(), limit=8, latency_factor=2)
+        with scheduler.condition:
+            scheduler.adjust(0.1, True)
+            self.assertTrue(scheduler.limit > 8)
+            # a single slow response doesn't count as congestion...
+            scheduler.adjust(0.2, True)
+            self.assertTrue(scheduler.limit > 8)
+            # ...but a sustained slow down does
+            for i in range(10):
+                scheduler.adjust(0.5, True)
+        self.assertTrue(scheduler.limit < 8)
+
+    def test_baseline(self):
+        self.assertEqual(('PUT', 'values'),
+                         endpoint('put', 'http://fluiddb/values?query=a'))
+        self.assertEqual(('GET', 'objects'),
+                         endpoint('GET', 'http://fluiddb/objects/1'))
+        scheduler = Scheduler(FakeSession(), limit=8, latency_factor=2)
+        with scheduler.condition:
+            for i in range(10):
+                scheduler.adjust(0.01, True, ('GET', 'namespaces'))
+            # slower kinds of request are compared with their own baseline
+            for i in range(10):
+                scheduler.adjust(0.5, True, ('PUT', 'values'))
+            self.assertTrue(scheduler.limit > 8)
+            # a sustained slow down is congestion...
+            for i in range(10):
+                scheduler.adjust(2.0, True, ('PUT', 'values'))
+            self.assertTrue(scheduler.limit < 8)
+            limit = scheduler.limit
+            # ...until the baseline has aged to the new normal
+            for i in range(200):
+                scheduler.adjust(2.0, True, ('PUT', 'values'))
+            self.assertTrue(scheduler.limit > limit)
+
+    def test_limit(self):
+        session = FakeSession(delay=0.02)
+        scheduler = Scheduler(session, limit=3, max_limit=3)
+        threads = [threading.Thread(target=scheduler.request,
+                                    args=('GET', 'http://x')) for i in
+                   range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(12, len(session.requests))
+        self.assertEqual(3, session.most_in_flight)
+        self.assertEqual(0, scheduler.in_flight)
@@ -0,0 +1,143 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+from fom.session import Fluid
+from fom.mapping import Namespace
+from flimp import utils
+from flimp.cache import SchemaCache
+from flimp.scheduler import Scheduler
+from flimp.schema import plan, build_schema, Node
+from flimp.transport import Response
+
+HEADERS = {'content-type': 'application/json'}
+
+TEMPLATE = {
+    'foo': 'a',
+    'bar': {
+        'baz': 1,
+        'qux': {
+            'quux': [1, 2]
+        }
+    },
+    'corge': {}
+}
+
+class FakeTree(object):
+    """
+    A session that pretends to be FluidDB's /namespaces and /tags API for the
+    given namespaces and tags (errors come without content, or a content type,
+    as they do from FluidDB).
+    """
+
+    def __init__(self, namespaces, tags):
+        self.namespaces = set(namespaces)
+        self.tags = set(tags)
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def request(self, method, url, data=None, headers=None):
+        kind, path = url.split('?')[0].split('/', 3)[3].split('/', 1)
+        with self.lock:
+            self.requests.append((method, kind, path))
+            if path not in self.namespaces:
+                return Response(404, {}, '')
+            if method == 'GET':
+                listing = {
+                    'namespaceNames': [p.rsplit('/', 1)[1] for p in
+                        self.namespaces if p.rsplit('/', 1)[0] == path],
+                    'tagNames': [p.rsplit('/', 1)[1] for p in
+                        self.tags if p.rsplit('/', 1)[0] == path]}
+                return Response(200, HEADERS, json.dumps(listing))
+            paths = getattr(self, kind)
+            new_path = path + '/' + json.loads(data)['name']
+            if new_path in paths:
+                return Response(412, {}, '')
+            paths.add(new_path)
+            return Response(201, HEADERS, '{}')
+
+class TestSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.fluid = Fluid('https://sandbox.fluidinfo.com')
+        self.fluid.bind()
+        utils._resolved.clear()
+        self.tree = FakeTree(['test', 'test/data', 'test/data/bar'],
+                             ['test/data/foo', 'test/data/bar/baz'])
+        # shared by the workers' sessions
+        self.fluid.db.session = Scheduler(self.tree)
+
+    def tearDown(self):
+        SchemaCache.bound = None
+
+    def test_plan(self):
+        levels, tags = plan(TEMPLATE, 'test/data')
+        self.assertEqual([[Node('test/data', ['bar', 'corge'], ['foo'])],
+                          [Node('test/data/bar', ['qux'], ['baz']),
+                           Node('test/data/corge', [], [])],
+                          [Node('test/data/bar/qux', [], ['quux'])]],
+                         [sorted(Node(n.path, sorted(n.namespaces), n.tags)
+                                 for n in level) for level in levels])
+        self.assertEqual(set(['test/data/foo', 'test/data/bar/baz',
+                              'test/data/bar/qux/quux']), set(tags))
+        self.assertEqual('application/json',
+                         tags['test/data/bar/qux/quux'].content_type)
+        self.assertFalse(tags['test/data/foo'].lazy_save)
+
+    def test_build_schema(self):
+        tags = build_schema(TEMPLATE, 'test/data', 'data', 'desc')
+        self.assertEqual(3, len(tags))
+        self.assertTrue(set(['test/data/corge', 'test/data/bar/qux']) <=
+                        self.tree.namespaces)
+        self.assertTrue('test/data/bar/qux/quux' in self.tree.tags)
+        # only the existing namespaces are read and only what's missing is
+        # created
+        self.assertEqual([('GET', 'namespaces', 'test/data'),
+                          ('GET', 'namespaces', 'test/data/bar'),
+                          ('POST', 'namespaces', 'test/data'),
+                          ('POST', 'namespaces', 'test/data/bar'),
+                          ('POST', 'tags', 'test/data/bar/qux')],
+                         sorted(self.tree.requests))
+        # the second time round there's nothing to create
+        self.tree.requests = []
+        build_schema(TEMPLATE, 'test/data', 'data', 'desc')
+        self.assertEqual(['GET'] * 4,
+                         [method for method, kind, path in self.tree.requests])
+
+    def test_generate(self):
+        tags = {}
+        utils.generate(Namespace('test'), 'other', TEMPLATE, 'desc', 'data',
+                       tags)
+        self.assertEqual(set(['test/other/foo', 'test/other/bar/baz',
+                              'test/other/bar/qux/quux']), set(tags))
+        self.assertTrue('test/other/bar/qux' in self.tree.namespaces)
+        self.assertTrue('test/other/bar/qux/quux' in self.tree.tags)
+
+    def test_workers(self):
+        # the schema is built with the number of workers given for the import
+        build_schema = utils.build_schema
+        calls = []
+        def record(template, root_path, name, desc, workers):
+            calls.append(workers)
+            return build_schema(template, root_path, name, desc, workers)
+        utils.build_schema = record
+        try:
+            utils.prepare_import([{'foo': 1}], 'test/data', 'data', 'desc', 3)
+        finally:
+            utils.build_schema = build_schema
+        self.assertEqual([3], calls)
+
+    def test_cached(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cache = SchemaCache(os.path.join(directory, 'cache'),
+                                'http://fluiddb', 'test')
+            cache.bind()
+            build_schema(TEMPLATE, 'test/data', 'data', 'desc')
+            self.tree.requests = []
+            build_schema(TEMPLATE, 'test/data', 'data', 'desc')
+            self.assertEqual([], self.tree.requests)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,149 @@
+import json
+import threading
+import unittest
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from fom.session import Fluid
+from flimp.transport import ConnectionPool, Response, Headers, install
+from flimp.workers import clone_session
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Answers every request with a small JSON document (using HTTP/1.1 so the
+    connection is kept alive unless the path ends with "close").
+
+    PUT and POST requests are recorded. They are answered as FluidDB answers
+    them: with a 204 that has no content (or content type) or, if the path
+    ends with "drop", by closing the connection without a response.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    received = []
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.received.append((self.command, self.path))
+        if self.path.endswith('drop'):
+            self.close_connection = 1
+            return
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_POST = do_PUT
+
+    def do_GET(self):
+        body = json.dumps({'path': self.path,
+                           'auth': self.headers.get('Authorization')})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.path.endswith('close'):
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class TestTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       args=(0.05, ))
+        self.thread.daemon = True
+        self.thread.start()
+        self.fdb = Fluid('http://127.0.0.1:%d' % self.server.server_port)
+        self.fdb.login('test', 'test')
+        Handler.received = []
+
+    def tearDown(self):
+        if isinstance(self.fdb.db.session, ConnectionPool):
+            self.fdb.db.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuse(self):
+        pool = install(self.fdb, 2)
+        self.assertTrue(self.fdb.db.session is pool)
+        for i in range(5):
+            response = self.fdb.db('GET', ['users', 'test%d' % i])
+            self.assertEqual('/users/test%d' % i, response.value['path'])
+            self.assertEqual(self.fdb.db.headers['Authorization'],
+                             response.value['auth'])
+        self.assertEqual((1, 4, 0), (pool.opened, pool.reused, pool.closed))
+        pool.close()
+        self.assertEqual(1, pool.closed)
+        self.assertEqual('Connections: 1 opened, 4 reused, 1 closed',
+                         pool.stats())
+
+    def test_query_string(self):
+        pool = install(self.fdb)
+        response = self.fdb.db('GET', ['values'], urlargs=(('query', 'a = 1'),
+                               ('tag', 'test/foo')))
+        self.assertEqual('/values?query=a+%3D+1&tag=test%2Ffoo',
+                         response.value['path'])
+
+    def test_server_closes(self):
+        pool = install(self.fdb)
+        self.fdb.db('GET', ['close'])
+        self.fdb.db('GET', ['close'])
+        self.assertEqual((2, 0, 2), (pool.opened, pool.reused, pool.closed))
+
+    def test_stale_connection(self):
+        pool = install(self.fdb)
+        self.fdb.db('GET', ['users', 'test'])
+        # the connection goes away while it is idle
+        pool.idle.queue[0].sock.close()
+        response = self.fdb.db('GET', ['users', 'test'])
+        self.assertEqual('/users/test', response.value['path'])
+        self.assertEqual((2, 1, 1), (pool.opened, pool.reused, pool.closed))
+
+    def test_no_content(self):
+        install(self.fdb)
+        response = self.fdb.db('PUT', ['objects', 'a', 'test', 'foo'], 1)
+        self.assertEqual(204, response.status)
+        self.assertEqual(None, response.content_type)
+        self.assertEqual([('PUT', '/objects/a/test/foo')], Handler.received)
+
+    def test_lost_response(self):
+        pool = install(self.fdb)
+        # the server acts on the POST but the response never arrives so it
+        # must not be sent again
+        self.fdb.db('GET', ['users', 'test'])
+        self.assertRaises(Exception, self.fdb.db, 'POST', ['objects', 'drop'],
+                          {})
+        self.assertEqual([('POST', '/objects/drop')], Handler.received)
+        # a PUT is idempotent so it is tried again with a new connection
+        Handler.received = []
+        self.fdb.db('GET', ['users', 'test'])
+        self.assertRaises(Exception, self.fdb.db, 'PUT',
+                          ['objects', 'a', 'drop'], 1)
+        self.assertEqual([('PUT', '/objects/a/drop')] * 2, Handler.received)
+
+    def test_shared_with_workers(self):
+        pool = install(self.fdb)
+        self.assertTrue(clone_session(self.fdb).db.session is pool)
+
+    def test_bad_pool(self):
+        self.assertRaises(ValueError, ConnectionPool, 'ftp://example.com')
+        self.assertRaises(ValueError, ConnectionPool, 'http://example.com', 0)
+
+    def test_response_text(self):
+        response = Response(200, {'content-type': 'text/plain; charset=latin-1'},
+                            '\xe9')
+        self.assertEqual(u'\xe9', response.text)
+        response = Response(200, {}, '\xc3\xa9')
+        self.assertEqual(u'\xe9', response.text)
+
+    def test_headers(self):
+        headers = Headers([('Content-Type', 'application/json')])
+        self.assertEqual('application/json', headers['content-type'])
+        self.assertEqual('application/json', headers['CONTENT-TYPE'])
+        self.assertTrue('Content-type' in headers)
+        self.assertEqual(None, headers['x-fluiddb-error-class'])
+        self.assertEqual('', headers.get('x-fluiddb-error-class', ''))
@@ -2,11 +2,15 @@ import unittest
 import uuid
 
 from fom.session import Fluid
-from fom.mapping import Namespace, Object
+from fom.mapping import Namespace, Object, tag_value
 from flimp.utils import (create_schema, generate, create_class,
                          push_to_fluiddb, get_values, validate,
                          make_namespace, make_tag, make_namespace_path,
-                         set_tag_value, process_data_list)
+                         set_tag_value, process_data_list, peek,
+                         set_tag_values, split_values, is_primitive,
+                         compile_plan)
+from flimp import utils
+from tests.test_schema import FakeTree
 
 # good data structure
 TEMPLATE = [
@@ -190,6 +194,29 @@ class TestUtils(unittest.TestCase):
         self.assertTrue("Field 'quux' in record" in  extras[0])
         self.assertEqual(1, len(missing))
         self.assertTrue("Field 'baz' in record" in missing[0])
+        # iterators are validated as they're consumed
+        missing, extras = validate(iter(data))
+        self.assertEqual(1, len(extras))
+        self.assertEqual(1, len(missing))
+        # the number of records with problems can be counted too
+        records = [{'foo': 1}, {'foo': 2}, {'bar': 3}, {'foo': 4, 'bar': 5}]
+        missing, extras, problems = validate(records, True)
+        self.assertEqual(1, len(missing))
+        self.assertEqual(2, len(extras))
+        self.assertEqual(2, problems)
+
+    def test_peek(self):
+        data = [{'foo': 'a'}, {'foo': 'b'}]
+        # works with lists
+        first, records = peek(data)
+        self.assertEqual(data[0], first)
+        self.assertEqual(data, list(records))
+        # and iterators
+        first, records = peek(iter(data))
+        self.assertEqual(data[0], first)
+        self.assertEqual(data, list(records))
+        # but not if there's nothing to peek at
+        self.assertRaises(ValueError, peek, [])
 
     def test_create_schema(self):
         tags = create_schema(TEMPLATE, 'test/this/is/a/test', 'flimp-test',
@@ -325,3 +352,105 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(item['quux'], result['test/flimp/test/quux'])
         self.assertEqual(item['corge'], result['test/flimp/test/corge'])
 
+    def test_split_values(self):
+        fom_class = create_class({
+            'test/foo': tag_value('test/foo'),
+            'test/baz/qux': tag_value('test/baz/qux'),
+            'test/quux': tag_value('test/quux'),
+            'test/corge': tag_value('test/corge', 'application/json'),
+            'test/empty': tag_value('test/empty')})
+        tag_values = get_values(TEMPLATE[0], 'test')
+        tag_values['test/empty'] = None
+        tag_values['test/unknown'] = 'ignored'
+        values, others = split_values(fom_class, tag_values, True)
+        self.assertEqual({'test/foo': {'value': 'bar'},
+                          'test/baz/qux': {'value': '1'},
+                          'test/quux': {'value': ['ham', 'eggs']},
+                          'test/empty': {'value': None}}, values)
+        # JSON values have to be set one at a time
+        self.assertEqual({'test/corge': [{'a': 1, 'b': 2}]}, others)
+        # Empty values are *not* allowed
+        values, others = split_values(fom_class, tag_values, False)
+        self.assertFalse('test/empty' in values)
+        self.assertEqual(3, len(values))
+
+    def test_compile_plan(self):
+        fom_class = create_class({
+            'test/foo': tag_value('test/foo'),
+            'test/baz/qux': tag_value('test/baz/qux'),
+            'test/quux': tag_value('test/quux'),
+            'test/corge': tag_value('test/corge', 'application/json')})
+        plan = compile_plan(fom_class, 'test')
+        self.assertEqual([('baz', 'qux'), ('corge', ), ('foo', ), ('quux', )],
+                         [step.keys for step in plan.steps])
+        # the same as walking the record
+        tag_values = plan.values(TEMPLATE[0])
+        self.assertEqual(get_values(TEMPLATE[0], 'test'), tag_values)
+        self.assertEqual(split_values(fom_class, tag_values, True),
+                         plan.split(tag_values, True))
+        # values that are missing, or aren't where the template said they'd
+        # be, are left out
+        self.assertEqual({'test/foo': None},
+                         plan.values({'foo': None, 'baz': 'qux',
+                                      'quux': {'a': 1}, 'other': 1}))
+        values, others = plan.split({'test/foo': None}, False)
+        self.assertEqual(({}, {}), (values, others))
+
+    def test_set_tag_values(self):
+        requests = []
+        class FakeValues(object):
+            def put(self, query, values):
+                requests.append((query, values))
+        fom_class = create_class({'test/foo': tag_value('test/foo'),
+                                  'test/bar': tag_value('test/bar')})
+        obj = fom_class(uid='1234')
+        obj.fluid = type('FakeFluid', (object, ), {'values': FakeValues()})()
+        set_tag_values(fom_class, obj, {'test/foo': 1, 'test/bar': 'a'}, True)
+        # a single request
+        self.assertEqual([('fluiddb/id = "1234"', {'test/foo': {'value': 1},
+                                                   'test/bar': {'value': 'a'}})],
+                         requests)
+
+    def test_is_primitive(self):
+        for value in [None, True, 1, 1L, 1.5, 'a', u'b', ['a', u'b'], ()]:
+            self.assertTrue(is_primitive(value))
+        for value in [{}, [1, 2], ['a', None], object()]:
+            self.assertFalse(is_primitive(value))
+
+class TestMakeNamespacePath(unittest.TestCase):
+
+    def setUp(self):
+        self.fluid = Fluid('https://sandbox.fluidinfo.com')
+        self.fluid.bind()
+        self.tree = FakeTree(['test', 'test/a', 'test/a/b', 'test/a/b/c'], [])
+        self.fluid.db.session = self.tree
+        utils._resolved.clear()
+
+    def test_existing(self):
+        ns = make_namespace_path('test/a/b/c', 'data', 'desc')
+        self.assertEqual('test/a/b/c', ns.path)
+        self.assertEqual([('GET', 'namespaces', 'test/a/b/c')],
+                         self.tree.requests)
+        # the path (and its prefixes) are resolved for the rest of the process
+        self.tree.requests = []
+        make_namespace_path('test/a/b', 'data', 'desc')
+        make_namespace('test/a/b/c', 'data', 'desc')
+        self.assertEqual([], self.tree.requests)
+
+    def test_missing(self):
+        ns = make_namespace_path('test/a/b/c/d/e/f', 'data', 'desc')
+        self.assertEqual('test/a/b/c/d/e/f', ns.path)
+        self.assertTrue('test/a/b/c/d/e/f' in self.tree.namespaces)
+        # bisected to find test/a/b/c and only created the rest
+        self.assertEqual([('GET', 'namespaces', 'test/a/b/c/d/e/f'),
+                          ('GET', 'namespaces', 'test/a/b/c'),
+                          ('GET', 'namespaces', 'test/a/b/c/d'),
+                          ('POST', 'namespaces', 'test/a/b/c'),
+                          ('POST', 'namespaces', 'test/a/b/c/d'),
+                          ('POST', 'namespaces', 'test/a/b/c/d/e')],
+                         self.tree.requests)
+        # the root namespace is never checked
+        self.tree.requests = []
+        self.assertEqual('test', make_namespace_path('test', 'data',
+                                                     'desc').path)
+        self.assertEqual([], self.tree.requests)
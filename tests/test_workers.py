@@ -0,0 +1,79 @@
+import time
+import threading
+import unittest
+from fom.session import Fluid
+from flimp.workers import clone_session, push_records
+
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        # no requests are made to FluidDB by these tests
+        self.fdb = Fluid('https://sandbox.fluidinfo.com')
+        self.fdb.login('test', 'test')
+
+    def test_clone_session(self):
+        session = clone_session(self.fdb)
+        self.assertFalse(session is self.fdb)
+        self.assertFalse(session.db.session is self.fdb.db.session)
+        self.assertEqual(self.fdb.db.base_url, session.db.base_url)
+        self.assertEqual(self.fdb.db.headers['Authorization'],
+                         session.db.headers['Authorization'])
+
+    def test_push_records(self):
+        sessions = set()
+        lock = threading.Lock()
+        def push(record, session):
+            with lock:
+                sessions.add(session)
+            time.sleep(0.01)
+            return record * 2
+        results = list(push_records(push, iter(range(20)), 4,
+                                    fluid=self.fdb))
+        self.assertEqual(20, len(results))
+        self.assertEqual(range(1, 21), sorted(r.index for r in results))
+        for result in results:
+            self.assertEqual((result.index - 1) * 2, result.value)
+            self.assertEqual(None, result.error)
+        # each worker has its own session (not the one we passed in)
+        self.assertTrue(1 < len(sessions) <= 4)
+        self.assertFalse(self.fdb in sessions)
+
+    def test_push_records_errors(self):
+        def push(record, session):
+            if record % 3 == 0:
+                raise ValueError(record)
+            return record
+        results = sorted(push_records(push, range(10), 3, fluid=self.fdb))
+        self.assertEqual(10, len(results))
+        failed = [r for r in results if r.error]
+        self.assertEqual([1, 4, 7, 10], [r.index for r in failed])
+        self.assertTrue(isinstance(failed[0].error, ValueError))
+
+    def test_push_records_bounded(self):
+        # the records are only consumed as fast as the workers can keep up
+        consumed = []
+        def records():
+            for i in range(10):
+                consumed.append(i)
+                yield i
+        started = threading.Event()
+        release = threading.Event()
+        def push(record, session):
+            started.set()
+            release.wait()
+            return record
+        results = push_records(push, records(), 2, queue_size=2,
+                               fluid=self.fdb)
+        thread = threading.Thread(target=list, args=(results,))
+        thread.start()
+        started.wait()
+        time.sleep(0.1)
+        # 2 being worked on, 2 waiting and 1 blocked trying to join the queue
+        self.assertTrue(len(consumed) <= 5)
+        release.set()
+        thread.join()
+        self.assertEqual(10, len(consumed))
+
+    def test_no_workers(self):
+        self.assertRaises(ValueError, list,
+                          push_records(lambda r, s: r, [1], 0, fluid=self.fdb))
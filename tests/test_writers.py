@@ -0,0 +1,107 @@
+import time
+import unittest
+from fom.mapping import tag_value
+from flimp.utils import create_class
+from flimp.writers import BatchWriter, about_query, id_query
+
+class FakeFluid(object):
+    """
+    Records the requests made to the /values endpoint (rather than sending
+    them to FluidDB). Any batch containing a query for a bad about value
+    fails.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def values(self, method, payload):
+        queries = payload['queries']
+        self.requests.append(queries)
+        for query, values in queries:
+            if 'bad' in query:
+                raise ValueError('Bad query %r' % query)
+
+RECORDS = [{'id': i, 'foo': 'value %d' % i, 'bar': {'baz': i}} for i in
+           range(10)]
+
+class TestWriters(unittest.TestCase):
+
+    def setUp(self):
+        self.tags = {
+            'test/id': tag_value('test/id'),
+            'test/foo': tag_value('test/foo'),
+            'test/bar/baz': tag_value('test/bar/baz')}
+        self.fom_class = create_class(self.tags)
+        self.fluid = FakeFluid()
+
+    def test_queries(self):
+        self.assertEqual('fluiddb/about = "data:1"', about_query('data:1'))
+        self.assertEqual('fluiddb/about = "say \\"hi\\" \\\\o/"',
+                         about_query('say "hi" \\o/'))
+        self.assertEqual('fluiddb/id = "1234"', id_query('1234'))
+
+    def test_batches(self):
+        writer = BatchWriter(self.fom_class, 'test', 'id', 'data',
+                             batch_size=4, fluid=self.fluid)
+        for item in RECORDS:
+            writer.add(item)
+        # the last (partial) batch hasn't been sent yet
+        self.assertEqual(2, len(self.fluid.requests))
+        writer.flush()
+        self.assertEqual(3, len(self.fluid.requests))
+        self.assertEqual(3, writer.requests)
+        self.assertEqual(10, writer.records)
+        self.assertEqual([4, 4, 2], [len(r) for r in self.fluid.requests])
+        query, values = self.fluid.requests[0][1]
+        self.assertEqual('fluiddb/about = "data:1"', query)
+        self.assertEqual({'test/id': {'value': 1},
+                          'test/foo': {'value': 'value 1'},
+                          'test/bar/baz': {'value': 1}}, values)
+        self.assertEqual([], writer.failed)
+
+    def test_split_failed_batches(self):
+        records = list(RECORDS)
+        records[5] = {'id': 'bad', 'foo': 'oops', 'bar': {'baz': 0}}
+        writer = BatchWriter(self.fom_class, 'test', 'id', 'data',
+                             batch_size=8, fluid=self.fluid)
+        for item in records:
+            writer.add(item)
+        writer.flush()
+        # only the bad record failed
+        self.assertEqual([6], [index for index, error in writer.failed])
+        # 8 -> 4 + 4 -> 4 + 2 + 2 -> 4 + 2 + 1 + 1 and then the last batch
+        self.assertEqual(8, writer.requests)
+        written = set()
+        for queries in self.fluid.requests:
+            if not [q for q, v in queries if 'bad' in q]:
+                written.update(q for q, v in queries)
+        self.assertEqual(9, len(written))
+
+    def test_flush_interval(self):
+        writer = BatchWriter(self.fom_class, 'test', 'id', 'data',
+                             batch_size=100, flush_interval=0.05,
+                             fluid=self.fluid)
+        writer.add(RECORDS[0])
+        self.assertEqual(0, len(self.fluid.requests))
+        time.sleep(0.06)
+        writer.add(RECORDS[1])
+        self.assertEqual(1, len(self.fluid.requests))
+        self.assertEqual(2, len(self.fluid.requests[0]))
+
+    def test_anonymous(self):
+        def create(obj, about=None):
+            obj.uid = '1234'
+        self.tags['create'] = create
+        Klass = create_class(self.tags)
+        writer = BatchWriter(Klass, 'test', None, 'data', batch_size=4,
+                             fluid=self.fluid)
+        writer.add(RECORDS[0])
+        writer.flush()
+        # one request to create the object and one to tag it
+        self.assertEqual(2, writer.requests)
+        self.assertEqual('fluiddb/id = "1234"',
+                         self.fluid.requests[0][0][0])
+
+    def test_bad_batch_size(self):
+        self.assertRaises(ValueError, BatchWriter, self.fom_class, 'test',
+                          'id', 'data', batch_size=0, fluid=self.fluid)